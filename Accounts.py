@@ -0,0 +1,132 @@
+import time
+import threading
+
+import Metrics
+
+## Capabilities the bot asks for, if the server has them.
+WANTED_CAPS = ("account-tag", "extended-join", "account-notify", "multi-prefix", "batch")
+
+TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+def unescapeTag(value):
+    if "\\" not in value:
+        return value
+    out = []
+    chars = iter(value)
+    for char in chars:
+        if "\\" == char:
+            char = TAG_ESCAPES.get(next(chars, ""), "")
+        out.append(char)
+    return "".join(out)
+
+def splitTags(line):
+    """ (tags, line without them) for an IRCv3 line starting "@key=value;key ...". """
+    if not line.startswith("@"):
+        return {}, line
+    rawTags, _, line = line[1:].partition(" ")
+    tags = {}
+    for tag in rawTags.split(";"):
+        key, _, value = tag.partition("=")
+        tags[key] = unescapeTag(value)
+    return tags, line.lstrip(" ")
+
+
+class AccountCache(object):
+    """ Which services account each nick is logged in to.
+
+    With account-tag, extended-join and account-notify the server says so in the traffic
+    the bot gets anyway, and keeps saying so when it changes, so what's learned that way holds
+    until the nick quits or changes. Without them, accounts come from WHOIS, asked once per nick
+    and trusted for ttl seconds.
+    """
+    def __init__(self, fold=str.lower, ttl=300.0, timeout=5.0):
+        self.fold = fold
+        self.ttl = ttl
+        self.timeout = timeout
+        ## folded nick -> (account, or None if logged out; when it was learned, or None if the server keeps it current)
+        self.accounts = {}
+        ## folded nick -> (Event, when it was sent) for a WHOIS that hasn't finished
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.metrics = Metrics.registry
+
+    def learn(self, nick, account, current=True):
+        """ nick is logged in to account ("*", "0" or None for nobody). current: the server will say if it changes. """
+        if account in ("*", "0", ""):
+            account = None
+        with self.lock:
+            self.accounts[self.fold(nick)] = (account, None if current else time.time())
+
+    def clear(self):
+        """ Forget everyone, as after a reconnect, and stop anyone waiting on a WHOIS that won't come. """
+        with self.lock:
+            self.accounts.clear()
+            pending = self.pending.values()
+            self.pending = {}
+        for event, asked in pending:
+            event.set()
+
+    def forget(self, nick):
+        with self.lock:
+            self.accounts.pop(self.fold(nick), None)
+
+    def rename(self, oldNick, newNick):
+        with self.lock:
+            known = self.accounts.pop(self.fold(oldNick), None)
+            if known:
+                self.accounts[self.fold(newNick)] = known
+
+    def get(self, nick):
+        """ (True, account) if nick's account is known and still fresh, (False, None) if not. """
+        with self.lock:
+            known = self.accounts.get(self.fold(nick))
+        if known and (known[1] is None or time.time() - known[1] < self.ttl):
+            self.metrics.cacheResult("accounts", True)
+            return True, known[0]
+        self.metrics.cacheResult("accounts", False)
+        return False, None
+
+    def lookup(self, nick, sendWhois):
+        """ nick's account, asking the server with sendWhois(nick) only if it isn't known.
+
+        Several threads asking about the same nick share one WHOIS. Gives None if the
+        server doesn't answer in time.
+        """
+        known, account = self.get(nick)
+        if known:
+            return account
+        key = self.fold(nick)
+        with self.lock:
+            asking = key not in self.pending
+            if asking:
+                self.pending[key] = (threading.Event(), time.time())
+            event = self.pending[key][0]
+        if asking:
+            self.metrics.inc("whois_sent_total")
+            sendWhois(nick)
+        if not event.wait(self.timeout):
+            ## No answer; let the next lookup ask again.
+            with self.lock:
+                if self.pending.get(key, (None,))[0] is event:
+                    del self.pending[key]
+
+        return self.get(nick)[1]
+
+    def whoisAccount(self, nick, account):
+        """ A WHOIS said nick is logged in to account (330). """
+        self.learn(nick, account, current=False)
+
+    def whoisEnd(self, nick):
+        """ A WHOIS finished (318). No 330 before it means nick isn't logged in. """
+        key = self.fold(nick)
+        with self.lock:
+            event, asked = self.pending.pop(key, (None, 0))
+            known = self.accounts.get(key)
+            if not known or known[1] is not None and known[1] < asked:
+                self.accounts[key] = (None, time.time())
+        if event:
+            event.set()
+
+
+Metrics.registry.describe("whois_sent_total", "WHOIS requests sent because a nick's account wasn't known.")
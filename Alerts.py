@@ -0,0 +1,176 @@
+import os.path
+import json
+import time
+import Queue
+import urllib2
+import logging
+import threading
+
+import Metrics
+
+alertDir = os.path.join(os.path.dirname(__file__), "log")
+
+## Different messages quoted in a digest; the rest are only counted.
+MAX_SAMPLES = 3
+
+
+class Digest(object):
+    """ Every mention of one keyword in one channel within a window. """
+    def __init__(self, keyword, channel, when):
+        self.keyword = keyword
+        self.channel = channel
+        self.first = when
+        self.last = when
+        self.count = 0
+        self.nicks = []
+        self.samples = []
+        self.seen = set()
+
+    def add(self, nick, msg, when):
+        self.count += 1
+        self.last = when
+        if nick not in self.nicks:
+            self.nicks.append(nick)
+        ## The same thing said again (by the same person) is counted, not repeated.
+        if (nick.lower(), msg) not in self.seen:
+            self.seen.add((nick.lower(), msg))
+            self.samples.append((nick, msg))
+
+    def text(self):
+        if 1 == len(self.samples):
+            nick, msg = self.samples[0]
+            times = " x{n}".format(n=self.count) if 1 < self.count else ""
+            return "({chan})<{nick}> {msg} [{kw} mentioned{t}]".format(chan=self.channel, nick=nick, msg=msg, kw=self.keyword, t=times)
+        quoted = " | ".join("<{nick}> {msg}".format(nick=nick, msg=msg) for nick, msg in self.samples[:MAX_SAMPLES])
+        more = len(self.samples) - MAX_SAMPLES
+        return "({chan}) [{kw} mentioned {n} times by {nicks} in {s:.0f}s] {quoted}{more}".format(chan=self.channel, kw=self.keyword, n=self.count,
+                                                                                                  nicks=", ".join(self.nicks), s=self.last - self.first,
+                                                                                                  quoted=quoted,
+                                                                                                  more=" (+{m} more)".format(m=more) if 0 < more else "")
+
+    def record(self):
+        return {"keyword": self.keyword, "channel": self.channel, "count": self.count, "nicks": self.nicks,
+                "first": self.first, "last": self.last, "samples": [{"nick": n, "msg": m} for n, m in self.samples]}
+
+
+class NoticeSink(object):
+    """ Digests NOTICEd to someone, by a function like GreetBot.say. """
+    name = "notice"
+
+    def __init__(self, notice):
+        self.notice = notice
+
+    def send(self, digests):
+        for digest in digests:
+            self.notice(digest.text())
+
+
+class FileSink(object):
+    """ Digests appended to a file, one line each. """
+    name = "file"
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, digests):
+        with open(self.path, "a") as fileHandler:
+            for digest in digests:
+                fileHandler.write("{t} {text}\n".format(t=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(digest.last)),
+                                                         text=digest.text()))
+
+
+class WebhookSink(object):
+    """ Digests POSTed as JSON to a webhook, all of one delivery in one request. """
+    name = "webhook"
+
+    def __init__(self, url, timeout=5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, digests):
+        body = json.dumps({"alerts": [digest.record() for digest in digests]})
+        request = urllib2.Request(self.url, body, {"Content-Type": "application/json"})
+        urllib2.urlopen(request, timeout=self.timeout).close()
+
+
+class AlertQueue(object):
+    """ Keyword mentions on their way to the sinks.
+
+    put() only queues a mention, so whoever noticed it gets straight back to what it was doing.
+    One thread takes mentions off the queue and gathers them, per keyword and channel, into a digest
+    that's delivered window seconds after its first mention. A burst is one digest, not a message per hit.
+    A sink that fails or hangs holds up only the alerts.
+    """
+    def __init__(self, sinks, window=10.0, fold=str.lower, size=10000):
+        self.sinks = sinks
+        self.window = window
+        self.fold = fold
+        self.queue = Queue.Queue(size)
+        ## (keyword, folded channel) -> Digest, until its window is up
+        self.open = {}
+        self.thread = None
+        self.lock = threading.Lock()
+        self.metrics = Metrics.registry
+        self.logger = logging.getLogger(type(self).__name__)
+
+    def put(self, keyword, channel, nick, msg):
+        try:
+            self.queue.put_nowait((keyword, channel, nick, msg, time.time()))
+        except Queue.Full:
+            self.metrics.inc("alerts_dropped_total")
+            return
+        self.metrics.inc("alerts_total")
+        with self.lock:
+            if not self.thread:
+                self.thread = threading.Thread(target=self.run, name=type(self).__name__)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def run(self):
+        while True:
+            due = min(d.first for d in self.open.values()) + self.window if self.open else None
+            try:
+                keyword, channel, nick, msg, when = self.queue.get(timeout=max(0, due - time.time()) if due else None)
+            except Queue.Empty:
+                pass
+            else:
+                key = (keyword, self.fold(channel))
+                if key not in self.open:
+                    self.open[key] = Digest(keyword, channel, when)
+                self.open[key].add(nick, msg, when)
+            self.deliver([key for key, digest in self.open.items() if digest.first + self.window <= time.time()])
+
+    def deliver(self, keys):
+        digests = sorted((self.open.pop(key) for key in keys), key=lambda d: d.first)
+        if not digests:
+            return
+        for sink in self.sinks:
+            try:
+                with self.metrics.timer("alert_delivery_seconds", sink=sink.name):
+                    sink.send(digests)
+                self.metrics.inc("alert_digests_total", len(digests), sink=sink.name)
+            except Exception as ex:
+                self.metrics.inc("alert_sink_failures_total", sink=sink.name)
+                self.logger.warning("Couldn't deliver alerts to {s}: {e}".format(s=sink.name, e=ex))
+
+
+def makeSinks(options, notice):
+    """ The sinks named in the [Alerts] section of Settings.ini. notice(text) NOTICEs the owner. """
+    sinks = []
+    for name in [s.strip() for s in options.get("sinks", "notice").split(",") if s.strip()]:
+        if "notice" == name:
+            sinks.append(NoticeSink(notice))
+        elif "file" == name:
+            sinks.append(FileSink(os.path.join(alertDir, options.get("file", "Alerts.log"))))
+        elif "webhook" == name and options.get("webhook"):
+            sinks.append(WebhookSink(options["webhook"], float(options.get("webhooktimeout", 5.0))))
+        else:
+            logging.getLogger("AlertQueue").warning("Unknown or unconfigured alert sink: {s}".format(s=name))
+    return sinks
+
+
+Metrics.registry.describe("alerts_total", "Keyword mentions queued for alerting.")
+Metrics.registry.describe("alerts_dropped_total", "Keyword mentions dropped because the alert queue was full.")
+Metrics.registry.describe("alert_digests_total", "Alert digests delivered, by sink.")
+Metrics.registry.describe("alert_sink_failures_total", "Alert deliveries that failed, by sink.")
+Metrics.registry.describe("alert_delivery_seconds", "Time spent handing one batch of digests to a sink.")
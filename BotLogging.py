@@ -0,0 +1,195 @@
+import os.path
+import re
+import sys
+import logging
+import logging.handlers
+import threading
+import Queue
+import collections
+
+NUM_CHATTER = 15
+NUM_TRIGGER = 18
+NUM_RESPONSE = 19
+CHAT_LEVELS = (NUM_CHATTER, NUM_TRIGGER, NUM_RESPONSE)
+
+transcriptDir = os.path.join(os.path.dirname(__file__), "log", "transcripts")
+
+
+class QueueHandler(logging.Handler):
+    """ Puts records on a queue instead of writing them. Never blocks the caller. """
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def prepare(self, record):
+        ## Format now, while the arguments are still what they were when logged.
+        record.msg = self.format(record)
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(threading.Thread):
+    """ Takes records off a queue in batches and hands them to the real handlers. """
+    sentinel = None
+
+    def __init__(self, queue, handlers, batchSize=200):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.handlers = handlers
+        self.batchSize = batchSize
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            for record in batch:
+                if record is self.sentinel:
+                    running = False
+                    continue
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            for handler in self.handlers:
+                handler.flushBatch()
+
+    def stop(self):
+        self.queue.put(self.sentinel)
+        self.join()
+        for handler in self.handlers:
+            handler.close()
+
+
+class BatchedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """ RotatingFileHandler that only flushes when told to, not after every record. """
+    def flush(self):
+        pass
+
+    def flushBatch(self):
+        logging.handlers.RotatingFileHandler.flush(self)
+
+
+class TranscriptHandler(logging.Handler):
+    """ Writes chat-level records to one rotating transcript file per channel. """
+    def __init__(self, directory=transcriptDir, maxBytes=1048576, backupCount=5, maxOpen=64):
+        logging.Handler.__init__(self)
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.maxOpen = maxOpen
+        self.files = collections.OrderedDict()
+        self.written = set()
+        self.formatter = logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S")
+
+    def getFile(self, channel):
+        fileName = re.sub(r"[^\w#.-]", "_", channel.lower()) or "server"
+        try:
+            handler = self.files.pop(fileName)
+        except KeyError:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            handler = BatchedRotatingFileHandler(os.path.join(self.directory, fileName + ".log"),
+                                                 maxBytes=self.maxBytes, backupCount=self.backupCount, delay=True)
+            handler.setFormatter(self.formatter)
+            ## Too many open transcripts; close the one written to least recently.
+            while len(self.files) >= self.maxOpen:
+                oldName, oldHandler = self.files.popitem(last=False)
+                self.written.discard(oldHandler)
+                oldHandler.flushBatch()
+                oldHandler.close()
+        self.files[fileName] = handler
+
+        return handler
+
+    def emit(self, record):
+        if record.levelno not in CHAT_LEVELS:
+            return
+        handler = self.getFile(getattr(record, "channel", None) or "server")
+        handler.emit(record)
+        self.written.add(handler)
+
+    def flushBatch(self):
+        for handler in self.written:
+            handler.flushBatch()
+        self.written = set()
+
+    def close(self):
+        for handler in self.files.values():
+            handler.flushBatch()
+            handler.close()
+        self.files.clear()
+        logging.Handler.close(self)
+
+
+class ConsoleHandler(logging.StreamHandler):
+    """ Console output, written by the listener thread and flushed once per batch. """
+    def __init__(self, stream=None):
+        logging.StreamHandler.__init__(self, stream or sys.stdout)
+        self.chatFormatter = logging.Formatter("[%(asctime)s] %(message)s", "%H:%M:%S")
+        self.setFormatter(logging.Formatter("%(levelname)s:\t%(message)s"))
+
+    def format(self, record):
+        if record.levelno in CHAT_LEVELS:
+            return self.chatFormatter.format(record)
+        return logging.StreamHandler.format(self, record)
+
+    def flush(self):
+        pass
+
+    def flushBatch(self):
+        logging.StreamHandler.flush(self)
+
+
+class LogPipeline(object):
+    """ Loggers attached here only enqueue records; one listener thread does all the writing. """
+    def __init__(self, console=True, directory=transcriptDir, maxBytes=1048576, backupCount=5,
+                 maxOpen=64, batchSize=200, queueSize=10000):
+        self.queue = Queue.Queue(queueSize)
+        self.queueHandler = QueueHandler(self.queue)
+        handlers = [TranscriptHandler(directory, maxBytes, backupCount, maxOpen)]
+        if console:
+            handlers.append(ConsoleHandler())
+        self.listener = QueueListener(self.queue, handlers, batchSize)
+
+    def attach(self, logger):
+        logger.handlers = [self.queueHandler]
+        logger.propagate = False
+        return logger
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+
+
+def makePipeline(keywords):
+    """ Build a LogPipeline from the [Logging] section of Settings.ini. """
+    options = keywords.get("Logging", {})
+    directory = transcriptDir
+    if options.get("transcriptdir"):
+        directory = os.path.join(os.path.dirname(__file__), options["transcriptdir"])
+
+    return LogPipeline(console="no" != options.get("console", "yes").lower(),
+                       directory=directory,
+                       maxBytes=int(options.get("transcriptmaxbytes", 1048576)),
+                       backupCount=int(options.get("transcriptbackups", 5)),
+                       maxOpen=int(options.get("maxopentranscripts", 64)),
+                       batchSize=int(options.get("batchsize", 200)),
+                       queueSize=int(options.get("queuesize", 10000)))
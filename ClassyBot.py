@@ -5,24 +5,31 @@ import os.path
 import logging
 import traceback
 
+import errno
+import select
 import socket
 import time
-from time import strftime
 from datetime import timedelta
 import threading
 
-import urllib2
-from bs4 import BeautifulSoup
-import goslate
-
 import Settings
 from PhraseGetter import *
-from games import HijackGame
+from games import HijackGame, HotPotatoGame, gameClasses
+from BotLogging import makePipeline, NUM_CHATTER, NUM_TRIGGER, NUM_RESPONSE
+import Metrics
+import Profiling
+from Scheduler import scheduler, sender
+import Snapshot
+import Offload
+from Wire import LineReader, LineWriter
+from Roster import Roster, UserIndex, NamesReply
+from ServerSupport import ServerSupport, FoldedDict, splitBytes
+from Accounts import AccountCache, WANTED_CAPS, splitTags
+import Alerts
+import RateLimit
+from Languages import LanguageDetector
 
 FILE_ALERT = os.path.join(phraseDir, "Alerts.txt")
-NUM_CHATTER = 15
-NUM_TRIGGER = 18
-NUM_RESPONSE = 19
 
 logging.addLevelName(NUM_CHATTER, "CHATTER")
 logging.addLevelName(NUM_TRIGGER, "TRIGGER")
@@ -47,6 +54,39 @@ logging.Logger.response = response
 logging.basicConfig(level="CHATTER", format="%(levelname)s:%(name)s (%(asctime)s)\t%(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 
 
+class StartupTimer(object):
+    """ How long each startup phase took, from construction up to the first PONG. """
+    def __init__(self, name="Startup"):
+        self.name = name
+        self.started = time.time()
+        self.last = self.started
+        self.phases = []
+        self.finished = False
+
+    def mark(self, phase):
+        now = time.time()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        phases = ", ".join(["{p} {ms:.1f} ms".format(p=p, ms=secs * 1000) for p, secs in self.phases])
+        return "{name}: {phases} (total {ms:.1f} ms)".format(name=self.name, phases=phases, ms=(self.last - self.started) * 1000)
+
+
+class LazyFiles(dict):
+    """ Phrase files, each one read the first time it's asked for. """
+    def __init__(self, fileTypes):
+        dict.__init__(self)
+        self.fileTypes = fileTypes
+        self.lock = threading.Lock()
+
+    def __missing__(self, classType):
+        with self.lock:
+            if not dict.__contains__(self, classType):
+                self[classType] = self.fileTypes[classType]()
+            return dict.__getitem__(self, classType)
+
+
 #### ---- IRC Stuff ---- ####
 ## -- Main IRC bot -- ##
 class GreetBot(threading.Thread):
@@ -55,9 +95,25 @@ class GreetBot(threading.Thread):
     owner = ""
     botNick = "MeatBot"
     userName = botNick
+    fileTypes = {"react": Reaction,
+                 "subject": Subject,
+                 "greet": Greeting,
+                 "gossip": Gossip,
+                 "idle": Idle,
+                 "link": Link,
+                 "meta": Meta,
+                 "user": User,
+                 "song": Song,
+                 "singalong": SingAlong,
+                 "recite": Recital,
+                 "help": HelpMe,
+                 "quote": Quote,}
+    ## Rarely used, so only read on first use.
+    lazyFiles = ("singalong", "recite", "quote")
     
-    def __init__ (self, host, port, channels, botNick, owner, password, idleChannels = None):
-        self.init = Settings.Settings().keywords
+    def __init__ (self, host, port, channels, botNick, owner, password, idleChannels = None, fastStart = True, recordFile = None):
+        self.startup = StartupTimer()
+        self.init = Settings.getKeywords()
         self.host = host
         self.port = port
         self.botNick = botNick
@@ -65,8 +121,17 @@ class GreetBot(threading.Thread):
         self.owner = owner
         self.password = password
         
-        self.channelInfo = {}
-
+        ## The server's limits and case folding, from its 005 lines. Channels are keyed the way it compares them.
+        self.support = ServerSupport()
+        self.channelInfo = FoldedDict(self.support)
+        ## Which of the bot's channels each nick is in, kept up to date by the channels' rosters.
+        self.userIndex = UserIndex(self.support.fold)
+        ## Who's logged in to which account, from IRCv3 capabilities if the server has them, WHOIS if not.
+        self.caps = set()
+        self.capsOffered = []
+        self.accounts = AccountCache(self.support.fold,
+                                     float(self.init.get("Accounts", {}).get("whoisttl", 300)),
+                                     float(self.init.get("Accounts", {}).get("whoistimeout", 5)))
 
         for chan in channels:
             self.initChannel(chan)
@@ -80,7 +145,12 @@ class GreetBot(threading.Thread):
         self.hostName = botNick
         self.initChannel(self.botNick)
         self.lastMsg = {}
-        self.isAlertUp = False
+        ## Keyword mentions, gathered into digests for the owner and whatever else [Alerts] names.
+        alertOptions = self.init.get("Alerts", {})
+        self.alerts = Alerts.AlertQueue(Alerts.makeSinks(alertOptions, lambda text: self.say("", self.owner, text, "NOTICE")),
+                                        float(alertOptions.get("window", 10)), self.support.fold)
+        ## How often each user, and each channel, gets to use commands.
+        self.limiter = RateLimit.makeLimiter(self.init.get("RateLimit", {}))
 
         ## Variables for whois/whowas info retrieval.
         self.whoNick = ""
@@ -92,20 +162,67 @@ class GreetBot(threading.Thread):
         self.whoArgs = []
         
         self.lastTime = time.time()
-        self.dataThreads = []
         self.timeGotData = time.time()
-        self.translator = goslate.Goslate()
+        ## connected is cleared by whichever thread first notices the link is gone; quitting stops reconnects.
+        self.connected = False
+        self.readLock = threading.Lock()
+        self.namesReply = NamesReply(self.support.fold)
+        self.registered = False
+        self.quitting = False
+        self.lostAt = None
+        ## The bot's own PING that hasn't been answered yet, as (token, when it was sent), and the last round trip.
+        self.pingSent = None
+        self.lastPing = 0
+        self.lag = None
+        self.translator = None
+        self.languageDetector = None
+        ## Held while the detector is trained, so two translations at once don't both train one.
+        self.detectorLock = threading.Lock()
+        ## Replies like !getsongs that are the same every time until their file changes.
+        self.outputs = OutputCache(int(self.init.get("Outputs", {}).get("cachesize", 256)))
+        self.metrics = Metrics.registry
+        self.metricsServer = None
+        self.profileSession = None
+        self.scheduler = scheduler
+        self.sender = sender
+        ## Channels quiet for longer than their wait get something said in them, for as long as idling is on.
+        self.idling = True
+        self.idleTask = self.scheduler.later(1, self.checkIdle)
+        ## Everything received gets written here, to be replayed with ReplayBench.py.
+        self.recordFile = recordFile
         self.makeLoggers()
-
-        self.readFiles()
+        self.startup.mark("settings")
+
+        ## Channels waiting for a JOIN line, and greetings waiting for their channel's names.
+        self.joinQueue = []
+        self.joinLock = threading.Lock()
+        ## Whether a sendJoins is on its way, on the scheduler or the sender.
+        self.joinScheduled = False
+        self.pendingGreetings = {}
+
+        ## Pick up where the last run left off: quiet flags, sing-alongs, recitals, games and idle timers.
+        self.pendingRecitals = set()
+        self.stateStore = Snapshot.makeStore(self.init)
+        if self.stateStore:
+            self.restoreState(self.stateStore.load())
+            self.stateStore.start(self.getChannelStates, float(self.init["State"].get("interval", 5)))
+            self.startup.mark("state")
+
+        ## With fastStart, connect first and read phrase files afterwards.
+        self.fastStart = fastStart
+        self.files = None
+        if not fastStart:
+            self.readFiles(loadAll=True)
+            self.startup.mark("corpora")
         
         threading.Thread.__init__(self)
 
     def makeLoggers(self):
-        self.consoleLogger = logging.getLogger(type(self).__name__ +" (Console)")
-        consoleHandler = logging.StreamHandler()
-        consoleHandler.setFormatter(logging.Formatter("%(levelname)s:\t%(message)s"))
-        self.consoleLogger.addHandler(consoleHandler)
+        ## Loggers only queue records; the pipeline's own thread writes the console and transcripts.
+        self.logPipeline = makePipeline(self.init)
+        self.consoleLogger = self.logPipeline.attach(logging.getLogger(type(self).__name__ +" (Console)"))
+        self.chatLogger = self.logPipeline.attach(logging.getLogger(type(self).__name__ +" (Chat)"))
+        self.logPipeline.start()
         
 ##        self.generalLogger = logging.getLogger(type(self).__name__)
 ##        generalHandler = logging.FileHandler(os.path.join(os.path.dirname(__file__), "Logs", "BotLog.log"))
@@ -115,83 +232,282 @@ class GreetBot(threading.Thread):
 ##        self.generalLogger.propagate = False
 
     def closeLogHandlers(self):
-        for handler in self.consoleLogger.handlers:
-            handler.close()
+        ## Writes out whatever is still queued.
+        self.logPipeline.stop()
+        self.consoleLogger.handlers = []
+        self.chatLogger.handlers = []
 ##        for handler in self.generalLogger.handlers:
 ##            handler.close()
-        self.consoleLogger.handlers = []
 ##        self.generalLogger.handlers = []
 
-    def readFiles(self):
-        self.files = {"react": Reaction(),
-                      "subject": Subject(),
-                      "greet": Greeting(),
-                      "gossip": Gossip(),
-                      "idle": Idle(),
-                      "link": Link(),
-                      "meta": Meta(),
-                      "user": User(),
-                      "song": Song(),
-                      "singalong": SingAlong(),
-                      "recite": Recital(),
-                      "help": HelpMe(),
-                      "quote": Quote(),}
+    def readFiles(self, loadAll=False):
+        files = LazyFiles(self.fileTypes)
+        for classType in self.fileTypes:
+            if loadAll or classType not in self.lazyFiles:
+                files[classType]
+        self.files = files
+        self.outputs.clear()
+
+    def commandKind(self, cmd, game=None):
+        """ The kind of command cmd counts as for rate limits, or None if it isn't a command. A game's own commands are just commands. """
+        for name, command in self.init["Commands"].items():
+            if cmd == command:
+                return RateLimit.KINDS.get(name, "commands")
+        if cmd in self.init["SpecialCommands"].values() or (game and game.handles(cmd)):
+            return "commands"
+        return None
+
+    def allowCommand(self, nick, channel, kind):
+        """ Whether nick can use a kind of command in channel right now. The first time they can't, they might be told. """
+        allowed, warn = self.limiter.allow(self.support.fold(nick), self.support.fold(channel), kind)
+        if warn and "yes" == self.init.get("RateLimit", {}).get("warn", "yes").lower():
+            self.say("", nick, self.init["Inform"]["ratelimited"], "NOTICE")
+        return allowed
+
+    def rendered(self, command, arg, fileType, render):
+        """ What render() gives for command and arg (as the command reads it), built once per version of fileType's file. """
+        return self.outputs.get((command, arg, self.files[fileType].getVersion()), render)
+
+    def getChannelStates(self):
+        ## Everything in channelInfo worth keeping across a restart. Channels with nothing going on are left out.
+        states = {}
+        for chan, info in self.channelInfo.items():
+            state = {}
+            if info["quiet"]:
+                state["quiet"] = True
+            if info["wait"]:
+                state["wait"] = info["wait"]
+                state["last"] = info["last"]
+            if info["singalong"]:
+                state["singalong"] = info["singalong"].getState()
+            if info["recite"] and "eightball" != info["recite"]:
+                state["recite"] = info["recite"].getState()
+            if info["game"] and not info["game"].isOver():
+                state["game"] = info["game"].getState()
+            if state:
+                states[chan] = state
+
+        return states
+
+    def restoreState(self, states):
+        for chan, state in states.items():
+            if chan not in self.channelInfo:
+                self.initChannel(chan)
+            info = self.channelInfo[chan]
+            info["quiet"] = state.get("quiet", False)
+            if state.get("wait"):
+                info["wait"] = state["wait"]
+                info["last"] = state["last"]
+            if "singalong" in state:
+                info["singalong"] = SongCursor.fromState(state["singalong"])
+            if "recite" in state:
+                info["recite"] = SongCursor.fromState(state["recite"])
+                ## Carries on once the bot's back in the channel.
+                self.pendingRecitals.add(chan)
+            if state.get("game", {}).get("kind") in gameClasses:
+                info["game"] = self.startGame(chan, gameClasses[state["game"]["kind"]], state["game"])
+
+    def saveState(self):
+        if self.stateStore:
+            self.stateStore.save(self.getChannelStates(), checkpoint=True)
+
+    def getTranslator(self):
+        if not self.translator:
+            import goslate
+            self.translator = goslate.Goslate()
+        return self.translator
+
+    def getLanguageDetector(self):
+        ## Trained once, on the languages in [Translate], from the samples in the database directory.
+        if not self.languageDetector:
+            with self.detectorLock:
+                if not self.languageDetector:
+                    self.languageDetector = LanguageDetector(set(self.init["Translate"].values()))
+        return self.languageDetector
 
     def run(self):
-        channels = [chan for chan in self.channelInfo]
-        self.__init__(self.host, self.port, channels, self.botNick, self.owner, self.password, self.idleChannels)
-        
-        ## Try to connect to server.
-        try:
-            self.irc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        except:
-            self.consoleLogger.error("Failed to create socket.")
-            return
+        ## Stays connected until told to quit: connect, read until the link dies, back off, connect again.
+        ## Everything loaded (phrase files, caches, channel state) carries over between connections.
+        attempt = 0
+        while not self.quitting:
+            try:
+                self.connect()
+                self.readUntilLost()
+            except (socket.error, IOError) as ex:
+                self.consoleLogger.error("Couldn't connect: {e}".format(e=ex))
+            self.closeSocket()
+            if self.quitting:
+                break
+
+            ## Only a connection that got as far as the end of the MOTD resets the backoff.
+            attempt = 1 if self.registered else attempt + 1
+            if self.registered:
+                self.registered = False
+                self.lostAt = time.time()
+                self.metrics.inc("reconnects_total")
+                self.saveState()
+                ## Who's in each channel comes again with the NAMES after rejoining.
+                for chan in self.channelInfo:
+                    self.setRoster(chan, Roster(self.support.fold))
+                self.accounts.clear()
+            delay = self.backoff(attempt)
+            self.consoleLogger.error("Trying again in {s:.1f} seconds.".format(s=delay))
+            time.sleep(delay)
+
+    def connect(self):
+        if self.startup.finished:
+            ## Reconnecting; keep what's already loaded and time the new connection.
+            self.startup = StartupTimer("Reconnect")
 
+        ## Try to connect to server.
+        self.irc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         remoteIP = socket.gethostbyname(self.host)
-        print(remoteIP)
+        self.consoleLogger.info(remoteIP)
+        self.startup.mark("resolve")
 
         self.irc.connect((remoteIP, self.port))
+        self.startup.mark("connect")
+        if self.recordFile:
+            from ReplayBench import RecordingSocket
+            self.irc = RecordingSocket(self.irc, self.recordFile)
+        self.attachSocket(self.irc)
+        self.connected = True
+        self.timeGotData = time.time()
+
+        if not self.metricsServer:
+            options = self.init.get("Metrics", {})
+            self.metricsServer = Metrics.serveMetrics(self.metrics, int(options.get("port") or 0), options.get("socket", ""))
         nickMsg = "NICK {nick}\r\n".format(nick = self.botNick)
         userMsg = "USER {user} {hname} {host} :{rname}\r\n".format(user = self.userName,
                                                                    hname = self.hostName,
                                                                    host = self.host,
                                                                    rname = self.realName)
-        self.irc.send(nickMsg)
-        self.irc.send(userMsg)
+        ## Registration waits for CAP END if the server does capabilities, and carries on without it if not.
+        self.caps = set()
+        self.capsOffered = []
+        self.sendRaw("CAP LS 302\r\n")
+        self.sendRaw(nickMsg)
+        self.sendRaw(userMsg)
         sendMsg = "PRIVMSG NICKSERV :GHOST {botnick} {pword}\r\n".format(botnick = self.botNick,
                                                                          pword = self.password)
-        self.irc.send(sendMsg)
+        self.sendRaw(sendMsg)
+        self.startup.mark("register")
 
-        while True:
+        if self.files is None:
+            self.readFiles()
+            self.startup.mark("corpora")
+
+    def attachSocket(self, sock):
+        ## Lines come in through a reader that turns them into UTF-8, and go out through a writer that batches them.
+        self.irc = sock
+        self.input = LineReader(self.init.get("Encoding", {}).get("fallback", "cp1252"))
+        self.output = LineWriter(sock, self.sendFailed)
+
+    def sendFailed(self, ex):
+        ## The reader notices too; this just stops everyone else writing into a dead socket.
+        self.consoleLogger.error("Couldn't send: {e}".format(e=ex))
+        self.connected = False
+
+    def readUntilLost(self):
+        options = self.init.get("Reconnect", {})
+        pingEvery = float(options.get("pingevery", 30))
+        lagLimit = float(options.get("laglimit", 60))
+        self.pingSent = None
+        while self.connected:
             try:
-                self.makeLoggers()
-                
-                self.dataThreads.append(threading.Thread(target=self.getData))
-                if not self.dataThreads[len(self.dataThreads) - 1].is_alive():
-                    self.dataThreads[len(self.dataThreads) - 1].start()
-                    
-                for t in self.dataThreads:
-                    if not t.is_alive():
-                        t.join()
-                self.dataThreads = []
-
-                self.closeLogHandlers()
-                if 200 < time.time() - self.timeGotData:
-                    ## 200+ seconds passed since last message. Try reconnecting.
-                    self.run()
-            except IOError as ex:
-                print("IO Error encountered: {args}".format(args=str(ex.args)))
-                self.closeLogHandlers()
-            except socket.timeout:
-                self.consoleLogger.error("The socket timed out, it seems. Trying a connection after 15 seconds.")
-                time.sleep(15)
-                
-                ## Try again.
-                self.run()
-            finally:
+                ## Wake up as soon as there's something to read, then read until there's nothing left,
+                ## so a burst (like the names from a batch of JOINs) doesn't queue up behind a fixed poll.
+                select.select([self.irc], [], [], 0.5)
+                while self.getData():
+                    pass
+
+                self.checkLag(pingEvery, lagLimit)
+            except (IOError, select.error) as ex:
+                self.consoleLogger.error("IO Error encountered: {args}".format(args=str(ex.args)))
                 time.sleep(0.5)
 
+    def checkLag(self, pingEvery, lagLimit):
+        ## PING the server every so often and time the PONG. A PONG that's lagLimit seconds late means the link is dead,
+        ## whether or not anything else is still trickling in. Servers don't take PINGs before registering, so until then it's
+        ## down to hearing anything at all.
+        now = time.time()
+        if self.pingSent:
+            if lagLimit < now - self.pingSent[1]:
+                self.consoleLogger.error("No PONG in {s:.0f} seconds. Reconnecting.".format(s=lagLimit))
+                self.connected = False
+        elif self.registered:
+            if pingEvery <= now - self.lastPing:
+                self.pingSent = ("{t:.6f}".format(t=now), now)
+                self.lastPing = now
+                self.sendRaw("PING :{token}\r\n".format(token=self.pingSent[0]))
+        elif pingEvery + lagLimit < now - self.timeGotData:
+            self.consoleLogger.error("Nothing from the server in {s:.0f} seconds. Reconnecting.".format(s=pingEvery + lagLimit))
+            self.connected = False
+
+    def closeSocket(self):
+        self.connected = False
+        try:
+            self.irc.close()
+        except (AttributeError, socket.error):
+            pass
+
+    def backoff(self, attempt):
+        ## Doubles with each failed attempt up to maxDelay. The jitter keeps a crowd of bots
+        ## dropped by the same netsplit from all knocking at once.
+        options = self.init.get("Reconnect", {})
+        delay = min(float(options.get("maxdelay", 300)), float(options.get("mindelay", 1)) * 2 ** (attempt - 1))
+
+        return random.uniform(delay / 2, delay)
+
+    def joinChannels(self, greet=True):
+        ## Everything in channelInfo, as after connecting.
+        channels = sorted(chan for chan in self.channelInfo if self.support.isChannel(chan))
+        self.queueJoins(channels, dict((chan, (self.botNick, "")) for chan in channels) if greet else {})
+
+    def queueJoins(self, channels, greetings=None):
+        ## Channels wait here to be packed into as few JOIN lines as the server allows, sent a little apart.
+        ## greetings: channel -> (nick, message) to say once its names are in; an empty message means a jointalk phrase.
+        with self.joinLock:
+            for chan in channels:
+                if chan not in self.joinQueue:
+                    self.joinQueue.append(chan)
+            for chan, greeting in (greetings or {}).items():
+                self.pendingGreetings[self.support.fold(chan)] = greeting
+            if not self.joinScheduled:
+                self.joinScheduled = True
+                self.sendLater(0, self.sendJoins)
+
+    def sendJoins(self):
+        with self.joinLock:
+            self.joinScheduled = False
+            if not self.connected:
+                ## Whatever's left is asked for again after reconnecting.
+                self.joinQueue = []
+                return
+            groups = self.support.packTargets("JOIN", self.joinQueue, int(self.init.get("Join", {}).get("maxperline") or 0))
+            if not groups:
+                return
+            self.joinQueue = self.joinQueue[len(groups[0]):]
+            if self.joinQueue:
+                self.joinScheduled = True
+                self.sendLater(float(self.init.get("Join", {}).get("interval", 1)), self.sendJoins)
+        sendMsg = "JOIN {chans}\r\n".format(chans=",".join(groups[0]))
+        self.sendRaw(sendMsg)
+        self.consoleLogger.info(sendMsg.strip())
+
+    def joinedChannel(self, channel):
+        ## The channel's names are all in; now say hello and pick up any recital left off.
+        greeting = self.pendingGreetings.pop(channel, None)
+        if greeting:
+            nick, msg = greeting
+            if not msg:
+                msg = self.getMsg(nick, "react", self.init["Headers"]["reaction-jointalk"], channel, True)
+            self.sendLater(0, self.say, "", channel, msg, "PRIVMSG")
+        if channel in self.pendingRecitals:
+            self.pendingRecitals.discard(channel)
+            piece = self.channelInfo[channel]["recite"]
+            self.sendLater(max(0, piece.nextAt - time.time()), self.recite, channel, piece)
+
     def act(self, data, channel, action):
         if "#" in channel:
             action = re.sub(self.init["Substitutions"]["channel"], channel, action, flags=re.I)
@@ -202,24 +518,15 @@ class GreetBot(threading.Thread):
             
         ## The bot sends an action ("/me" message).
         sendMsg = "PRIVMSG {chan} :\001ACTION {act}\001\r\n".format(chan=channel, act=action)
-        self.irc.send(sendMsg)
+        self.sendRaw(sendMsg)
         
-        prettyMsg = "\n[{time}]({chan}) * {bot} {acts}".format(time=strftime("%H:%M:%S"),
-                                                               chan=channel,
-                                                               bot=self.botNick,
-                                                               acts=action)
-        print(prettyMsg)
-
-    def alert(self, message):
-##        if not self.isAlertUp:
-##            self.isAlertUp = True
-        
-##            self.isAlertUp = False
-            
-        return
+        prettyMsg = "({chan}) * {bot} {acts}".format(chan=channel,
+                                                    bot=self.botNick,
+                                                    acts=action)
+        self.chatLogger.response(prettyMsg, extra={"channel": channel})
 
     def askTime(self, server = ""):
-        self.irc.send("TIME {s}\r\n".format(s = server))
+        self.sendRaw("TIME {s}\r\n".format(s = server))
 
     def checkKeywords(self, msg, nick, channel):
         keywords = DictInDict(FILE_ALERT, "keyword").keyValues
@@ -228,9 +535,6 @@ class GreetBot(threading.Thread):
         isRegex = False
         found = False
 
-        alerts = []
-        newAlert = ""
-
         for kw in keywords:
             match = kw
             if "no" in keywords[kw]["case-sensitive"]:
@@ -266,18 +570,14 @@ class GreetBot(threading.Thread):
                         found = True
 
                 if "no" != keywords[kw]["alert"]:
-                    newAlert = "({chan})<{nick}> {msg} [{kw} mentioned]".format(chan=channel, nick=nick,
-                                                                                msg=msg, kw=keywords[kw]["keyword"])
-                    alerts.append(newAlert)
+                    self.alerts.put(keywords[kw]["keyword"], channel, nick, msg)
 
-        if alerts:
-            alertThread = threading.Thread(target=self.alert, args=(str("\n".join(alerts)),))
-            alertThread.start()
-        
         return found
 
     def disconnect(self, msg=":("):
-        self.irc.send("QUIT :{msg}\r\n".format(msg=msg))
+        self.quitting = True
+        self.saveState()
+        self.sendRaw("QUIT :{msg}\r\n".format(msg=msg))
 
     def eightball(self, data, channel, nick, msgType):
         if self.channelInfo[channel]["recite"]:
@@ -296,65 +596,210 @@ class GreetBot(threading.Thread):
         self.channelInfo[channel]["recite"] = None
         
     def getData(self):
-        self.init = Settings.Settings().keywords
-        self.irc.setblocking(0)
-        try:
-            data = self.irc.recv(4096)
-        except socket.error:
+        self.init = Settings.getKeywords()
+        with self.readLock:
+            self.irc.setblocking(0)
+            started = time.time()
+            try:
+                data = self.irc.recv(4096)
+            except socket.error as ex:
+                if ex.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.consoleLogger.error("Lost the connection: {e}".format(e=ex))
+                    self.connected = False
+                return False
+            if not data:
+                ## The server closed the connection.
+                self.connected = False
+                return False
+            self.metrics.observe("receive_seconds", time.time() - started)
+            ## Whole lines only, in UTF-8; a line cut off at the end of the read waits for the rest of it.
+            lines = self.input.feed(data)
+
+        ## Every PING in the read is answered before anything else in it is looked at.
+        rest = []
+        for line in lines:
+            tags, line = splitTags(line)
+            line = re.sub("\x03\d+", "", line)
+            self.metrics.inc("messages_in_total")
+            self.timeGotData = time.time()
+            if not self.readPing(line):
+                rest.append((tags, line))
+
+        for tags, line in rest:
+            ## This is the connection's only reader; one line it can't handle mustn't take the connection down with it.
+            try:
+                self.readLine(tags, line)
+            except Exception:
+                self.consoleLogger.exception("Couldn't handle a line: {l}".format(l=line))
+
+        return True
+
+    def readLine(self, tags, line):
+        heard = re.match(r":\S+ (?:PRIVMSG|NOTICE) (#\S+) :", line)
+        if heard:
+            ## Someone spoke, so the channel's not idle.
+            info = self.channelInfo.get(heard.group(1).lower())
+            if info:
+                info["last"] = time.time()
+        line = self.readAccounts(tags, line)
+        if line is None or self.readCaps(line):
             return
-        
-        data = re.sub("\x03\d+", "", data)
-
-        ## Set a timer for idle messages in each channel.
-        ## If the channel is quiet for too long, the bot says something.
-        for chan in self.channelInfo:
-            if self.channelInfo[chan]["wait"]:
-                if re.search(r"(?i):\S+ (PRIVMSG|NOTICE) {chan} :".format(chan = chan), data):
-                    self.channelInfo[chan]["last"] = time.time()
-                elif self.channelInfo[chan]["wait"] <= time.time() - self.channelInfo[chan]["last"]:
-                    self.say(data, chan, self.getMsg(self.botNick, "idle", self.init["Headers"]["idle-talk"], chan, True))
-                    self.channelInfo[chan]["last"] = time.time()
-
-        data = re.split(r"(\r|\n|\r\n|\n\r)", data)
-        
-        for line in data:
-            if line.strip():
-                self.prettyOutput(line)
-                self.timeGotData = time.time()
-            dataProcess = threading.Thread(target=self.processData, args=(line,))
-            dataProcess.start()
-
-        return
+        with self.metrics.timer("parse_seconds", stage="prettyOutput"):
+            self.prettyOutput(line)
+        if self.readSupport(line) or self.readNames(line):
+            return
+        self.startThread(self.processData, (line,))
+
+    def checkIdle(self):
+        ## Every second on the scheduler: a channel quiet for its wait gets something said in it, by the sender.
+        now = time.time()
+        if self.connected:
+            ## Other threads add channels (a PM opens one), so go over a copy.
+            for chan, info in list(self.channelInfo.items()):
+                if info["wait"] and info["wait"] <= now - info["last"]:
+                    info["last"] = now
+                    self.sender.call(self.sayIdle, chan)
+        if self.idling:
+            self.idleTask = self.scheduler.later(1, self.checkIdle)
+
+    def sayIdle(self, chan):
+        self.say("", chan, self.getMsg(self.botNick, "idle", self.init["Headers"]["idle-talk"], chan, True))
+
+    def readPing(self, line):
+        ## PING and PONG are dealt with here, before anything else, so a PONG never waits behind the commands being handled.
+        if line.startswith("PING "):
+            self.sendRaw("PONG {reply}\r\n".format(reply=line[5:]))
+            self.consoleLogger.info("PONG {reply}".format(reply=line[5:]))
+            if not self.startup.finished:
+                self.startup.finished = True
+                self.startup.mark("first PONG")
+                self.consoleLogger.info(self.startup.report())
+            return True
+        pong = re.match(r":\S+ PONG \S+ :?(\S+)", line)
+        if pong:
+            ## The answer to the bot's own PING: the round trip is the lag.
+            sent = self.pingSent
+            if sent and pong.group(1) == sent[0]:
+                self.pingSent = None
+                self.lag = time.time() - sent[1]
+                self.metrics.observe("lag_seconds", self.lag)
+            return True
+        return False
+
+    def readCaps(self, line):
+        ## Ask for whichever of the wanted capabilities the server offers, then let registration finish.
+        gotCap = re.match(r":\S+ CAP \S+ (LS|ACK|NAK)( \*)? :?(.*)", line)
+        if not gotCap:
+            return False
+        subcommand, more, caps = gotCap.groups()
+        if "LS" == subcommand:
+            self.capsOffered.extend(cap.split("=", 1)[0] for cap in caps.split())
+            if more:
+                return True
+            wanted = [cap for cap in WANTED_CAPS if cap in self.capsOffered]
+            if wanted:
+                self.sendRaw("CAP REQ :{caps}\r\n".format(caps=" ".join(wanted)))
+                return True
+        elif "ACK" == subcommand:
+            self.caps.update(caps.split())
+        self.consoleLogger.info("Capabilities: {caps}".format(caps=" ".join(sorted(self.caps)) or "none"))
+        self.sendRaw("CAP END\r\n")
+        return True
+
+    def readAccounts(self, tags, line):
+        ## Note who's logged in to what from whatever the line says about it. Gives back the line for the rest
+        ## of the bot, as a plain JOIN if it was an extended one, or None if there's nothing more in it.
+        fromUser = re.match(r":([^!\s]+)!\S+ (\S+) ?(.*)", line)
+        if not fromUser:
+            whoisAccount = re.match(r":\S+ 330 \S+ (\S+) (\S+) :", line)
+            if whoisAccount:
+                self.accounts.whoisAccount(whoisAccount.group(1), whoisAccount.group(2))
+            endOfWhois = re.match(r":\S+ 318 \S+ (\S+) :", line)
+            if endOfWhois:
+                self.accounts.whoisEnd(endOfWhois.group(1))
+            if re.match(r":\S+ BATCH ", line):
+                return None
+            return line
+
+        nick, command, params = fromUser.groups()
+        if "account" in tags:
+            self.accounts.learn(nick, tags["account"])
+        elif "account-tag" in self.caps:
+            ## Every line from a logged-in user carries the tag, so no tag means no account.
+            self.accounts.learn(nick, None)
+
+        if "ACCOUNT" == command:
+            self.accounts.learn(nick, params.lstrip(":"))
+            return None
+        if "JOIN" == command:
+            params = params.split(" ")
+            if "extended-join" in self.caps and 1 < len(params):
+                self.accounts.learn(nick, params[1])
+            return "{source} JOIN {chan}".format(source=line.split(" ", 1)[0], chan=params[0].lstrip(":"))
+        if "NICK" == command:
+            self.accounts.rename(nick, params.lstrip(":"))
+        elif "QUIT" == command:
+            self.accounts.forget(nick)
+        return line
+
+    def readSupport(self, line):
+        ## The server's 005s, read once here, before anything that depends on them.
+        if not re.match(r":\S+ 005 ", line):
+            return False
+        if self.support.parse(line.split(" :", 1)[0].split()[3:]):
+            ## Channels were keyed by a guess at the server's case folding; key them by the real one.
+            self.channelInfo.refold()
+            for chan in self.channelInfo:
+                self.setRoster(chan, self.channelInfo[chan]["users"])
+        return True
+
+    def readNames(self, line):
+        ## NAMES replies are read here, in order, rather than on a thread per line,
+        ## so a channel's 366 can't overtake the last of its 353s.
+        names = re.match(r":\S+ 353 \S+ [=*@] (\S+) :(.*)", line)
+        if names:
+            self.namesReply.names(names.group(1), names.group(2), self.support.prefixes)
+            return True
+        endOfNames = re.match(r":\S+ 366 \S+ (\S+) :", line)
+        if endOfNames:
+            channel = self.support.fold(endOfNames.group(1))
+            roster = self.namesReply.end(channel)
+            if channel in self.channelInfo:
+                self.setRoster(channel, roster)
+                self.joinedChannel(channel)
+            self.consoleLogger.info("{chan}: {n} users".format(chan=channel, n=len(roster)))
+            return True
+        return False
 
     def getMsg(self, nick, classType, header, channel, capitalize = False):
         ## Get a random phrase from a class that reads a text file full of phrases.
-        try:
-            msg = self.files[classType].getPhrase(header)
-        except ValueError:
-            self.readFiles()
-            msg = self.files[classType].getPhrase(header)
+        with self.metrics.timer("render_seconds", stage="getMsg"):
+            try:
+                msg = self.files[classType].getPhrase(header)
+            except ValueError:
+                self.readFiles()
+                msg = self.files[classType].getPhrase(header)
         
         
-        ## Make sure the same phrase is not used more than once consecutively.
-        if classType + header + channel in self.lastMsg:
-            if 5 < len(self.lastMsg[classType + header + channel]):
-                self.lastMsg[classType + header + channel].pop(0)
-            while msg in self.lastMsg[classType + header + channel]:
-                msg = self.files[classType].getPhrase(header)
-        else:
-            self.lastMsg[classType + header + channel] = []
+            ## Make sure the same phrase is not used more than once consecutively.
+            if classType + header + channel in self.lastMsg:
+                if 5 < len(self.lastMsg[classType + header + channel]):
+                    self.lastMsg[classType + header + channel].pop(0)
+                while msg in self.lastMsg[classType + header + channel]:
+                    msg = self.files[classType].getPhrase(header)
+            else:
+                self.lastMsg[classType + header + channel] = []
 
-        self.lastMsg[classType + header + channel].append(msg)
+            self.lastMsg[classType + header + channel].append(msg)
 
-        msg = self.subMsg(msg, nick, channel, capitalize)
+            msg = self.subMsg(msg, nick, channel, capitalize)
 
         return msg
 
     def getSubject(self, nick):
+        ## Whoever's account is already known goes by it; greetings never wait on a WHOIS.
         initNick = nick
-        nick = self.whoIs(nick)
-        if not nick:
-            nick = initNick
+        nick = self.accounts.get(nick)[1] or initNick
 
         subject = [initNick, User().randCallNick(nick)]
         for gen in self.files["user"].getGenders(nick):
@@ -368,34 +813,39 @@ class GreetBot(threading.Thread):
 
     def ghost(self, nick, password):
         sendMsg = "PRIVMSG NICKSERV :GHOST {nick} {pword}\r\n".format(nick=nick, pword=password)
-        self.irc.send(sendMsg)
+        self.sendRaw(sendMsg)
         self.consoleLogger.info("(NickServ)<You> Smite this so-called \"{nick}\"".format(nick=nick))
 
+    def setRoster(self, channel, roster):
+        channel = self.support.fold(channel)
+        self.channelInfo[channel]["users"].detach()
+        self.channelInfo[channel]["users"] = roster.attach(self.userIndex, channel)
+
+    def removeChannel(self, channel):
+        self.channelInfo.pop(channel.lower())["users"].detach()
+
     def initChannel(self, channel):
-        self.channelInfo[channel.lower()] = {"users": [], "wait": None, "last": time.time(), "game": None, "singalong": None, "recite": None, "quiet": False, "pause": False}
+        self.channelInfo[channel] = {"users": Roster(self.support.fold).attach(self.userIndex, self.support.fold(channel)), "wait": None, "last": time.time(), "game": None, "singalong": None, "recite": None, "quiet": False}
             
     def join(self, data, nick, channel, msg = ""):
         if channel.lower() != self.botNick.lower() and "#" in channel:
-            sendMsg = "JOIN {chan}\r\n".format(chan = channel)
-            
             if channel.lower() not in self.channelInfo:
                 self.initChannel(channel)
-
-            self.irc.send(sendMsg)
-            
-            try:
-                self.consoleLogger.info(sendMsg.strip())
-            except AttributeError:
-                self.prettyOutput(sendMsg)
-            finally:       
-                time.sleep(1)
-                if msg:
-                    self.say(data, channel, msg, "PRIVMSG")
-                else:
-                    self.say(data, channel, self.getMsg(nick, "react", self.init["Headers"]["reaction-jointalk"], channel, True))
+            self.queueJoins([channel], {channel: (nick, msg)})
 
         return
 
+    def dispatchCmd(self, data, nick):
+        ## Times lookForCmd, labelled with the command the line starts with, if any.
+        command = "none"
+        gotCmd = re.match(r":\S+ (?:PRIVMSG|NOTICE) \S+ :\s*(\S+)", data)
+        if gotCmd:
+            cmd = gotCmd.group(1).lower()
+            if cmd in self.init["Commands"].values() or cmd in self.init["SpecialCommands"].values():
+                command = cmd
+        with self.metrics.timer("dispatch_seconds", command=command):
+            self.lookForCmd(data, nick)
+
     def lookForCmd(self, data, nick):
         gotMsg = re.match(r"(?i):(\S+) (PRIVMSG|NOTICE) (#?\S+) :\s*(\S+)", data)
 
@@ -412,9 +862,6 @@ class GreetBot(threading.Thread):
             channel = gotMsg.group(3)
             cmd = gotMsg.group(4)
 
-            arg = arg.decode("utf-8")
-            msg = msg.decode("utf-8")
-
             if channel.lower() == self.botNick.lower():
                 if self.botNick.lower() != nick.lower():
                     channel = nick
@@ -422,6 +869,9 @@ class GreetBot(threading.Thread):
                     return
             if channel.lower() not in self.channelInfo:
                 self.initChannel(channel)
+            if cmd.lower() in self.init["Commands"].values() or cmd.lower() in self.init["SpecialCommands"].values():
+                self.chatLogger.trigger("({chan}) {nick} triggered {cmd}".format(chan=channel, nick=nick, cmd=cmd),
+                                        extra={"channel": channel})
             
             if self.channelInfo[channel.lower()]["recite"] and "eightball" != self.channelInfo[channel.lower()]["recite"]:
                 if "4'33\"" == self.channelInfo[channel.lower()]["recite"].currentTitle:
@@ -436,18 +886,15 @@ class GreetBot(threading.Thread):
                         return
                 else:
                     return
-            if self.channelInfo[channel.lower()]["game"]:
-                game = self.channelInfo[channel.lower()]["game"]
-                if game.gameTitle == self.init["Titles"]["game-hijack"]:
-                    output = game.processCommand(nick, msg, self.channelInfo[channel.lower()]["users"])
-                    if output:
-                        for tup in output:
-                            if self.channelInfo[channel.lower()]["game"]:
-                                self.say(data, channel, tup[0], msgType)
-                                time.sleep(tup[1])
-                            else:
-                                break
-                        return
+            game = self.channelInfo[channel.lower()]["game"]
+            kind = self.commandKind(cmd.lower(), game)
+            if kind and not self.allowCommand(nick, channel, kind):
+                return
+            if game and game.handles(cmd):
+                output = game.processCommand(nick, msg, self.channelInfo[channel.lower()]["users"])
+                if output:
+                    self.sayLines(data, channel, output, msgType, game)
+                    return
             if self.init["Commands"]["hi"] == cmd.lower():
                 if arg and self.botNick.lower() not in arg.lower():
                     subject = arg.strip(",.?:;!").strip()
@@ -473,22 +920,27 @@ class GreetBot(threading.Thread):
             elif self.init["Commands"]["eightball"] == cmd.lower():
                 self.eightball(data, channel, nick, msgType)
             elif self.init["Commands"]["help"] == cmd.lower():
-                self.say(data, channel, HelpMe().getHelp(arg), msgType)
+                self.say(data, channel, self.rendered(cmd.lower(), re.sub(r"\W", "", arg), "help",
+                                                      lambda: self.files["help"].getHelp(arg)), msgType)
             elif self.init["Commands"]["link"] == cmd.lower():
-                sendMsg = self.files["link"].getTrigger(arg)
+                if arg:
+                    sendMsg = self.files["link"].getTrigger(arg)
+                else:
+                    sendMsg = self.rendered(cmd.lower(), "", "link", self.files["link"].getList)
                 if list == type(sendMsg):
-                    counter = 0
-                    for link in sendMsg:
-                        self.say("", nick, link, "NOTICE")
-                        counter += 1
-
-                        if counter > 4:
+                    ## Five links to a write, two seconds apart.
+                    for start in xrange(0, len(sendMsg), 5):
+                        if start:
                             time.sleep(2)
-                            counter = 0
+                        with self.output.batch():
+                            for link in sendMsg[start:start + 5]:
+                                self.say("", nick, link, "NOTICE")
                 else:
                     self.say(data, nick, sendMsg, "NOTICE")
             elif self.init["Commands"]["lottery"] == cmd.lower():
-                self.say(data, channel, random.choice(self.channelInfo[channel.lower()]["users"]), msgType)
+                winner = self.channelInfo[channel.lower()]["users"].choice()
+                if winner:
+                    self.say(data, channel, winner, msgType)
             elif self.init["Commands"]["quiet"] == cmd.lower():
                 self.channelInfo[channel.lower()]["quiet"] = True
             elif self.init["Commands"]["roll"] == cmd.lower():
@@ -512,18 +964,17 @@ class GreetBot(threading.Thread):
             elif self.init["Commands"]["rockpaperscissors"] == cmd.lower():
                 self.say(data, channel, random.choice(self.init["Choices"]["rockpaperscissors"].split(self.init["Splitters"]["choices-rps"])), msgType)
             elif self.init["Commands"]["sing"] == cmd.lower():
-                if Song().getQuote(arg):
-                    msg = Song().getQuote(arg)
-                else:
+                msg = self.files["song"].getQuote(arg)
+                if not msg:
                     msg = self.getMsg(nick, "meta", self.init["Headers"]["meta-nosong"], channel, True) +" (Try \"{g} {cat}\")".format(g=self.init["Commands"]["songlist"],
                                                                                                                                        cat=self.init["Arguments"]["songlist-cat"])
                 self.say(data, channel, msg, msgType)
             elif self.init["Commands"]["singalong"] == cmd.lower():
                 if not self.channelInfo[channel.lower()]["singalong"]:
-                    if self.files["singalong"].getTitle(arg):
-                        self.channelInfo[channel.lower()]["singalong"] = SingAlong()
-                        songInstance = self.channelInfo[channel.lower()]["singalong"]
-                        songTitle = songInstance.nextLine(arg)
+                    songInstance = SongCursor()
+                    songTitle = self.files["singalong"].nextLine(songInstance, arg)
+                    if songInstance.currentTitle:
+                        self.channelInfo[channel.lower()]["singalong"] = songInstance
                         self.say(data, channel, songTitle, msgType)
                     else:
                         if arg.strip():
@@ -534,24 +985,30 @@ class GreetBot(threading.Thread):
                                                                                                           cat=self.init["Arguments"]["songlist-cat"])
                         self.say(data, channel, msg, msgType)
             elif self.init["Commands"]["songlist"] == cmd.lower():
-                self.say(data, channel, self.files["singalong"].getLists(arg), msgType)
+                songs = self.files["singalong"]
+                self.say(data, channel, self.rendered(cmd.lower(), songs.dumbDown(arg).lower(), "singalong",
+                                                      lambda: songs.getLists(arg)), msgType)
             elif self.init["Commands"]["startgame"] == cmd.lower():
                 if arg:
                     startMsg = ""
-                    if self.channelInfo[channel.lower()]["game"]:
+                    if self.channelInfo[channel.lower()]["game"] and not self.channelInfo[channel.lower()]["game"].isOver():
                         gameMsg = self.init["Inform"]["gamealreadystarted"]
                         gameMsg = gameMsg.replace(self.init["Substitutions"]["game"], self.channelInfo[channel.lower()]["game"].gameTitle)
                         self.say(data, channel, gameMsg, msgType)
                     elif arg.lower() == self.init["Arguments"]["startgame-hijack"]:
-                        self.channelInfo[channel.lower()]["game"] = HijackGame()
+                        self.channelInfo[channel.lower()]["game"] = self.startGame(channel, HijackGame)
                         startMsg = self.init["Inform"]["startgame-hijack"]
+                    elif arg.lower() == self.init["Arguments"]["startgame-hotpotato"]:
+                        self.channelInfo[channel.lower()]["game"] = self.startGame(channel, HotPotatoGame)
+                        startMsg = self.init["Inform"]["startgame-hotpotato"]
                     if startMsg:
                         self.say(data, channel, startMsg, msgType)
                 else:
                     self.say(data, channel, self.init["Inform"]["howto-startgame"], msgType)
             elif self.init["Commands"]["stopgame"] == cmd.lower():
-                if self.channelInfo[channel.lower()]["game"]:
+                if self.channelInfo[channel.lower()]["game"] and not self.channelInfo[channel.lower()]["game"].isOver():
                     self.say(data, channel, "Stopping {g}.".format(g=self.channelInfo[channel.lower()]["game"].gameTitle), msgType)
+                    self.channelInfo[channel.lower()]["game"].stop()
                     self.channelInfo[channel.lower()]["game"] = None
                 else:
                     self.say(data, channel, self.init["Inform"]["nogame"], msgType)
@@ -561,28 +1018,26 @@ class GreetBot(threading.Thread):
                     self.act(data, channel, self.getMsg(nick, "meta", self.init["Headers"]["meta-songstopact"], channel))
             elif self.init["Commands"]["poem"] == cmd.lower():
                 if not self.channelInfo[channel.lower()]["recite"]:
-                    self.channelInfo[channel.lower()]["recite"] = Recital()
-                    piece = self.channelInfo[channel.lower()]["recite"]
-                    if piece.getTitle(arg):
-                        piece.currentTitle = piece.getTitle(arg)
-                    else:
+                    poems = self.files["recite"]
+                    title = poems.getTitle(arg)
+                    if not title:
                         if arg:
                             self.say(data, channel, "Try \"{g}\".".format(g=self.init["Commands"]["poemlist"]))
                             return
                         else:
-                            titles = []
-                            for t in piece.byTitle:
-                                titles.append(t)
-                            piece.currentTitle = random.choice(titles)
-                    piece.lenTitle = len(piece.byTitle[piece.currentTitle])
-                    reciteThread = threading.Thread(target=self.recite, args=(channel.lower(),))
-                    reciteThread.start()
+                            title = random.choice(poems.titles)
+                    piece = SongCursor(title)
+                    self.channelInfo[channel.lower()]["recite"] = piece
+                    self.recite(channel.lower(), piece)
             elif self.init["Commands"]["poemlist"] == cmd.lower():
-                self.say(data, channel, self.files["recite"].getLists(arg), msgType)
+                poems = self.files["recite"]
+                self.say(data, channel, self.rendered(cmd.lower(), poems.dumbDown(arg).lower(), "recite",
+                                                      lambda: poems.getLists(arg)), msgType)
             elif self.init["Commands"]["quote"] == cmd.lower():
                 self.say(data, channel, self.files["quote"].getQuote(arg), msgType)
             elif self.init["Commands"]["quotecat"] == cmd.lower():
-                self.say(data, channel, self.files["quote"].getCategories(arg), msgType)
+                self.say(data, channel, self.rendered(cmd.lower(), arg.strip().lower(), "quote",
+                                                      lambda: self.files["quote"].getCategories(arg)), msgType)
             elif self.init["Commands"]["stoppoem"] == cmd.lower():
                 if self.channelInfo[channel.lower()]["recite"]:
                     self.channelInfo[channel.lower()]["recite"] = None
@@ -592,8 +1047,6 @@ class GreetBot(threading.Thread):
                     tFrom = re.search(r"\bfrom=(\w+(-\w)*)", arg, re.I)
                     tTo = re.search(r"\bto=(\w+(-\w)*)", arg, re.I)
 
-                    arg = arg.encode("utf-8")
-
                     try:
                         arg = arg.replace(tFrom.group(), "")
                         tFrom = tFrom.group(1)
@@ -625,48 +1078,52 @@ class GreetBot(threading.Thread):
                     else:
                         tTo = "en"
 
-                    translation = self.translator.translate(arg, tTo, tFrom)
+                    ## The language it's from is worked out here and handed to the translator, so the label says what it translated.
+                    ## With nothing to tell by, the translator's left to guess, and the label stays blank.
+                    detected = tFrom or self.getLanguageDetector().detect(arg)
+                    translator = self.getTranslator()
+                    translation = translator.translate(arg, tTo, detected)
                     
                     inLang = ""
                     outLang = "english"
                     try:
-                        inLang = [l for l in self.init["Translate"] if self.translator.detect(arg).lower() == self.init["Translate"][l]][0]
+                        inLang = [l for l in self.init["Translate"] if detected == self.init["Translate"][l]][0]
                         outLang = [l for l in self.init["Translate"] if tTo == self.init["Translate"][l]][0]
                     except IndexError:
-                        print(self.translator.detect(arg).lower())
+                        self.consoleLogger.warning("Unknown language: {l}".format(l=detected))
 
                     self.say(data, channel, "{trans} [{fr} > {to}]".format(fr=inLang, to=outLang, trans=translation.encode("utf-8")))
                     
             elif self.channelInfo[channel.lower()]["singalong"]:
                 songInstance = self.channelInfo[channel.lower()]["singalong"]
+                songs = self.files["singalong"]
                 if songInstance.currentTitle:
-                    if self.channelInfo[channel.lower()]["pause"]:
+                    if songInstance.paused:
                         if self.init["Commands"]["unpause"] == cmd.lower():
-                            self.channelInfo[channel.lower()]["pause"] = False
+                            songInstance.paused = False
                             self.say(data, channel, "Resuming \"{}\" singalong.".format(songInstance.currentTitle))
                         return
                     elif self.init["Commands"]["pause"] == cmd.lower():
-                        self.channelInfo[channel.lower()]["pause"] = True
+                        songInstance.paused = True
                         self.say(data, channel, "Song paused. \"{}\" to continue.".format(self.init["Commands"]["unpause"]))
                         return
-                    elif songInstance.currentQ == songInstance.byTitle[songInstance.currentTitle][songInstance.lenTitle] and songInstance.currentOrder >= songInstance.lenTitle:
+                    elif songs.isFinished(songInstance):
                         self.channelInfo[channel.lower()]["singalong"] = None
                         self.act(data, channel, self.getMsg(nick, "meta", self.init["Headers"]["meta-songstopact"], channel) +" (Song finished)")
                         return
                     else:
                         if self.init["Commands"]["nextlyric"] == cmd.lower():
-                            songLine = songInstance.autoNext()
+                            songLine = songs.autoNext(songInstance)
                         else:
-                            songLine = songInstance.nextLine(msg)
+                            songLine = songs.nextLine(songInstance, msg)
                             
                         if songLine:
                             self.say(data, channel, songLine, msgType)
-                        if songInstance.currentQ == songInstance.byTitle[songInstance.currentTitle][songInstance.lenTitle] and songInstance.currentOrder >= songInstance.lenTitle:
+                        if songs.isFinished(songInstance):
                             self.channelInfo[channel.lower()]["singalong"] = None
                             self.act(data, channel, self.getMsg(nick, "meta", self.init["Headers"]["meta-songdoneact"], channel) +" (Song finished)")
             elif cmd.lower() in self.init["SpecialCommands"].values():
-                self.whoIs(nick)
-                if self.whoIdentity.lower() == self.owner.lower():
+                if self.isOwner(nick):
                     if self.init["SpecialCommands"]["act"] == cmd.lower():
                         try:
                             actChan = arg.split(" ")[0]
@@ -716,6 +1173,10 @@ class GreetBot(threading.Thread):
                     elif self.init["SpecialCommands"]["update"] == cmd.lower():
                         self.readFiles()
                         self.say(data, nick, "Updated.", "NOTICE")
+                    elif self.init["SpecialCommands"]["stats"] == cmd.lower():
+                        self.say(data, nick, self.metrics.summary(), "NOTICE")
+                    elif self.init["SpecialCommands"]["profile"] == cmd.lower():
+                        self.profile(data, nick, arg)
                 else:
                     self.say(data, nick, "Don't tell me what to do.", "NOTICE")
             else:
@@ -729,7 +1190,12 @@ class GreetBot(threading.Thread):
 
 
                 lMatches = [m.group() for m in re.finditer(r"https?://\S+", msg)]
-                for m in lMatches:
+                ## Every link means fetching a page, so links count against the poster's limit too.
+                fetches = lMatches if lMatches and self.allowCommand(nick, channel, "links") else []
+                if fetches:
+                    import urllib2
+                    from bs4 import BeautifulSoup
+                for m in fetches:
                     try:
                         response = urllib2.urlopen(m)
                         html = response.read()
@@ -772,12 +1238,12 @@ class GreetBot(threading.Thread):
                 
     def mode(self, channel, modeChar="", nick=""):
         sendMsg = "MODE {chan} {m} {nick}\r\n".format(chan=channel, m=modeChar, nick=nick)
-        self.irc.send(sendMsg)
+        self.sendRaw(sendMsg)
         self.consoleLogger.info(sendMsg.strip())
         
     def nickChange(self, nick):
         sendMsg = "NICK {nick}\r\n".format(nick=nick)
-        self.irc.send(sendMsg)
+        self.sendRaw(sendMsg)
         self.consoleLogger.info("You are now {nick}.".format(nick=nick))
         self.botNick = nick
 
@@ -827,17 +1293,18 @@ class GreetBot(threading.Thread):
 
     def part(self, channel, msg):
         try:
-            del self.channelInfo[channel.lower()]
+            self.removeChannel(channel)
             if "" == msg:
                 msg = "I don't know why I'm leaving. :("
             sendMsg = "PART {chan} :{msg}\r\n".format(chan=channel, msg=msg)
-            self.irc.send(sendMsg)
+            self.sendRaw(sendMsg)
             self.consoleLogger.info("You left {chan}. ({msg})".format(chan=channel, msg=msg))
         except KeyError:
             pass
 
     def prettyOutput(self, line):
         line = line.strip()
+        channel = None
         joined = re.match(r":(\S+)!\S+ JOIN (#\S+)$", line)
         kicked = re.match(r":(\S+)!\S+ KICK (#\S+) (\S+) :(.+)", line)
         parted = re.match(r":(\S+)!\S+ PART (#\S+)", line)
@@ -849,10 +1316,16 @@ class GreetBot(threading.Thread):
         if joined:
             joinNick = joined.group(1)
             chan = joined.group(2)
+            channel = chan
             line = "\t{nick} joined {chan}.".format(nick=joinNick,
                                                     chan=chan)
+            if self.botNick.lower() == joinNick.lower():
+                ## The server just showed the source it puts on the bot's lines.
+                self.support.source = joined.string.split(" ", 1)[0][1:]
             
-            self.channelInfo[chan.lower()]["users"].append(joinNick)
+            ## Not a channel being kept track of (yet), if the JOIN beat the bot's own bookkeeping.
+            if chan.lower() in self.channelInfo:
+                self.channelInfo[chan.lower()]["users"].add(joinNick)
 
             # Greet the user if user is not the bot.
             if self.botNick.lower() != joinNick.lower() and "#" in chan:
@@ -868,29 +1341,38 @@ class GreetBot(threading.Thread):
             chan = kicked.group(2)
             kickedNick = kicked.group(3)
             kickMsg = kicked.group(4)
+            channel = chan
             
             line = "{kicker} kicked {kickee} out of {room}. ({reason})".format(kicker=kicker, kickee=kickedNick,
                                                                                room=chan, reason=kickMsg,)
-            self.channelInfo[chan.lower()]["users"].remove(kickedNick)
+            if chan.lower() in self.channelInfo:
+                self.channelInfo[chan.lower()]["users"].discard(kickedNick)
+            if not self.userIndex.channelsOf(kickedNick):
+                self.accounts.forget(kickedNick)
 
             if self.botNick.lower() == kickedNick.lower():
-                del self.channelInfo[chan.lower()]
+                self.removeChannel(chan)
                 
         elif parted:
             quitNick = parted.group(1)
             chan = parted.group(2)
+            channel = chan
             line = "\t{nick} left {chan}.".format(nick=quitNick,
                                                   chan=chan)
             
-            if self.channelInfo[chan.lower()]["game"]:
-                game = self.channelInfo[chan.lower()]["game"]
+            ## The bot's own PART comes back after the channel's already been dropped.
+            info = self.channelInfo.get(chan.lower())
+            if info and info["game"]:
+                game = info["game"]
                 try:
                     if quitNick.lower() in game.players:
                         game.removePlayer(quitNick.lower())
                 except AttributeError:
                     pass
-            if quitNick in self.channelInfo[chan.lower()]["users"]:
-                self.channelInfo[chan.lower()]["users"].remove(quitNick)
+            if info:
+                info["users"].discard(quitNick)
+            if not self.userIndex.channelsOf(quitNick):
+                self.accounts.forget(quitNick)
 
             # Gossip.
             if "#" in chan:
@@ -900,19 +1382,24 @@ class GreetBot(threading.Thread):
             quitNick = quitted.group(1)
             line = "\t{nick} quit. ({reason})".format(nick=quitNick,
                                                       reason=quitted.group(2).lstrip(" :"))
-            for chan in self.channelInfo:
-                if self.channelInfo[chan]["game"]:
-                    game = self.channelInfo[chan]["game"]
+            for chan in self.userIndex.channelsOf(quitNick):
+                info = self.channelInfo.get(chan)
+                if not info:
+                    continue
+                if info["game"]:
+                    game = info["game"]
                     try:
                         if quitNick.lower() in game.players:
                             game.removePlayer(quitNick.lower())
                     except AttributeError:
                         pass
-                if quitNick in self.channelInfo[chan]["users"]:
-                    self.channelInfo[chan]["users"].remove(quitNick)
+                if info["users"].discard(quitNick):
                     self.say(line, chan, self.getMsg(quitNick, "gossip", "gossip", chan, True))
         elif msged:
             msg = msged.group(3).strip()
+            channel = msged.group(2)
+            if channel.lower() == self.botNick.lower():
+                channel = msged.group(1)
             line = "({chan})<{nick}> {msg}".format(chan=msged.group(2),
                                                    nick=msged.group(1),
                                                    msg=msg)
@@ -926,49 +1413,53 @@ class GreetBot(threading.Thread):
             newNick = nickChanged.group(2)
             line = " * {oldnick} is now known as {newnick}.".format(oldnick=oldNick,
                                                                     newnick=newNick)
-            for chan in self.channelInfo:
-                if oldNick in self.channelInfo[chan]["users"]:
-                    self.channelInfo[chan]["users"][self.channelInfo[chan]["users"].index(oldNick)] = newNick
-                if self.channelInfo[chan]["game"]:
-                    game = self.channelInfo[chan]["game"]
-                    try:
-                        if oldNick.lower() in game.players:
-                            game.players[newNick.lower()] = game.players[oldNick.lower()]
-                            game.players[newNick.lower()].name = newNick
-                            del game.players[oldNick.lower()]
-                    except AttributeError:
-                        pass
+            if self.botNick.lower() == oldNick.lower():
+                ## Learned again at the next JOIN.
+                self.support.source = None
+            for chan in self.userIndex.channelsOf(oldNick):
+                info = self.channelInfo.get(chan)
+                if not info:
+                    continue
+                info["users"].rename(oldNick, newNick)
+                if info["game"]:
+                    info["game"].renamePlayer(oldNick, newNick)
         elif noticed:
+            channel = noticed.group(2)
+            if channel.lower() == self.botNick.lower():
+                channel = noticed.group(1)
             line = "({chan}) {nick} whispers: {msg}".format(chan=noticed.group(2),
                                                             nick=noticed.group(1),
                                                             msg=noticed.group(3))
 
-        print("[{time}] {line}".format(time=strftime("%H:%M:%S"), line=line))
+        self.chatLogger.chatter(line, extra={"channel": channel})
 
     def processData(self, data):
+        started = time.time()
         try:
             nick = data.split("!")[0].translate(None, ":")
         except AttributeError:
             pass
 
-        ## Respond to server pings:
-        if "PING" in data.split(" ")[0]:
-            pongMsg = "PONG {reply}\r\n".format(reply=data.split("PING ")[1])
-            self.irc.send(pongMsg)
-            print("[{time}] {pong}".format(time=strftime("%H:%M:%S"), pong=pongMsg))
+        ## Registered: now there's time to start the workers. Until they're up, their jobs just run here.
+        if re.match(r":\S+ 001 ", data):
+            Offload.start(self.init)
 
         ## Join channels after the message of the day is out.
         if re.match(r"(?i):\S+ \d+ {bot}.* :End of /MOTD".format(bot=self.botNick.lower()), data.lower()):
             sendMsg = "PRIVMSG NICKSERV :IDENTIFY {own} {pword}\r\n".format(own=self.owner, pword=self.password)
-            self.irc.send(sendMsg)
-            print("(NickServ)<You> I am totally {own}. Seriously.".format(own=self.owner))
+            self.sendRaw(sendMsg)
+            self.consoleLogger.info("(NickServ)<You> I am totally {own}. Seriously.".format(own=self.owner))
 
             sendMsg = "MODE {bot} +R\r\n".format(bot=self.botNick)
-            self.irc.send(sendMsg)
-            print(sendMsg.strip())
-            for chan in self.channelInfo:
-                joinThread = threading.Thread(target=self.join, args=(data, nick, chan))
-                joinThread.start()
+            self.sendRaw(sendMsg)
+            self.consoleLogger.info(sendMsg.strip())
+            self.registered = True
+            if self.lostAt:
+                self.metrics.observe("reconnect_seconds", time.time() - self.lostAt)
+                self.consoleLogger.info("Back {s:.1f} seconds after losing the connection.".format(s=time.time() - self.lostAt))
+            ## Only greet channels the first time in; after a reconnect, slip back in quietly.
+            self.joinChannels(greet=not self.lostAt)
+            self.lostAt = None
 
         ## Ghost any past copies of the bot already inside.
         nickUsed = re.match(r"(?i):\S+ \d+ \S+ (\w+) :Nickname is already in use", data)
@@ -979,32 +1470,6 @@ class GreetBot(threading.Thread):
         if re.match(r"(?i):\S+ NOTICE \S+ :.?\S+.? (is not online|has been ghosted)", data.lower()):
             self.nickChange(self.botNick)
 
-        ## Get channel and user prefixes that represent modes (opped, voiced, moderated, etc.).
-        gotChanPrefixes = re.match(r"(?i):.+{bot} .+ PREFIX=\(\w+\)(\S+) .+:are supported by this server".format(bot = self.botNick.lower()),
-                                   data.lower())
-        if gotChanPrefixes:
-            self.chanPrefixes = gotChanPrefixes.group(1)
-        else:
-            self.chanPrefixes = "@+"
-
-        showedNames = re.match(r"(?i):\S+ \d+ {bot}.? \S (#\S+) :".format(bot = self.botNick), data)
-        if showedNames:
-            channel = showedNames.group(1)
-            users = data.split(showedNames.group(0))[1].translate(None, self.chanPrefixes)
-            self.channelInfo[channel.lower()]["users"] = users.split(" ")
-            self.consoleLogger.info(self.channelInfo[channel.lower()]["users"])
-
-        ## Set a timer for idle messages in each channel.
-        ## If the channel is quiet for too long, the bot says something.
-        for chan in self.channelInfo:
-            if self.channelInfo[chan]["wait"]:
-                if "privmsg {chan} :".format(chan = chan.lower()) in data.lower():
-                    self.channelInfo[chan]["last"] = time.time()
-                else:
-                    if self.channelInfo[chan]["wait"] <= time.time() - self.channelInfo[chan]["last"]:
-                        self.say(data, chan, self.getMsg(nick, "idle", "say", chan, True))
-                        self.channelInfo[chan]["last"] = time.time()
-        
         whoIdMatch = re.match(r"(?i):\S+ \d+ {bot}.? (\S+) (\S+) :(wa|i)s logged in as".format(bot = self.botNick), data)
         whoIdleMatch = re.match(r"(?i):\S+ \d+ {bot}.? \S+ (\d+ \d+) :second".format(bot = self.botNick), data)
         whoDateMatch = re.match(r"(?i):\S+ \d+ {bot}.? \S+ (\S+) :(\S+ \S+ \d+ \d+:\d+:\d+ \d+)".format(bot = self.botNick), data)
@@ -1028,27 +1493,87 @@ class GreetBot(threading.Thread):
         if inviteMatch:
             self.join(data, nick, inviteMatch.group(1))
 
+        self.metrics.observe("parse_seconds", time.time() - started, stage="processData")
+
        ## Respond to certain kinds of user input:
-        checkCmd = threading.Thread(target=self.lookForCmd, args=(data, nick))
-        checkCmd.start()
+        self.startThread(self.dispatchCmd, (data, nick))
 
         return
 
-    def recite(self, channel):
-        while self.channelInfo[channel]["recite"]:
-            piece = self.channelInfo[channel]["recite"]
-            if piece.currentOrder > 0 and piece.currentOrder > piece.lenTitle:
-                self.channelInfo[channel]["recite"] = None
-                self.act("", channel, self.getMsg("", "meta", self.init["Headers"]["meta-recitaldoneact"], channel))
-            else:
-                if self.channelInfo[channel]["quiet"]:
-                    pass
-                else:
-                    self.say("", channel, piece.autoNext())
-                    time.sleep(piece.delay)
-                            
-        return
+    def recite(self, channel, piece):
+        ## One line at a time; the scheduler comes back for the next, so a recital doesn't hold a thread of its own.
+        if piece is not self.channelInfo[channel]["recite"]:
+            ## Stopped, or another one started since.
+            return
+        poems = self.files["recite"]
+        if poems.isFinished(piece):
+            self.channelInfo[channel]["recite"] = None
+            self.act("", channel, self.getMsg("", "meta", self.init["Headers"]["meta-recitaldoneact"], channel))
+            return
+        ## While the channel's quiet the recital waits where it is.
+        if not self.channelInfo[channel]["quiet"]:
+            self.say("", channel, poems.autoNext(piece))
+        piece.nextAt = time.time() + piece.delay
+        self.sendLater(piece.delay, self.recite, channel, piece)
                 
+    def profile(self, data, nick, arg):
+        ## Profile the running bot for a while; the summary is sent to whoever asked when it's done.
+        options = self.init.get("Profiling", {})
+        if "stop" == arg.strip().lower():
+            if self.profileSession and not self.profileSession.finished:
+                self.profileSession.stop()
+            else:
+                self.say(data, nick, "Not profiling.", "NOTICE")
+            return
+        if self.profileSession and not self.profileSession.finished:
+            self.say(data, nick, "Already profiling. (\"{c} stop\" to stop.)".format(c=self.init["SpecialCommands"]["profile"]), "NOTICE")
+            return
+
+        seconds = float(options.get("defaultseconds", 30))
+        kind = "sample"
+        for word in arg.lower().split():
+            if re.match(r"^\d+(\.\d+)?$", word):
+                seconds = min(float(word), float(options.get("maxseconds", 600)))
+            elif word in ("sample", "cprofile"):
+                kind = word
+        directory = Profiling.profileDir
+        if options.get("directory"):
+            directory = os.path.join(os.path.dirname(__file__), options["directory"])
+
+        self.profileSession = Profiling.ProfileSession(kind, seconds, float(options.get("interval", 0.005)), directory,
+                                                       lambda summary: self.say("", nick, summary, "NOTICE"))
+        self.profileSession.start()
+        self.say(data, nick, "Profiling ({k}) for {s:g} seconds.".format(k=kind, s=seconds), "NOTICE")
+
+    def startGame(self, channel, gameClass, state=None):
+        game = gameClass(self.init)
+        if state:
+            game.setState(state)
+        ## Timers (like the hot potato's fuse) talk to the channel on their own, through the sender.
+        game.announce = lambda output: self.sender.call(self.sayLines, "", channel, output, "PRIVMSG", game)
+        return game
+
+    def sendLater(self, seconds, callback, *args):
+        ## callback(*args) on the sender thread once seconds are up. The scheduler only hands it over,
+        ## so a long reply or a backed-up socket never holds up anyone else's timers.
+        return self.scheduler.later(seconds, self.sender.call, callback, *args)
+
+    def sayLines(self, data, channel, output, msgType="PRIVMSG", game=None):
+        ## Output is a list of (message, seconds to wait after it), paced by the scheduler instead of sleeping.
+        delay = 0
+        for msg, pause in output:
+            if delay:
+                self.sendLater(delay, self.sayGameLine, data, channel, msg, msgType, game)
+            else:
+                self.sayGameLine(data, channel, msg, msgType, game)
+            delay += pause
+
+    def sayGameLine(self, data, channel, msg, msgType, game):
+        ## Drop what's left of a game's output once it's been stopped.
+        if game and game is not self.channelInfo.get(channel.lower(), {}).get("game"):
+            return
+        self.say(data, channel, msg, msgType)
+
     def say(self, data, channel, msg, msgType="PRIVMSG"):
         ## Send a message to a channel or user. (channel = channel OR user)
         if "#" in channel:
@@ -1064,52 +1589,74 @@ class GreetBot(threading.Thread):
         except IndexError:
             pass
 
-        counter = 0
+        ## Lines are packed up to what the server will pass on, counted in bytes.
+        if isinstance(msg, unicode):
+            msg = msg.encode("utf-8")
+        limit = self.support.payloadBytes(self.botNick, channel, msgType.upper())
+
+        ## Up to five lines go out in one write, then a second's pause before the next five.
         while msg:
-            sendMsg = "{msgType} {chan} :{msg}\r\n".format(msgType = msgType.upper(), chan = channel, msg = msg[:300])
-            self.irc.send(sendMsg)
-            
-            prettyMsg = "[{time}]({chan})<{bot}> {msg}".format(time=strftime("%H:%M:%S"),
-                                                                               chan=channel,
-                                                                               bot=self.botNick,
-                                                                               msg=msg[:300])    
-            print(prettyMsg)
-            msg = msg[300:]
-            counter += 1
-
-            if counter >= 5:
+            with self.output.batch():
+                for _ in xrange(5):
+                    chunk, msg = splitBytes(msg, limit)
+                    sendMsg = "{msgType} {chan} :{msg}\r\n".format(msgType = msgType.upper(), chan = channel, msg = chunk)
+                    self.sendRaw(sendMsg)
+
+                    prettyMsg = "({chan})<{bot}> {msg}".format(chan=channel,
+                                                               bot=self.botNick,
+                                                               msg=chunk)
+                    self.chatLogger.response(prettyMsg, extra={"channel": channel})
+                    if not msg:
+                        break
+            if msg:
+                ## Even inside someone else's batch, these five go out before the pause.
+                self.output.flush()
                 time.sleep(1)
-                counter = 0
+
+    def sendRaw(self, line):
+        ## Every line to the server goes out through here. Inside self.output.batch(), it waits to go out with the rest.
+        self.output.write(line)
+        self.metrics.inc("messages_out_total")
+
+    def startThread(self, target, args=()):
+        newThread = threading.Thread(target=target, args=args)
+        newThread.start()
+        self.metrics.inc("threads_spawned_total")
+        return newThread
 
     def subMsg(self, msg, nick, channel="this place", capitalize=False):
         ## Substitute placeholders with meaningful values.
-        msg = msg.replace(self.init["Substitutions"]["sendnick"], nick)
-        msg = msg.replace(self.init["Substitutions"]["botnick"], self.botNick)
-        msg = msg.replace(self.init["Substitutions"]["subjectplural"], self.files["subject"].getPhrase("plural"))
-        msg = msg.replace(self.init["Substitutions"]["owner"], self.owner)
-        msg = msg.replace(self.init["Substitutions"]["channel"], channel)
-
-        ## Capitalize first /letter/.
-        if capitalize:
-            firstLetter = re.search("\w", msg).group(0)
-            msg = msg[0:msg.index(firstLetter)] + firstLetter.upper() + msg[msg.index(firstLetter) + 1:]
-
-        ## Replace "a" with "an" when necessary.
-        for m in ["hour", "heir", "homage", "honest", "[aeiou]"]:
-            anMatch = re.findall(r"(?i)\ba\s+{m}".format(m = m), msg)
-            for m in anMatch:
-                msg = msg[0:msg.index(m) + 1] +"n"+ msg[msg.index(m) + 1:]
-                
+        with self.metrics.timer("render_seconds", stage="subMsg"):
+            msg = msg.replace(self.init["Substitutions"]["sendnick"], nick)
+            msg = msg.replace(self.init["Substitutions"]["botnick"], self.botNick)
+            msg = msg.replace(self.init["Substitutions"]["subjectplural"], self.files["subject"].getPhrase("plural"))
+            msg = msg.replace(self.init["Substitutions"]["owner"], self.owner)
+            msg = msg.replace(self.init["Substitutions"]["channel"], channel)
+
+            ## Capitalize first /letter/.
+            firstLetter = re.search("\w", msg)
+            if capitalize and firstLetter:
+                firstLetter = firstLetter.group(0)
+                msg = msg[0:msg.index(firstLetter)] + firstLetter.upper() + msg[msg.index(firstLetter) + 1:]
+
+            ## Replace "a" with "an" when necessary.
+            for m in ["hour", "heir", "homage", "honest", "[aeiou]"]:
+                anMatch = re.findall(r"(?i)\ba\s+{m}".format(m = m), msg)
+                for m in anMatch:
+                    msg = msg[0:msg.index(m) + 1] +"n"+ msg[msg.index(m) + 1:]
+
         return msg
 
     def whoIs(self, nick, server = ""):
-        self.irc.send("WHOIS {s} {nick}\r\n".format(s = server, nick = nick))
-        self.searchingWho = True
-        while self.searchingWho:
-            pass
+        ## nick's account: from what the server's already said, or a WHOIS if it hasn't said.
+        return self.accounts.lookup(nick, lambda n: self.sendRaw("WHOIS {s} {nick}\r\n".format(s = server, nick = n)))
+
+    def isOwner(self, nick):
+        account = self.whoIs(nick)
+        return bool(account) and account.lower() == self.owner.lower()
 
     def whoWas(self, nick, server = ""):
-        self.irc.send("WHOWAS {s} {nick}\r\n".format(s = server, nick = nick))
+        self.sendRaw("WHOWAS {s} {nick}\r\n".format(s = server, nick = nick))
         self.whoSearching = True
         while self.searchingWho:
             pass
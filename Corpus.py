@@ -0,0 +1,411 @@
+import os.path
+import mmap
+import struct
+import bisect
+import argparse
+import collections
+import threading
+
+corpusDir = os.path.join(os.path.dirname(__file__), "database")
+FILE_CORPUS = os.path.join(corpusDir, "Corpus.bin")
+FILE_SETTINGS = os.path.join(corpusDir, "Settings.ini")
+
+MAGIC = "MBCORPUS"
+VERSION = 2
+
+KIND_PHRASES = 1
+KIND_SONGS = 2
+KIND_RECORDS = 3
+
+## magic, version, Settings.ini mtime, string count, string offsets, string blob, table count, table directory
+HEADER = struct.Struct("<8sIdIIIII")
+## name, kind, source mtime, array count, array directory
+TABLE_ENTRY = struct.Struct("<IIdII")
+## name, length, data position
+ARRAY_ENTRY = struct.Struct("<III")
+UINT = struct.Struct("<I")
+
+## Set to False to make every phrase class parse its text file instead.
+enabled = True
+
+
+#### ---- Reading ---- ####
+class UIntArray(object):
+    """ Read-only view of an array of unsigned ints inside the corpus. """
+    def __init__(self, buf, pos, length):
+        self.buf = buf
+        self.pos = pos
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return UINT.unpack_from(self.buf, self.pos + 4 * i)[0]
+
+
+class StringList(collections.Sequence):
+    """ Strings referenced by a slice of a string ID array. """
+    def __init__(self, corpus, ids, start=0, end=None):
+        self.corpus = corpus
+        self.ids = ids
+        self.start = start
+        self.end = len(ids) if end is None else end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.corpus.string(self.ids[self.start + i])
+
+
+class SortedDict(collections.Mapping):
+    """ Maps strings to values, looked up by binary search over sorted key IDs. """
+    def __init__(self, corpus, keyIds, getValue):
+        self.corpus = corpus
+        self.keyIds = keyIds
+        self.keyList = StringList(corpus, keyIds)
+        self.getValue = getValue
+
+    def find(self, key):
+        i = bisect.bisect_left(self.keyList, key)
+        if i < len(self.keyList) and self.keyList[i] == key:
+            return i
+        return -1
+
+    def __getitem__(self, key):
+        i = self.find(key)
+        if -1 == i:
+            raise KeyError(key)
+        return self.getValue(i)
+
+    def __contains__(self, key):
+        return -1 != self.find(key)
+
+    def __iter__(self):
+        return iter(self.keyList)
+
+    def __len__(self):
+        return len(self.keyList)
+
+
+class SongLines(collections.Mapping):
+    """ Order number -> line for one title, read from a range of song rows. """
+    def __init__(self, table, start, end, withDelay=False):
+        self.table = table
+        self.orders = table.array("order")
+        self.start = start
+        self.end = end
+        self.withDelay = withDelay
+
+    def find(self, order):
+        lo, hi = self.start, self.end
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.orders[mid] < order:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.end and self.orders[lo] == order:
+            return lo
+        return -1
+
+    def __getitem__(self, order):
+        try:
+            row = self.find(order)
+        except TypeError:
+            row = -1
+        if -1 == row:
+            raise KeyError(order)
+        quote = self.table.string("quote", row)
+        if self.withDelay:
+            return (quote, float(self.table.string("delay", row)))
+        return quote
+
+    def __iter__(self):
+        for row in xrange(self.start, self.end):
+            yield self.orders[row]
+
+    def __len__(self):
+        return self.end - self.start
+
+
+class CorpusTable(object):
+    def __init__(self, corpus, name, kind, sourceTime, arrays):
+        self.corpus = corpus
+        self.name = name
+        self.kind = kind
+        self.sourceTime = sourceTime
+        self.arrays = arrays
+
+    def array(self, name):
+        return self.arrays[name]
+
+    def string(self, arrayName, row):
+        return self.corpus.string(self.arrays[arrayName][row])
+
+    def isFresh(self, sourceFile):
+        try:
+            return os.path.getmtime(sourceFile) == self.sourceTime
+        except OSError:
+            return False
+
+    def strings(self, arrayName):
+        return StringList(self.corpus, self.arrays[arrayName])
+
+    def pairs(self, prefix):
+        """ Mapping over a "<prefix>Keys/Values" index. """
+        values = self.arrays[prefix + "Values"]
+        return SortedDict(self.corpus, self.arrays[prefix + "Keys"],
+                          lambda i: self.corpus.string(values[i]))
+
+    def ranges(self, prefix, getValue):
+        """ Mapping over a "<prefix>Keys/Start/End" index. """
+        start = self.arrays[prefix + "Start"]
+        end = self.arrays[prefix + "End"]
+        return SortedDict(self.corpus, self.arrays[prefix + "Keys"],
+                          lambda i: getValue(start[i], end[i]))
+
+
+class Corpus(object):
+    """ A compiled corpus file, memory-mapped read-only. """
+    def __init__(self, inputFile=FILE_CORPUS):
+        self.inputFile = inputFile
+        self.fileTime = os.path.getmtime(inputFile)
+        with open(inputFile, "rb") as fileHandler:
+            self.buf = mmap.mmap(fileHandler.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.settingsTime, stringCount, offsetsPos, self.blobPos, tableCount, tablePos = HEADER.unpack_from(self.buf, 0)
+        if MAGIC != magic or VERSION != version:
+            self.buf.close()
+            raise ValueError("{f} is not a version {v} corpus.".format(f=inputFile, v=VERSION))
+
+        self.offsets = UIntArray(self.buf, offsetsPos, stringCount + 1)
+        self.tables = {}
+        for t in xrange(tableCount):
+            nameId, kind, sourceTime, arrayCount, arrayPos = TABLE_ENTRY.unpack_from(self.buf, tablePos + t * TABLE_ENTRY.size)
+            arrays = {}
+            for a in xrange(arrayCount):
+                arrayName, length, dataPos = ARRAY_ENTRY.unpack_from(self.buf, arrayPos + a * ARRAY_ENTRY.size)
+                arrays[self.string(arrayName)] = UIntArray(self.buf, dataPos, length)
+            name = self.string(nameId)
+            self.tables[name] = CorpusTable(self, name, kind, sourceTime, arrays)
+
+    def string(self, stringId):
+        return self.buf[self.blobPos + self.offsets[stringId]:self.blobPos + self.offsets[stringId + 1]]
+
+    def table(self, sourceFile):
+        """ Table compiled from sourceFile, or None if missing or out of date. """
+        table = self.tables.get(os.path.basename(sourceFile))
+        if table and table.isFresh(sourceFile):
+            return table
+        return None
+
+    def isStale(self):
+        try:
+            return (os.path.getmtime(self.inputFile) != self.fileTime or
+                    os.path.getmtime(FILE_SETTINGS) != self.settingsTime)
+        except OSError:
+            return True
+
+    def close(self):
+        self.buf.close()
+
+
+_corpus = None
+_corpusLock = threading.Lock()
+
+def getCorpus():
+    """ Shared Corpus for this process, reopened if the file was recompiled. """
+    global _corpus
+    if not enabled:
+        return None
+    with _corpusLock:
+        if _corpus and _corpus.isStale():
+            ## Don't close the old map; phrase objects from before the reload may still read it.
+            _corpus = None
+        if not _corpus and os.path.isfile(FILE_CORPUS):
+            try:
+                _corpus = Corpus(FILE_CORPUS)
+                if _corpus.isStale():
+                    _corpus = None
+            except (IOError, ValueError, struct.error):
+                _corpus = None
+        return _corpus
+
+def getTable(sourceFile):
+    corpus = getCorpus()
+    if corpus:
+        return corpus.table(sourceFile)
+    return None
+
+
+#### ---- Compiling ---- ####
+class CorpusWriter(object):
+    def __init__(self):
+        self.stringIds = {}
+        self.strings = []
+        self.tables = []
+
+    def stringId(self, s):
+        if isinstance(s, unicode):
+            s = s.encode("utf-8")
+        s = str(s)
+        try:
+            return self.stringIds[s]
+        except KeyError:
+            self.stringIds[s] = len(self.strings)
+            self.strings.append(s)
+            return self.stringIds[s]
+
+    def addTable(self, name, kind, sourceFile, arrays):
+        """ arrays: {array name: list of ints} """
+        self.tables.append((name, kind, os.path.getmtime(sourceFile), arrays))
+
+    def addPhrases(self, phrases):
+        arrays = {}
+        for col in phrases.columns:
+            arrays["col:" + col] = [self.stringId(p) for p in phrases.columns[col]]
+        self.addTable(os.path.basename(phrases.inputFile), KIND_PHRASES, phrases.inputFile, arrays)
+
+    def addSongs(self, songs, withDelay=False):
+        titles = sorted(t for t in songs.byTitle)
+        ## Row i's title is "title"[i] as a string, and "titleKeys"["titleIndex"][i] by position.
+        arrays = {"title": [], "titleIndex": [], "order": [], "quote": [], "delay": [],
+                  "titleKeys": [], "titleStart": [], "titleEnd": []}
+        for titleIndex, t in enumerate(titles):
+            arrays["titleKeys"].append(self.stringId(t))
+            arrays["titleStart"].append(len(arrays["order"]))
+            for order in sorted(o for o in songs.byTitle[t] if isinstance(o, int)):
+                line = songs.byTitle[t][order]
+                if withDelay:
+                    line, delay = line
+                    arrays["delay"].append(self.stringId(repr(float(delay))))
+                arrays["title"].append(self.stringId(t))
+                arrays["titleIndex"].append(titleIndex)
+                arrays["order"].append(order)
+                arrays["quote"].append(self.stringId(line))
+            arrays["titleEnd"].append(len(arrays["order"]))
+
+        arrays["workKeys"], arrays["workStart"], arrays["workEnd"], arrays["workTitles"] = [], [], [], []
+        for w in sorted(songs.byWork):
+            arrays["workKeys"].append(self.stringId(w))
+            arrays["workStart"].append(len(arrays["workTitles"]))
+            arrays["workTitles"].extend(self.stringId(t) for t in songs.byWork[w])
+            arrays["workEnd"].append(len(arrays["workTitles"]))
+
+        for name, dumbDict in (("dumbTitle", songs.dumbedTitle), ("dumbWork", songs.dumbedWork)):
+            keys = sorted(dumbDict)
+            arrays[name + "Keys"] = [self.stringId(k) for k in keys]
+            arrays[name + "Values"] = [self.stringId(dumbDict[k]) for k in keys]
+
+        self.addTable(os.path.basename(songs.inputFile), KIND_SONGS, songs.inputFile, arrays)
+
+    def addRecords(self, records):
+        keys = sorted(records.keyValues)
+        columns = sorted(records.columns)
+        arrays = {"keys": [self.stringId(k) for k in keys]}
+        for col in columns:
+            arrays["col:" + col] = [self.stringId(records.keyValues[k].get(col, "")) for k in keys]
+        self.addTable(os.path.basename(records.inputFile), KIND_RECORDS, records.inputFile, arrays)
+
+    def write(self, outputFile):
+        ## Intern every name before laying out the string table.
+        for name, kind, sourceTime, arrays in self.tables:
+            self.stringId(name)
+            for arrayName in arrays:
+                self.stringId(arrayName)
+
+        offsets = [0]
+        for s in self.strings:
+            offsets.append(offsets[-1] + len(s))
+        blob = "".join(self.strings)
+
+        pos = HEADER.size
+        offsetsPos = pos
+        pos += 4 * len(offsets)
+        blobPos = pos
+        pos += len(blob)
+        pos += -pos % 4
+
+        tableDirPos = pos
+        pos += TABLE_ENTRY.size * len(self.tables)
+        arrayDirs = []
+        for name, kind, sourceTime, arrays in self.tables:
+            arrayDirs.append(pos)
+            pos += ARRAY_ENTRY.size * len(arrays)
+
+        chunks = []
+        tableDir = []
+        arrayDir = []
+        for (name, kind, sourceTime, arrays), arrayDirPos in zip(self.tables, arrayDirs):
+            tableDir.append(TABLE_ENTRY.pack(self.stringId(name), kind, sourceTime, len(arrays), arrayDirPos))
+            for arrayName in sorted(arrays):
+                values = arrays[arrayName]
+                arrayDir.append(ARRAY_ENTRY.pack(self.stringId(arrayName), len(values), pos))
+                chunks.append(struct.pack("<{n}I".format(n=len(values)), *values))
+                pos += 4 * len(values)
+
+        tmpFile = outputFile + ".tmp"
+        with open(tmpFile, "wb") as fileHandler:
+            fileHandler.write(HEADER.pack(MAGIC, VERSION, os.path.getmtime(FILE_SETTINGS), len(self.strings),
+                                          offsetsPos, blobPos, len(self.tables), tableDirPos))
+            fileHandler.write(struct.pack("<{n}I".format(n=len(offsets)), *offsets))
+            fileHandler.write(blob)
+            fileHandler.write("\0" * (-(blobPos + len(blob)) % 4))
+            fileHandler.write("".join(tableDir))
+            fileHandler.write("".join(arrayDir))
+            fileHandler.write("".join(chunks))
+        ## Swap the file in whole so running bots never map a half-written corpus.
+        os.rename(tmpFile, outputFile)
+
+        return pos
+
+
+def compileCorpus(outputFile=FILE_CORPUS):
+    """ Parse every text file in the database and write them into one corpus file. """
+    global enabled
+    import PhraseGetter
+
+    wasEnabled = enabled
+    enabled = False
+    try:
+        writer = CorpusWriter()
+        for cls in (PhraseGetter.Reaction, PhraseGetter.Subject, PhraseGetter.Greeting,
+                    PhraseGetter.Gossip, PhraseGetter.Idle, PhraseGetter.Meta):
+            writer.addPhrases(cls())
+        writer.addSongs(PhraseGetter.Song())
+        writer.addSongs(PhraseGetter.SingAlong())
+        writer.addSongs(PhraseGetter.Recital(), withDelay=True)
+        for cls in (PhraseGetter.Quote, PhraseGetter.Link, PhraseGetter.HelpMe, PhraseGetter.User):
+            records = cls()
+            if os.path.isfile(records.inputFile):
+                writer.addRecords(records)
+        size = writer.write(outputFile)
+    finally:
+        enabled = wasEnabled
+
+    return size, len(writer.tables), len(writer.strings)
+
+
+if __name__ == "__main__":
+    ## Go through the imported module so PhraseGetter sees the same "enabled" flag.
+    import Corpus
+
+    argParser = argparse.ArgumentParser(description="MeatBot corpus tools.")
+    subParsers = argParser.add_subparsers(dest="command")
+    compileParser = subParsers.add_parser("compile-corpus", help="Compile the database text files into one binary corpus.")
+    compileParser.add_argument("-o", "--output", default=FILE_CORPUS)
+    args = argParser.parse_args()
+
+    if "compile-corpus" == args.command:
+        size, numTables, numStrings = Corpus.compileCorpus(args.output)
+        print("Wrote {f}: {t} tables, {s} strings, {b} bytes.".format(f=args.output, t=numTables, s=numStrings, b=size))
@@ -0,0 +1,564 @@
+import os
+import re
+import sys
+import time
+import random
+import select
+import socket
+import argparse
+import threading
+import subprocess
+import BaseHTTPServer
+
+import Settings
+
+SERVER_NAME = "fake.irc"
+
+## How often each kind of swarm event happens, relative to the others.
+DEFAULT_MIX = {"chat": 50, "join": 10, "part": 6, "nick": 4, "quit": 3,
+               "sing": 4, "quote": 4, "url": 0, "probe": 10}
+
+CHATTER = ["hi all", "anyone here?", "lol", "brb", "that's what she said", "good morning",
+           "did you see that?", "I think so", "no way", "ok", "whoa", "because reasons"]
+
+CAPS = ("account-tag", "extended-join", "account-notify", "multi-prefix", "batch")
+
+
+class BotClient(object):
+    """ The bot's connection, as the server sees it. """
+    def __init__(self, sock):
+        self.sock = sock
+        self.inBuffer = ""
+        self.outBuffer = ""
+        self.nick = ""
+        self.registered = False
+        self.channels = set()
+        self.caps = set()
+        self.negotiating = False
+        self.gotUser = False
+
+
+class SoakStats(object):
+    def __init__(self):
+        self.events = {}
+        self.linesFromBot = 0
+        self.probesSent = 0
+        self.latencies = []
+        self.dropped = 0
+        self.duplicated = 0
+        self.cpuSamples = []
+        self.rssSamples = []
+        self.whois = 0
+        self.drops = 0
+        self.refused = 0
+        ## Seconds from each drop to the bot being back in all its channels.
+        self.reconnects = []
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        def pct(fraction):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+
+        lines = ["Events sent: {e}".format(e=", ".join("{k} {v}".format(k=k, v=self.events[k]) for k in sorted(self.events))),
+                 "Lines from bot: {n}, WHOIS among them: {w}".format(n=self.linesFromBot, w=self.whois),
+                 "Probes: {s} sent, {a} answered, {d} dropped, {u} duplicated".format(s=self.probesSent, a=len(latencies),
+                                                                                     d=self.dropped, u=self.duplicated),
+                 "Reply latency: p50 {a:.1f} ms, p90 {b:.1f} ms, p99 {c:.1f} ms, max {d:.1f} ms".format(a=pct(0.5), b=pct(0.9),
+                                                                                                         c=pct(0.99), d=pct(1.0))]
+        if self.drops:
+            times = sorted(self.reconnects)
+            lines.append("Drops: {d}, refused {r} connections, {n} reconnects".format(d=self.drops, r=self.refused, n=len(times)) +
+                         (", back in all channels after min {a:.1f} s, median {m:.1f} s, max {b:.1f} s".format(a=times[0],
+                                                                                                               m=times[len(times) // 2],
+                                                                                                               b=times[-1]) if times else ""))
+        if self.cpuSamples:
+            lines.append("Bot CPU: avg {a:.1f}%, max {m:.1f}%".format(a=sum(self.cpuSamples) / len(self.cpuSamples),
+                                                                      m=max(self.cpuSamples)))
+        if self.rssSamples:
+            lines.append("Bot RSS: start {s} KB, end {e} KB, max {m} KB".format(s=self.rssSamples[0], e=self.rssSamples[-1],
+                                                                              m=max(self.rssSamples)))
+
+        return "\n".join(lines)
+
+
+class ProcessSampler(object):
+    """ CPU and RSS of another process, read from /proc (Linux only). """
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.lastCpu = None
+        self.lastTime = None
+
+    def sample(self):
+        """ (CPU % since the last sample, RSS in KB), or None if /proc isn't there. """
+        try:
+            with open("/proc/{p}/stat".format(p=self.pid)) as fileHandler:
+                fields = fileHandler.read().rsplit(")", 1)[1].split()
+            with open("/proc/{p}/status".format(p=self.pid)) as fileHandler:
+                rss = int(re.search(r"VmRSS:\s+(\d+)", fileHandler.read()).group(1))
+        except (IOError, AttributeError):
+            return None
+        cpu = float(int(fields[11]) + int(fields[12])) / self.ticks
+        now = time.time()
+        percent = 0.0
+        if self.lastTime:
+            percent = 100 * (cpu - self.lastCpu) / (now - self.lastTime)
+        self.lastCpu, self.lastTime = cpu, now
+
+        return percent, rss
+
+
+class FakeIrcServer(object):
+    """ Just enough of an IRC server for GreetBot, with a swarm of simulated users. """
+    def __init__(self, port=0, owner="", numUsers=1000, numChannels=100, rate=50.0, mix=None,
+                 burstEvery=0, burstSize=0, probeTimeout=10.0, httpPort=0, seed=0, dropEvery=0, refuseFor=0, caps=CAPS):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", port))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+
+        self.owner = owner
+        self.rate = rate
+        self.mix = mix or DEFAULT_MIX
+        self.burstEvery = burstEvery
+        self.burstSize = burstSize
+        self.probeTimeout = probeTimeout
+        self.httpPort = httpPort
+        ## IRCv3 capabilities offered to the bot; every simulated user is logged in as their nick.
+        self.caps = caps
+        ## Every dropEvery seconds, cut the bot off and turn it away for refuseFor seconds.
+        self.dropEvery = dropEvery
+        self.refuseFor = refuseFor
+        self.refuseUntil = 0
+        ## When the last drop happened and how many channels the bot was in, until it's back in them.
+        self.droppedAt = None
+        self.rejoinTarget = 0
+        self.random = random.Random(seed)
+        self.init = Settings.getKeywords()
+
+        self.clients = []
+        self.stats = SoakStats()
+        self.sampler = None
+        self.running = False
+
+        ## Simulated users: nick -> set of channels, and channel -> set of nicks.
+        self.channels = dict(("#chan{n}".format(n=n), set()) for n in xrange(numChannels))
+        self.users = {}
+        self.nextUser = 0
+        for _ in xrange(numUsers):
+            nick = self.newNick()
+            self.users[nick] = set()
+            for chan in self.random.sample(sorted(self.channels), min(3, numChannels)):
+                self.users[nick].add(chan)
+                self.channels[chan].add(nick)
+
+        ## (channel, number of dice) -> time sent, for "!dice Nd100" probes.
+        ## The number of dice in a reply says which probe it answers.
+        self.probes = {}
+        self.answered = set()
+        self.probeKey = 0
+
+    def newNick(self):
+        self.nextUser += 1
+        return "user{n}".format(n=self.nextUser)
+
+    #### ---- Talking to the bot ---- ####
+    def send(self, client, line):
+        client.outBuffer += line + "\r\n"
+
+    def numeric(self, client, code, text):
+        self.send(client, ":{s} {c} {n} {t}".format(s=SERVER_NAME, c=code, n=client.nick or "*", t=text))
+
+    def sendNames(self, client, chan):
+        names = sorted(self.channels[chan])
+        line = []
+        for nick in names + [client.nick]:
+            line.append(nick)
+            if 400 < sum(len(n) + 1 for n in line):
+                self.numeric(client, "353", "= {c} :{n}".format(c=chan, n=" ".join(line)))
+                line = []
+        if line:
+            self.numeric(client, "353", "= {c} :{n}".format(c=chan, n=" ".join(line)))
+        self.numeric(client, "366", "{c} :End of /NAMES list.".format(c=chan))
+
+    def welcome(self, client):
+        client.registered = True
+        self.numeric(client, "001", ":Welcome to the fake network, {n}".format(n=client.nick))
+        self.numeric(client, "002", ":Your host is {s}".format(s=SERVER_NAME))
+        self.numeric(client, "003", ":This server was created today")
+        self.numeric(client, "004", "{s} fake-1.0 iow ovmntk".format(s=SERVER_NAME))
+        self.numeric(client, "005", "CHANTYPES=# PREFIX=(ov)@+ NETWORK=Fake CASEMAPPING=rfc1459 LINELEN=512 :are supported by this server")
+        self.numeric(client, "375", ":- {s} Message of the Day -".format(s=SERVER_NAME))
+        self.numeric(client, "372", ":- Be nice to the robots.")
+        self.numeric(client, "376", ":End of /MOTD command.")
+
+    def handleLine(self, client, line):
+        self.stats.linesFromBot += 1
+        parts = line.split(" :", 1)
+        words = parts[0].split()
+        if not words:
+            return
+        command = words[0].upper()
+        trailing = parts[1] if len(parts) > 1 else ""
+
+        if "NICK" == command:
+            newNick = (words[1:] or [trailing])[0]
+            if client.registered and newNick != client.nick:
+                self.send(client, ":{o}!bot@fake NICK :{n}".format(o=client.nick, n=newNick))
+            client.nick = newNick
+        elif "USER" == command:
+            client.gotUser = True
+            if not client.registered and not client.negotiating:
+                self.welcome(client)
+        elif "CAP" == command:
+            subcommand = words[1].upper() if len(words) > 1 else ""
+            if "LS" == subcommand:
+                client.negotiating = True
+                self.send(client, ":{s} CAP * LS :{c}".format(s=SERVER_NAME, c=" ".join(self.caps)))
+            elif "REQ" == subcommand:
+                wanted = trailing.split()
+                if set(wanted) <= set(self.caps):
+                    client.caps.update(wanted)
+                    self.send(client, ":{s} CAP * ACK :{c}".format(s=SERVER_NAME, c=" ".join(wanted)))
+                else:
+                    self.send(client, ":{s} CAP * NAK :{c}".format(s=SERVER_NAME, c=" ".join(wanted)))
+            elif "END" == subcommand:
+                client.negotiating = False
+                if client.gotUser and not client.registered:
+                    self.welcome(client)
+        elif "PING" == command:
+            self.send(client, ":{s} PONG {s} :{t}".format(s=SERVER_NAME, t=trailing or " ".join(words[1:])))
+        elif "JOIN" == command:
+            for chan in words[1].split(","):
+                if chan.lower() not in self.channels:
+                    self.channels[chan.lower()] = set()
+                client.channels.add(chan.lower())
+                self.send(client, ":{n}!bot@fake JOIN {c}".format(n=client.nick, c=chan))
+                self.sendNames(client, chan.lower())
+        elif "PART" == command:
+            for chan in words[1].split(","):
+                client.channels.discard(chan.lower())
+        elif "WHOIS" == command:
+            self.stats.whois += 1
+            nick = words[-1]
+            account = self.owner if nick.lower() == self.owner.lower() else nick
+            self.numeric(client, "311", "{n} {n} fake * :{n}".format(n=nick))
+            self.numeric(client, "312", "{n} {s} :Fake server".format(n=nick, s=SERVER_NAME))
+            self.numeric(client, "330", "{n} {a} :is logged in as".format(n=nick, a=account))
+            self.numeric(client, "318", "{n} :End of /WHOIS list.".format(n=nick))
+        elif "PRIVMSG" == command and "nickserv" == words[1].lower():
+            if trailing.upper().startswith("GHOST"):
+                self.send(client, ":NickServ!services@fake NOTICE {n} :{g} is not online.".format(n=client.nick,
+                                                                                                  g=trailing.split()[1]))
+            else:
+                self.send(client, ":NickServ!services@fake NOTICE {n} :You are now identified.".format(n=client.nick))
+        elif "PRIVMSG" == command:
+            self.checkProbe(words[1].lower(), trailing)
+
+    def checkProbe(self, chan, text):
+        if not re.match(r"^\d+(, \d+)*$", text):
+            return
+        key = (chan, text.count(",") + 1)
+        if key in self.probes:
+            self.stats.latencies.append(time.time() - self.probes.pop(key))
+            self.answered.add(key)
+        elif key in self.answered:
+            self.stats.duplicated += 1
+
+    #### ---- The swarm ---- ####
+    def broadcast(self, chan, line, account=None, extendedJoin=""):
+        ## account: tag the line with it for bots that asked for account-tag.
+        ## extendedJoin: what a JOIN carries on the end for bots that asked for extended-join.
+        for client in self.clients:
+            if chan is None or chan in client.channels:
+                out = line
+                if extendedJoin and "extended-join" in client.caps:
+                    out += extendedJoin
+                if account and "account-tag" in client.caps:
+                    out = "@account={a} {l}".format(a=account, l=out)
+                self.send(client, out)
+
+    def sharesChannel(self, nick):
+        return any(self.users[nick] & client.channels for client in self.clients)
+
+    def say(self, nick, chan, text):
+        self.broadcast(chan, ":{n}!user@fake PRIVMSG {c} :{t}".format(n=nick, c=chan, t=text), nick)
+
+    def event(self, kind):
+        commands = self.init["Commands"]
+        botChannels = sorted(set().union(*[c.channels for c in self.clients])) or sorted(self.channels)
+        chan = self.random.choice(botChannels)
+        members = sorted(self.channels.get(chan, ()))
+
+        if "join" == kind:
+            nick = self.random.choice(sorted(self.users))
+            if chan in self.users[nick]:
+                return
+            self.users[nick].add(chan)
+            self.channels[chan].add(nick)
+            self.broadcast(chan, ":{n}!user@fake JOIN {c}".format(n=nick, c=chan), nick,
+                           " {a} :{n}".format(a=nick, n=nick))
+        elif "part" == kind and members:
+            nick = self.random.choice(members)
+            self.users[nick].discard(chan)
+            self.channels[chan].discard(nick)
+            self.broadcast(chan, ":{n}!user@fake PART {c} :bye".format(n=nick, c=chan))
+        elif "quit" == kind and members:
+            nick = self.random.choice(members)
+            if self.sharesChannel(nick):
+                self.broadcast(None, ":{n}!user@fake QUIT :Quit: gone".format(n=nick), nick)
+            for c in self.users.pop(nick):
+                self.channels[c].discard(nick)
+            self.users[self.newNick()] = set()
+        elif "nick" == kind and members:
+            nick = self.random.choice(members)
+            newNick = self.newNick()
+            if self.sharesChannel(nick):
+                self.broadcast(None, ":{o}!user@fake NICK :{n}".format(o=nick, n=newNick), nick)
+            self.users[newNick] = self.users.pop(nick)
+            for c in self.users[newNick]:
+                self.channels[c].discard(nick)
+                self.channels[c].add(newNick)
+        elif members:
+            nick = self.random.choice(members)
+            if "chat" == kind:
+                self.say(nick, chan, self.random.choice(CHATTER))
+            elif "sing" == kind:
+                self.say(nick, chan, commands["sing"])
+            elif "quote" == kind:
+                self.say(nick, chan, commands["quote"])
+            elif "url" == kind and self.httpPort:
+                self.say(nick, chan, "look at this http://127.0.0.1:{p}/{n}".format(p=self.httpPort, n=self.random.randint(1, 1000)))
+            elif "probe" == kind:
+                ## 50 dice at most, so the reply fits in one of say()'s 300 character lines.
+                self.probeKey = self.probeKey % 50 + 1
+                key = (chan, self.probeKey)
+                if key in self.probes:
+                    return
+                self.answered.discard(key)
+                self.probes[key] = time.time()
+                self.stats.probesSent += 1
+                self.say(nick, chan, "{d} {n}d100".format(d=commands["roll"], n=self.probeKey))
+            else:
+                return
+        else:
+            return
+        self.stats.events[kind] = self.stats.events.get(kind, 0) + 1
+
+    def pickEvent(self):
+        total = sum(self.mix.values())
+        pick = self.random.uniform(0, total)
+        for kind in sorted(self.mix):
+            pick -= self.mix[kind]
+            if pick <= 0:
+                return kind
+        return "chat"
+
+    def expireProbes(self):
+        now = time.time()
+        for key, sent in self.probes.items():
+            if self.probeTimeout < now - sent:
+                del self.probes[key]
+                self.stats.dropped += 1
+
+    def dropClients(self, now):
+        self.rejoinTarget = max(len(c.channels) for c in self.clients)
+        for client in self.clients:
+            client.sock.close()
+        self.clients = []
+        self.stats.drops += 1
+        self.droppedAt = now
+        self.refuseUntil = now + self.refuseFor
+
+    def checkRejoined(self, now):
+        if any(self.rejoinTarget <= len(c.channels) for c in self.clients):
+            self.stats.reconnects.append(now - self.droppedAt)
+            self.droppedAt = None
+
+    #### ---- Main loop ---- ####
+    def serve(self, duration, reportEvery=10.0, output=sys.stdout):
+        self.running = True
+        started = lastTick = lastReport = lastSample = lastBurst = lastPing = lastDrop = time.time()
+        owed = 0.0
+        while self.running and time.time() - started < duration:
+            sockets = [self.listener] + [c.sock for c in self.clients]
+            writers = [c.sock for c in self.clients if c.outBuffer]
+            readable, writable, broken = select.select(sockets, writers, [], 0.01)
+
+            for sock in readable:
+                if sock is self.listener:
+                    newSock, address = self.listener.accept()
+                    if time.time() < self.refuseUntil:
+                        newSock.close()
+                        self.stats.refused += 1
+                        continue
+                    self.clients.append(BotClient(newSock))
+                    continue
+                client = [c for c in self.clients if c.sock is sock][0]
+                try:
+                    data = sock.recv(65536)
+                except socket.error:
+                    data = ""
+                if not data:
+                    self.clients.remove(client)
+                    sock.close()
+                    continue
+                client.inBuffer += data
+                while "\n" in client.inBuffer:
+                    line, client.inBuffer = client.inBuffer.split("\n", 1)
+                    if line.strip():
+                        self.handleLine(client, line.strip())
+
+            for sock in writable:
+                client = [c for c in self.clients if c.sock is sock][0]
+                try:
+                    sent = sock.send(client.outBuffer)
+                    client.outBuffer = client.outBuffer[sent:]
+                except socket.error:
+                    pass
+
+            now = time.time()
+            if [c for c in self.clients if c.channels]:
+                ## Only start the swarm once the bot has joined something.
+                owed += self.rate * (now - lastTick)
+                while 1 <= owed:
+                    self.event(self.pickEvent())
+                    owed -= 1
+                if self.burstEvery and self.burstEvery <= now - lastBurst:
+                    for _ in xrange(self.burstSize):
+                        self.event(self.random.choice(["sing", "quote", "url"]))
+                    lastBurst = now
+            lastTick = now
+
+            if 60 <= now - lastPing:
+                for client in self.clients:
+                    self.send(client, "PING :{s}".format(s=SERVER_NAME))
+                lastPing = now
+
+            if self.droppedAt:
+                self.checkRejoined(now)
+                lastDrop = now
+            elif self.dropEvery and self.dropEvery <= now - lastDrop and [c for c in self.clients if c.channels]:
+                self.dropClients(now)
+
+            if 1 <= now - lastSample:
+                self.expireProbes()
+                if self.sampler:
+                    sample = self.sampler.sample()
+                    if sample:
+                        self.stats.cpuSamples.append(sample[0])
+                        self.stats.rssSamples.append(sample[1])
+                lastSample = now
+            if reportEvery <= now - lastReport:
+                output.write("[{t:.0f}s] {n} events, {p} probes answered, {d} dropped\n".format(t=now - started,
+                                                                                                n=sum(self.stats.events.values()),
+                                                                                                p=len(self.stats.latencies),
+                                                                                                d=self.stats.dropped))
+                lastReport = now
+
+        self.stats.dropped += len(self.probes)
+        self.probes.clear()
+        self.running = False
+
+        return self.stats
+
+    def close(self):
+        for client in self.clients:
+            client.sock.close()
+        self.listener.close()
+
+
+class PageHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Gives every URL in the swarm's chatter a page with a title to fetch. """
+    def do_GET(self):
+        body = "<html><head><title>Page {p}</title></head><body>Hi.</body></html>".format(p=self.path.strip("/"))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+BOT_SCRIPT = """
+import sys, time
+sys.path.insert(0, {path!r})
+import Settings
+Settings.getKeywords().setdefault("Logging", {{}})["console"] = "no"
+Settings.getKeywords().setdefault("State", {{}})["checkpoint"] = ""
+import ClassyBot
+bot = ClassyBot.GreetBot("127.0.0.1", {port}, {channels!r}, {nick!r}, {owner!r}, "")
+bot.daemon = True
+bot.start()
+while True:
+    time.sleep(1)
+"""
+
+def startBot(port, channels, nick, owner):
+    script = BOT_SCRIPT.format(path=os.path.dirname(os.path.abspath(__file__)), port=port,
+                               channels=channels, nick=nick, owner=owner)
+    devNull = open(os.devnull, "w")
+    return subprocess.Popen([sys.executable, "-c", script], stdout=devNull, stderr=devNull)
+
+def parseMix(text):
+    mix = dict(DEFAULT_MIX)
+    for item in text.split(","):
+        if "=" in item:
+            kind, weight = item.split("=", 1)
+            mix[kind.strip()] = float(weight)
+    return mix
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Soak-test GreetBot against a local fake IRC server and user swarm.")
+    argParser.add_argument("--port", type=int, default=0)
+    argParser.add_argument("--duration", type=float, default=60, help="Seconds to run.")
+    argParser.add_argument("--users", type=int, default=1000)
+    argParser.add_argument("--channels", type=int, default=100, help="Channels the bot is told to join.")
+    argParser.add_argument("--rate", type=float, default=50, help="Swarm events per second.")
+    argParser.add_argument("--mix", default="", help="Event weights, e.g. \"chat=50,join=10,sing=5,probe=10\".")
+    argParser.add_argument("--burst-every", type=float, default=0, help="Seconds between !sing/!quote/URL bursts.")
+    argParser.add_argument("--burst-size", type=int, default=0)
+    argParser.add_argument("--probe-timeout", type=float, default=10)
+    argParser.add_argument("--urls", action="store_true", help="Serve pages for URLs in the chatter.")
+    argParser.add_argument("--nick", default="MeatBot")
+    argParser.add_argument("--owner", default="owner")
+    argParser.add_argument("--seed", type=int, default=0)
+    argParser.add_argument("--drop-every", type=float, default=0, help="Seconds between cutting the bot's connection.")
+    argParser.add_argument("--refuse-for", type=float, default=0, help="Seconds to turn the bot away after cutting it off.")
+    argParser.add_argument("--no-caps", action="store_true", help="Offer no IRCv3 capabilities, so the bot has to WHOIS.")
+    argParser.add_argument("--external", action="store_true", help="Don't start a bot; wait for one to connect.")
+    args = argParser.parse_args()
+
+    httpPort = 0
+    if args.urls:
+        pageServer = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), PageHandler)
+        httpPort = pageServer.server_address[1]
+        pageThread = threading.Thread(target=pageServer.serve_forever)
+        pageThread.daemon = True
+        pageThread.start()
+
+    mix = parseMix(args.mix)
+    if args.urls and not mix.get("url"):
+        mix["url"] = 2
+    server = FakeIrcServer(args.port, args.owner, args.users, args.channels, args.rate, mix,
+                           args.burst_every, args.burst_size, args.probe_timeout, httpPort, args.seed,
+                           args.drop_every, args.refuse_for, () if args.no_caps else CAPS)
+    print("Fake IRC server on 127.0.0.1:{p}".format(p=server.port))
+
+    bot = None
+    if not args.external:
+        bot = startBot(server.port, sorted(server.channels), args.nick, args.owner)
+        server.sampler = ProcessSampler(bot.pid)
+    try:
+        stats = server.serve(args.duration)
+    finally:
+        if bot:
+            bot.kill()
+        server.close()
+    print(stats.report())
@@ -0,0 +1,148 @@
+import os.path
+import math
+import time
+import array
+import argparse
+import collections
+
+languageDir = os.path.join(os.path.dirname(__file__), "database")
+FILE_TRAINING = os.path.join(languageDir, "Languages.txt")
+FILE_SAMPLES = os.path.join(languageDir, "LanguageSamples.txt")
+
+## Lengths of the character n-grams the model counts.
+ORDERS = (1, 2, 3)
+## Added to every n-gram's count, so one a language never had doesn't rule it out.
+SMOOTHING = 0.1
+
+
+def grams(text):
+    """ The character n-grams of text's words, lowercased, with a space either side of each word. """
+    if not isinstance(text, unicode):
+        text = text.decode("utf-8", "replace")
+    cleaned = u"".join(char if char.isalpha() else u" " for char in text.lower())
+    for word in cleaned.split():
+        word = u" {w} ".format(w=word)
+        for n in ORDERS:
+            for i in xrange(len(word) - n + 1):
+                gram = word[i:i + n]
+                if u" " != gram:
+                    yield gram
+
+def readSamples(path):
+    """ (language code, text) for each line of a tab-separated file with a "lang	text" header. """
+    samples = []
+    with open(path, "r") as fileHandler:
+        next(fileHandler, None)
+        for line in fileHandler:
+            code, _, text = line.rstrip("\r\n").partition("\t")
+            if code and text:
+                samples.append((code, text.decode("utf-8")))
+    return samples
+
+
+class LanguageDetector(object):
+    """ Names the language of a line of text from the character n-grams in it, offline.
+
+    A naive Bayes model over the n-grams of the training samples. It's kept sparse: each n-gram
+    lists only the languages that used it, with how much likelier it makes each of them than a
+    language that never did, so a line costs a few dictionary lookups and additions per character.
+    The lists are packed into flat arrays, one entry per (n-gram, language) pair.
+    """
+    def __init__(self, codes=None, path=FILE_TRAINING):
+        counts = collections.defaultdict(collections.Counter)
+        for code, text in readSamples(path):
+            if codes is None or code in codes:
+                counts[code].update(grams(text))
+
+        self.languages = sorted(counts)
+        vocabulary = set()
+        for code in self.languages:
+            vocabulary.update(counts[code])
+        ## What an n-gram the language never used scores, per language.
+        self.floors = []
+        for code in self.languages:
+            total = sum(counts[code].values())
+            self.floors.append(math.log(SMOOTHING / (total + SMOOTHING * len(vocabulary))))
+
+        ## n-gram -> row; row k's (language, score above the floor) pairs are offsets[k] to offsets[k + 1].
+        self.index = {}
+        self.offsets = array.array("I", [0])
+        self.languageIds = array.array("B")
+        self.scores = array.array("f")
+        for gram in sorted(vocabulary):
+            self.index[gram] = len(self.offsets) - 1
+            for languageId, code in enumerate(self.languages):
+                count = counts[code].get(gram)
+                if count:
+                    self.languageIds.append(languageId)
+                    self.scores.append(math.log((count + SMOOTHING) / SMOOTHING))
+            self.offsets.append(len(self.languageIds))
+
+    def rank(self, text):
+        """ (log-likelihood, language code) for every language, best first. """
+        totals = [0.0] * len(self.languages)
+        seen = 0
+        index = self.index
+        offsets = self.offsets
+        languageIds = self.languageIds
+        scores = self.scores
+        for gram in grams(text):
+            seen += 1
+            row = index.get(gram)
+            if row is not None:
+                for i in xrange(offsets[row], offsets[row + 1]):
+                    totals[languageIds[i]] += scores[i]
+        ## Every n-gram counts the floor for every language; what's added above is the difference.
+        ranked = [(total + seen * floor, code) for total, floor, code in zip(totals, self.floors, self.languages)]
+        ranked.sort(reverse=True)
+        return ranked if seen else []
+
+    def detect(self, text):
+        """ The code of the likeliest language of text, or "" if there's nothing in it to tell by. """
+        ranked = self.rank(text)
+        return ranked[0][1] if ranked else ""
+
+
+def benchmark(detector, samples, rounds=20):
+    """ How many samples get the right language, and how long detection takes. """
+    right = 0
+    wrong = []
+    times = []
+    for code, text in samples:
+        found = detector.detect(text)
+        if found == code:
+            right += 1
+        else:
+            wrong.append((code, found, text))
+        for _ in xrange(rounds):
+            started = time.time()
+            detector.detect(text)
+            times.append(time.time() - started)
+    times.sort()
+    return right, wrong, times
+
+
+if __name__ == "__main__":
+    import Settings
+
+    argParser = argparse.ArgumentParser(description="Check the offline language detector against the bundled samples.")
+    argParser.add_argument("--samples", default=FILE_SAMPLES)
+    argParser.add_argument("--training", default=FILE_TRAINING)
+    argParser.add_argument("--rounds", type=int, default=20, help="Times each sample is detected for the timings.")
+    args = argParser.parse_args()
+
+    started = time.time()
+    detector = LanguageDetector(set(Settings.getKeywords()["Translate"].values()), args.training)
+    loaded = time.time() - started
+    samples = [(code, text) for code, text in readSamples(args.samples) if code in detector.languages]
+    right, wrong, times = benchmark(detector, samples, args.rounds)
+
+    print("{l} languages, {g} n-grams, {p} entries, loaded in {ms:.0f} ms".format(l=len(detector.languages), g=len(detector.index),
+                                                                               p=len(detector.scores), ms=loaded * 1000))
+    print("Accuracy: {r}/{n} ({p:.1%})".format(r=right, n=len(samples), p=float(right) / len(samples) if samples else 0))
+    for code, found, text in wrong:
+        print("  {c} taken for {f}: {t}".format(c=code, f=found or "nothing", t=text.encode("utf-8")))
+    if times:
+        print("Detection: mean {mean:.0f} us, p50 {p50:.0f} us, p99 {p99:.0f} us".format(mean=sum(times) / len(times) * 1e6,
+                                                                                       p50=times[len(times) // 2] * 1e6,
+                                                                                       p99=times[int(len(times) * 0.99)] * 1e6))
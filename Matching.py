@@ -0,0 +1,147 @@
+import re
+import time
+
+import Metrics
+
+try:
+    import re2
+except ImportError:
+    ## Without RE2, fuzzy patterns are never run; what people type is matched by canonical() instead.
+    re2 = None
+
+## Letters that might be draaaawnnn ouuut, so runs of them count as one.
+DRAWN_OUT = "aeghilmnorsuyzw"
+
+## Whole words that mean the same thing however they're spelled, and what they all become.
+SYNONYMS = ((re.compile(r"o+k$|o+ka+y+$"), "ok"),
+            (re.compile(r"whoah*$|woah*$|wh*ooh*$"), "whoa"),
+            (re.compile(r"hah*$"), "ha"),
+            (re.compile(r"cause$|cuz$|because$"), "cause"),
+            (re.compile(r"wa+n+a+$"), "wanna"),
+            (re.compile(r"go+n+a+$"), "gonna"))
+## Two words that mean the same as one: "want to" and "wanna", "going to" and "gonna".
+CONTRACTIONS = {("want", "to"): "wanna", ("goin", "to"): "gonna"}
+
+WORD = re.compile(r"[\w']+")
+
+## Canonical forms of corpus lines, which get searched over and over.
+CACHE_SIZE = 20000
+cache = {}
+
+
+def canonicalWord(word, fuzzy=True):
+    """ (canonical form, for each of its characters, how far into word it reaches). """
+    lowered = word.lower()
+    if not fuzzy:
+        return lowered.replace("'", ""), [i + 1 for i, char in enumerate(lowered) if "'" != char]
+    for synonym, canon in SYNONYMS:
+        if synonym.match(lowered):
+            return canon, [len(word)] * len(canon)
+    chars = []
+    ends = []
+    for i, char in enumerate(lowered):
+        ## Apostrophes, g-dropping ("runnin'" for "running"), "u" in "colour", and drawn-out letters
+        ## are skipped, with the character before stretching over them.
+        if ("'" == char or i and "g" == char
+                or "u" == char and chars and "o" == chars[-1] and "r" == lowered[i:].lstrip("u")[:1]
+                or chars and char == chars[-1] and char in DRAWN_OUT):
+            if ends:
+                ends[-1] = i + 1
+            continue
+        chars.append(char)
+        ends.append(i + 1)
+    return "".join(chars), ends
+
+def canonical(text, fuzzy=True):
+    """ (text as the matcher sees it, for each character of that, where it ends in text).
+
+    Case, spacing and punctuation are taken out, and if fuzzy, so are the usual ways of spelling
+    the same word differently. One plain substring search then stands in for the permissive pattern
+    that would otherwise have to be built from what someone typed.
+    Not fuzzy, words are kept apart by a space, so they match as words rather than letters.
+    """
+    known = cache.get((text, fuzzy))
+    if known:
+        return known
+    words = [(match.start(), match.group()) for match in WORD.finditer(text)]
+    canons = [canonicalWord(word, fuzzy) for start, word in words]
+    chars = []
+    ends = []
+    i = 0
+    while i < len(words):
+        canon, wordEnds = canons[i]
+        start = words[i][0]
+        if not fuzzy and i:
+            chars.append(" ")
+            ends.append(start)
+        elif fuzzy and i + 1 < len(words) and (canon, canons[i + 1][0]) in CONTRACTIONS:
+            canon = CONTRACTIONS[(canon, canons[i + 1][0])]
+            nextStart, nextWord = words[i + 1]
+            wordEnds = [nextStart - start + len(nextWord)] * len(canon)
+            i += 1
+        chars.append(canon)
+        ends.extend(start + end for end in wordEnds)
+        i += 1
+
+    known = ("".join(chars), ends)
+    if CACHE_SIZE <= len(cache):
+        cache.clear()
+    cache[(text, fuzzy)] = known
+    return known
+
+
+class Query(object):
+    """ Something someone typed, to be looked for in lines of text.
+
+    Matching takes time in proportion to the text, whatever was typed: it's canonical() and a
+    substring search, or an RE2 pattern (which can't backtrack) if RE2 is installed and a pattern is given.
+    A query also carries a time budget for the whole search it's used in.
+    """
+    def __init__(self, text, pattern=None, budget=None, fuzzy=True):
+        self.text = text
+        self.fuzzy = fuzzy
+        self.needle = canonical(text, fuzzy)[0]
+        self.regex = None
+        if pattern and fuzzy and re2:
+            try:
+                self.regex = re2.compile(pattern)
+            except Exception:
+                self.regex = None
+        self.deadline = time.time() + budget if budget else None
+        self.cutShort = False
+
+    def __nonzero__(self):
+        return bool(self.needle)
+
+    def end(self, text):
+        """ Where the first match in text ends, or -1 if there isn't one. """
+        if self.regex:
+            found = self.regex.search(text)
+            return found.end() if found else -1
+        haystack, ends = canonical(text, self.fuzzy)
+        found = haystack.find(self.needle)
+        if -1 == found or not self.needle:
+            return found
+        return ends[found + len(self.needle) - 1]
+
+    def search(self, text):
+        return -1 != self.end(text)
+
+    def rest(self, text):
+        """ What's left of text after the first match, or None if there isn't one. """
+        end = self.end(text)
+        return None if -1 == end else text[end:]
+
+    def equals(self, text):
+        """ Whether text says the same thing, as a whole. """
+        return self.needle == canonical(text, self.fuzzy)[0]
+
+    def expired(self):
+        """ Whether the search has used up its budget; it should stop there, with whatever it's found. """
+        if not self.cutShort and self.deadline and self.deadline < time.time():
+            Metrics.registry.inc("match_budget_exceeded_total")
+            self.cutShort = True
+        return self.cutShort
+
+
+Metrics.registry.describe("match_budget_exceeded_total", "Searches for user-typed text cut short by their time budget.")
@@ -0,0 +1,243 @@
+import os
+import time
+import bisect
+import threading
+import SocketServer
+import BaseHTTPServer
+
+## Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter(object):
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Histogram(object):
+    """ Fixed buckets, so observing is one bisect and a few additions. """
+    kind = "histogram"
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.total += value
+            self.count += 1
+
+    def percentile(self, fraction):
+        """ Upper bound of the bucket the given fraction of observations falls under. """
+        if not self.count:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= wanted:
+                if i < len(self.buckets):
+                    return self.buckets[i]
+                break
+        return float("inf")
+
+
+class Timer(object):
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.histogram.observe(time.time() - self.started)
+        return False
+
+
+class Registry(object):
+    """ Every counter and histogram the bot keeps, keyed by name and labels. """
+    prefix = "meatbot_"
+
+    def __init__(self):
+        self.metrics = {}
+        self.helps = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def get(self, cls, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        try:
+            return self.metrics[key]
+        except KeyError:
+            with self.lock:
+                if key not in self.metrics:
+                    self.metrics[key] = cls()
+                return self.metrics[key]
+
+    def describe(self, name, helpText):
+        self.helps[name] = helpText
+
+    def counter(self, name, **labels):
+        return self.get(Counter, name, labels)
+
+    def histogram(self, name, **labels):
+        return self.get(Histogram, name, labels)
+
+    def inc(self, name, amount=1, **labels):
+        self.get(Counter, name, labels).inc(amount)
+
+    def observe(self, name, value, **labels):
+        self.get(Histogram, name, labels).observe(value)
+
+    def timer(self, name, **labels):
+        return Timer(self.get(Histogram, name, labels))
+
+    def cacheResult(self, cache, hit):
+        if hit:
+            self.inc("cache_hits_total", cache=cache)
+        else:
+            self.inc("cache_misses_total", cache=cache)
+
+    def total(self, name):
+        """ Sum of a counter over all its labels. """
+        return sum(m.value for (n, labels), m in self.metrics.items() if n == name)
+
+    def render(self):
+        """ Prometheus text exposition format. """
+        byName = {}
+        for (name, labels), metric in sorted(self.metrics.items()):
+            byName.setdefault(name, []).append((labels, metric))
+
+        lines = []
+        for name in sorted(byName):
+            fullName = self.prefix + name
+            if name in self.helps:
+                lines.append("# HELP {n} {h}".format(n=fullName, h=self.helps[name]))
+            lines.append("# TYPE {n} {t}".format(n=fullName, t=byName[name][0][1].kind))
+            for labels, metric in byName[name]:
+                if "counter" == metric.kind:
+                    lines.append("{n}{l} {v}".format(n=fullName, l=formatLabels(labels), v=metric.value))
+                    continue
+                cumulative = 0
+                for bound, n in zip(metric.buckets + ("+Inf",), metric.counts):
+                    cumulative += n
+                    lines.append("{n}_bucket{l} {v}".format(n=fullName, l=formatLabels(labels + (("le", str(bound)),)), v=cumulative))
+                lines.append("{n}_sum{l} {v!r}".format(n=fullName, l=formatLabels(labels), v=metric.total))
+                lines.append("{n}_count{l} {v}".format(n=fullName, l=formatLabels(labels), v=metric.count))
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """ One line for !stats. """
+        hits = self.total("cache_hits_total")
+        lookups = hits + self.total("cache_misses_total")
+        parts = ["up {s}s".format(s=int(time.time() - self.started)),
+                 "in {n}".format(n=self.total("messages_in_total")),
+                 "out {n}".format(n=self.total("messages_out_total")),
+                 "threads {n}".format(n=self.total("threads_spawned_total")),
+                 "cache hits {p:.0%}".format(p=float(hits) / lookups if lookups else 0)]
+        for name in ("receive_seconds", "parse_seconds", "dispatch_seconds", "render_seconds", "send_seconds", "lag_seconds"):
+            merged = Histogram()
+            for (n, labels), metric in self.metrics.items():
+                if n == name:
+                    merged.counts = [a + b for a, b in zip(merged.counts, metric.counts)]
+                    merged.count += metric.count
+            if merged.count:
+                parts.append("{s} p50 {p50} p99 {p99}".format(s=name.split("_")[0],
+                                                               p50=formatSeconds(merged.percentile(0.5)),
+                                                               p99=formatSeconds(merged.percentile(0.99))))
+
+        return ", ".join(parts)
+
+
+def formatLabels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{k}="{v}"'.format(k=k, v=str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels) + "}"
+
+def formatSeconds(seconds):
+    if seconds < 1:
+        return "<{ms:g}ms".format(ms=seconds * 1000)
+    return "<{s:g}s".format(s=seconds)
+
+
+registry = Registry()
+registry.describe("receive_seconds", "Time spent in recv() per chunk read.")
+registry.describe("parse_seconds", "Time spent in prettyOutput/processData per line.")
+registry.describe("dispatch_seconds", "Time spent in lookForCmd per line, by command.")
+registry.describe("render_seconds", "Time spent rendering phrases in getMsg/subMsg.")
+registry.describe("send_seconds", "Time spent writing to the socket per flush (a line, or a batch of them).")
+registry.describe("threads_spawned_total", "Threads started by the bot.")
+registry.describe("messages_in_total", "Lines received from the server.")
+registry.describe("messages_out_total", "Lines sent to the server.")
+registry.describe("reconnects_total", "Times the connection to the server was lost and reopened.")
+registry.describe("reconnect_seconds", "Time from losing the connection to being registered again.")
+registry.describe("lag_seconds", "Round trip of the bot's own PINGs to the server.")
+registry.describe("cache_hits_total", "Cache lookups that were answered from the cache.")
+registry.describe("cache_misses_total", "Cache lookups that weren't.")
+
+
+#### ---- Metrics endpoint ---- ####
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return "local"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class UnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def serveMetrics(registry, port=0, socketPath=""):
+    """ Serve /metrics on 127.0.0.1:port or a Unix socket. Returns the server, or None if neither is set. """
+    if socketPath:
+        server = UnixHTTPServer(socketPath, MetricsHandler)
+    elif port:
+        server = LocalHTTPServer(("127.0.0.1", port), MetricsHandler)
+    else:
+        return None
+    server.registry = registry
+
+    serverThread = threading.Thread(target=server.serve_forever)
+    serverThread.daemon = True
+    serverThread.start()
+
+    return server
@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+import Queue
+import random
+import socket
+import logging
+import importlib
+import subprocess
+import _multiprocessing
+
+import Metrics
+
+## The pool everything in this process sends jobs to. None means jobs run inline,
+## which is how they run inside the workers themselves.
+pool = None
+
+
+def workerLoop(conn):
+    global pool
+    pool = None
+    random.seed()
+    ## Phrase files this worker has read, by (module, class, file), with the version the bot asked for when each was read.
+    ## They're read-only here, and the compiled corpus they come from is mmapped, so its pages are shared through the page cache.
+    sources = {}
+    parent = os.getppid()
+    while True:
+        try:
+            if not conn.poll(1):
+                ## The socket closes when the bot goes, but check on it anyway in case something else holds it open.
+                if os.getppid() != parent:
+                    return
+                continue
+            moduleName, className, inputFile, version, method, args = conn.recv()
+        except (EOFError, IOError):
+            return
+        try:
+            key = (moduleName, className, inputFile)
+            ## The bot read the file again (!update), so read it again here too.
+            if key not in sources or version != sources[key][0]:
+                sources[key] = (version, getattr(importlib.import_module(moduleName), className)(inputFile))
+            conn.send((True, getattr(sources[key][1], method)(*args)))
+        except Exception as ex:
+            conn.send((False, "{t}: {e}".format(t=type(ex).__name__, e=ex)))
+
+
+def serve():
+    """ A worker's whole life: jobs come in and results go out on its stdin, a socket to the bot. """
+    workerLoop(_multiprocessing.Connection(os.dup(0)))
+
+
+class Worker(object):
+    """ A worker process, started as a fresh interpreter rather than forked from the bot.
+
+    Workers get replaced while the bot's threads are running, and a fork would copy any lock one of them
+    held at that moment (logging's, the import lock) into a child with no thread left to release it.
+    A fresh interpreter only imports what it's asked for and reads its own phrase files.
+    """
+    def __init__(self):
+        ours, theirs = socket.socketpair()
+        here = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+        self.process = subprocess.Popen([sys.executable, "-c", "import Offload; Offload.serve()"],
+                                        stdin=theirs.fileno(), close_fds=True, env=env)
+        theirs.close()
+        self.conn = _multiprocessing.Connection(os.dup(ours.fileno()))
+        ours.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.wait()
+        self.conn.close()
+
+
+class WorkerPool(object):
+    """ Worker processes for pure-CPU jobs, so a slow match never holds the GIL the IRC threads need.
+
+    Each job gets a time budget. A job that runs over is cancelled the only way a running
+    job can be: its worker is killed and a fresh one takes its place.
+    """
+    def __init__(self, size=2, budget=2.0):
+        self.budget = budget
+        self.workers = []
+        self.idle = Queue.Queue()
+        for _ in xrange(size):
+            self.addWorker(Worker())
+        self.metrics = Metrics.registry
+        self.logger = logging.getLogger(type(self).__name__)
+
+    def addWorker(self, worker):
+        self.workers.append(worker)
+        self.idle.put(worker)
+
+    def replace(self, worker):
+        self.workers.remove(worker)
+        worker.kill()
+        newWorker = Worker()
+        self.workers.append(newWorker)
+        return newWorker
+
+    def call(self, obj, method, args=(), default=None, budget=None):
+        budget = budget or self.budget
+        started = time.time()
+        try:
+            worker = self.idle.get(timeout=budget)
+        except Queue.Empty:
+            self.metrics.inc("offload_cancelled_total", method=method, reason="busy")
+            return default
+
+        result = default
+        try:
+            worker.conn.send((type(obj).__module__, type(obj).__name__, obj.inputFile, obj.sourceVersion(), method, args))
+            if worker.conn.poll(max(0, budget - (time.time() - started))):
+                ok, value = worker.conn.recv()
+                if ok:
+                    result = value
+                else:
+                    self.metrics.inc("offload_failed_total", method=method)
+                    self.logger.warning("{m} failed in a worker: {e}".format(m=method, e=value))
+            else:
+                self.metrics.inc("offload_cancelled_total", method=method, reason="budget")
+                worker = self.replace(worker)
+        except (EOFError, IOError, OSError):
+            self.metrics.inc("offload_failed_total", method=method)
+            worker = self.replace(worker)
+        finally:
+            self.idle.put(worker)
+        self.metrics.observe("offload_seconds", time.time() - started, method=method)
+
+        return result
+
+    def stop(self):
+        for worker in self.workers:
+            worker.kill()
+        self.workers = []
+
+
+def call(obj, method, args=(), default=None, budget=None):
+    """ obj.method(*args) in a worker process if there's a pool, or right here if not.
+
+    obj is a phrase file object; the worker reads its own copy of the same file, and reads it again once obj has.
+    Gives back default if the job ran over its budget or failed.
+    """
+    if pool is None:
+        return getattr(obj, method)(*args)
+    return pool.call(obj, method, args, default, budget)
+
+def start(keywords):
+    """ Start the shared pool from the [Offload] section of Settings.ini, unless it's off or already running. """
+    global pool
+    options = keywords.get("Offload", {})
+    size = int(options.get("workers", 2))
+    if pool is None and 0 < size:
+        pool = WorkerPool(size, float(options.get("budget", 2.0)))
+    return pool
+
+def stop():
+    global pool
+    if pool:
+        pool.stop()
+        pool = None
+
+
+Metrics.registry.describe("offload_seconds", "Time from handing a job to the worker pool to getting its result.")
+Metrics.registry.describe("offload_cancelled_total", "Offloaded jobs given up on, because no worker was free or the job ran over budget.")
+Metrics.registry.describe("offload_failed_total", "Offloaded jobs that raised an error or lost their worker.")
@@ -1,13 +1,20 @@
 import re
+import array
 import random
 from random import getrandbits
 import os.path
 import logging
+import threading
 import traceback
+import collections
 import ConfigParser
 from string import maketrans
 
 import Settings
+import Corpus
+import Offload
+import Matching
+import Metrics
 
 phraseDir = os.path.join(os.path.dirname(__file__), "database")
 logDir = os.path.join(os.path.dirname(__file__), "log")
@@ -16,6 +23,7 @@ class Reaction(object):
     sendNick = ""
     ignore = "~`@\\"
     header = {}
+    corpusKind = Corpus.KIND_PHRASES
     
     columns = {}
     
@@ -26,8 +34,10 @@ class Reaction(object):
         self.parseCalled = 0
         self.index = 0
         self.field = ""
-        self.init = Settings.Settings().keywords
+        self.init = Settings.getKeywords()
         self.logger = None
+        ## What was read: the compiled table, or the text file's mtime.
+        self.version = None
 
         self.readFile()
 
@@ -45,8 +55,40 @@ class Reaction(object):
             handler.close()
         self.logger.handlers = []
 
+    def readCompiled(self):
+        """ Load this file's table from the compiled corpus, if it's up to date. """
+        table = Corpus.getTable(self.inputFile)
+        if table and self.corpusKind == table.kind:
+            self.loadTable(table)
+            self.version = table
+            return True
+        return False
+
+    def fileVersion(self):
+        try:
+            return os.path.getmtime(self.inputFile)
+        except OSError:
+            return None
+
+    def getVersion(self):
+        """ What this file's contents were read from. Anything worked out from the same version comes out the same. """
+        return self.version
+
+    def sourceVersion(self):
+        """ The mtime of the text file this was read from, whether it came from there or the compiled corpus. """
+        return getattr(self.version, "sourceTime", self.version)
+
+    def loadTable(self, table):
+        self.columns = {}
+        for name in table.arrays:
+            if name.startswith("col:"):
+                self.columns[name[4:]] = table.strings(name)
+
     def readFile(self):
-        self.init = Settings.Settings().keywords
+        self.init = Settings.getKeywords()
+        if self.readCompiled():
+            return
+        self.version = self.fileVersion()
         try:
             if os.path.isfile(self.inputFile):
                 with open(self.inputFile, "r") as fileHandler:
@@ -138,6 +180,12 @@ class Reaction(object):
             return re.compile(line)
         else:
             return line
+
+    def query(self, line, fuzzy=True):
+        """ What someone typed, ready to be searched for in time that doesn't depend on what they typed. """
+        """ Returns a Matching.Query with the [Matching] time budget; fuzzy matches like dumbRegex does. """
+        return Matching.Query(line, self.dumbRegex(line, False) if fuzzy else None,
+                              float(self.init.get("Matching", {}).get("budget", 1.0)), fuzzy)
     
     def getPhrase(self, phrase, capitalize = False):
         noHeader = True
@@ -265,12 +313,24 @@ class Meta(Reaction):
 class DictInDict(Reaction):
     keyField = ""
     keyValues = {}
+    corpusKind = Corpus.KIND_RECORDS
     
     def __init__(self, inputFile = "", key=""):
         self.keyField = key
         Reaction.__init__(self, inputFile)
 
+    def loadTable(self, table):
+        columns = [name[4:] for name in table.arrays if name.startswith("col:")]
+        self.columns = dict((col, []) for col in columns)
+        self.keyValues = Corpus.SortedDict(table.corpus, table.array("keys"),
+                                           lambda i: dict((col, table.string("col:" + col, i)) for col in columns))
+
     def readFile(self):
+        if self.readCompiled():
+            return
+        self.version = self.fileVersion()
+        ## A table of its own, not the class's, or what's gone from the file would stay in it.
+        self.keyValues = {}
         try:
             if os.path.isfile(self.inputFile):
                 fileHandler = open(self.inputFile, "r")
@@ -363,6 +423,8 @@ class User(DictInDict):
 class Song(Reaction):
     ignore = "`@\\"
     randTitle = True
+    corpusKind = Corpus.KIND_SONGS
+    hasDelay = False
     
 
     def __init__(self, inputFile = os.path.join(phraseDir, "Songs.txt")):
@@ -373,6 +435,14 @@ class Song(Reaction):
         self.dumbedTitle = {}
         self.dumbedWork = {}
         self.columns = {}
+        ## Every line of every title end to end, in title order, with each line's title as an index
+        ## into titles and each title's (start, end) rows, so a random line and its title are one lookup.
+        self.quotes = []
+        self.quoteTitles = array.array("I")
+        self.titles = []
+        self.titleRanges = {}
+        ## Held while the tables are read again, so they're only ever swapped in whole.
+        self.lock = threading.RLock()
         Reaction.__init__(self, inputFile)
         
     def addToList(self, theList, category, addWhat, dumbDict):
@@ -386,11 +456,61 @@ class Song(Reaction):
                 theList[category] = []
                 theList[category].append(addWhat)
 
+    def loadTable(self, table):
+        if table is self.version:
+            return
+        self.byTitle = table.ranges("title", lambda start, end: Corpus.SongLines(table, start, end, self.hasDelay))
+        self.byWork = table.ranges("work", lambda start, end: Corpus.StringList(table.corpus, table.array("workTitles"), start, end))
+        self.dumbedTitle = table.pairs("dumbTitle")
+        self.dumbedWork = table.pairs("dumbWork")
+        self.quotes = table.strings("quote")
+        self.quoteTitles = table.array("titleIndex")
+        self.titles = table.strings("titleKeys")
+        self.titleRanges = table.ranges("title", lambda start, end: (start, end))
+
+    def getVersion(self):
+        ## Songs are read again when their file changes, so check first.
+        self.readFile()
+        return self.version
+
+    def isCurrent(self):
+        """ Whether the text file is unchanged since it was last read. """
+        version = self.fileVersion()
+        return version is not None and version == self.version
+
+    def indexQuotes(self, byTitle):
+        """ (titles, quotes, quoteTitles, titleRanges): the lines of byTitle laid out flat, once per read of the text file. """
+        titles = sorted(byTitle)
+        quotes = []
+        quoteTitles = array.array("I")
+        titleRanges = {}
+        for titleIndex, t in enumerate(titles):
+            start = len(quotes)
+            for order in sorted(o for o in byTitle[t] if isinstance(o, int)):
+                quotes.append(self.lyricText(byTitle[t][order]))
+                quoteTitles.append(titleIndex)
+            titleRanges[t] = (start, len(quotes))
+        return titles, quotes, quoteTitles, titleRanges
+
+    def setTables(self, version, byWork, byTitle, dumbedTitle, dumbedWork):
+        """ Put tables read from the text file in place of the old ones all at once. """
+        titles, quotes, quoteTitles, titleRanges = self.indexQuotes(byTitle)
+        with self.lock:
+            self.byWork, self.byTitle, self.dumbedTitle, self.dumbedWork = byWork, byTitle, dumbedTitle, dumbedWork
+            self.titles, self.quotes, self.quoteTitles, self.titleRanges = titles, quotes, quoteTitles, titleRanges
+            self.version = version
+
     def readFile(self):
         """ Sort songs by movie/work and sort quotes """
         """ by song and chronological order. """
-        self.init = Settings.Settings().keywords
-        
+        self.init = Settings.getKeywords()
+        with self.lock:
+            if not (self.readCompiled() or self.isCurrent()):
+                self.readText()
+
+    def readText(self):
+        version = self.fileVersion()
+        byWork, byTitle, dumbedTitle, dumbedWork = {}, {}, {}, {}
         try:
             if os.path.isfile(self.inputFile):
                 with open(self.inputFile, "r") as fileHandler:
@@ -416,20 +536,20 @@ class Song(Reaction):
                                     quote = f
                             self.index += 1
                         if lineNum > 1:
-                            self.addToList(self.byWork, work, song, self.dumbedWork)
+                            self.addToList(byWork, work, song, dumbedWork)
                             try:
-                                self.byTitle[song][order] = quote
+                                byTitle[song][order] = quote
                             except KeyError:
                                 ## Song wasn't encountered yet.
-                                self.dumbedTitle[self.dumbDown(song).lower()] = ""
-                                self.dumbedTitle[self.dumbDown(song).lower()] = song
-                                self.byTitle[song] = {order: ""}
-                                self.byTitle[song][order] = quote
+                                dumbedTitle[self.dumbDown(song).lower()] = ""
+                                dumbedTitle[self.dumbDown(song).lower()] = song
+                                byTitle[song] = {order: ""}
+                                byTitle[song][order] = quote
                                 
                         self.index = 0
-            else:
-                pass
+            self.setTables(version, byWork, byTitle, dumbedTitle, dumbedWork)
         except IOError as ex:
+            self.version = None
             self.readFile()
 
     def getLists(self, arg):
@@ -461,19 +581,30 @@ class Song(Reaction):
         return output
     
     def getQuote(self, category):
+        if not category.strip():
+            return self.pickQuote(category)
+        ## Looking a song up by its lyrics means matching against every song; a worker does that.
+        return Offload.call(self, "pickQuote", (category,), default="")
+
+    def randomQuote(self, title=""):
+        """ (title, line) for a random line of title, or of any title if none is given. """
+        self.readFile()
+        start, end = self.titleRanges[title] if title else (0, len(self.quotes))
+        if start == end:
+            return "", ""
+        row = random.randrange(start, end)
+        return self.titles[self.quoteTitles[row]], self.quotes[row]
+
+    def pickQuote(self, category):
         category = category.strip()
         quote = ""
-        allQuotes = []
-        song = self.getTitle(category)
         if not category:
-            for s in self.byTitle:
-                for o in self.byTitle[s]:
-                    allQuotes.append(self.byTitle[s][o])
-            quote = random.choice(allQuotes)
-            song = self.getTitle(quote)
+            song, quote = self.randomQuote()
             self.randTitle = True
-        elif song:
-            quote = self.byTitle[song][random.randint(1, len(self.byTitle[song]))]
+        else:
+            song = self.getTitle(category)
+            if song:
+                song, quote = self.randomQuote(song)
         if quote:
             quote = self.parseParens(self.parseBraces(quote)).strip()
             if self.randTitle:
@@ -493,89 +624,147 @@ class Song(Reaction):
                 song = random.choice(self.byWork[self.dumbedWork[dumbLine]])
                 self.randTitle = True
             else:
-                for s in self.byTitle:
-                    for o in self.byTitle[s]:
-                        if self.dumbRegex(line).search(self.byTitle[s][o]):
-                            song = s
-                            self.currentQ = self.byTitle[s][o]
-                            self.randTitle = True
+                song = Offload.call(self, "findLyric", (line,), default=("", ""))[0]
+                if song:
+                    self.randTitle = True
         return song
 
-class SingAlong(Song):
+    def lyricText(self, entry):
+        return entry
 
-    def __init__(self, inputFile = os.path.join(phraseDir, "SingAlong.txt")):
-        Song.__init__(self, inputFile)
-        self.currentOrder = None
-        self.currentQ = ""
-        self.currentTitle = ""
+    def findLyric(self, line):
+        """ (title, line) for the last song line that the given line matches, or ("", ""). """
+        self.readFile()
+        query = self.query(line)
+        found = ("", "")
+        if not query:
+            return found
+        for s in self.byTitle:
+            if query.expired():
+                break
+            for o in self.byTitle[s]:
+                text = self.lyricText(self.byTitle[s][o])
+                if query.search(text):
+                    found = (s, text)
+        return found
+
+class SongCursor(object):
+    """ Where one channel is up to in a song or poem. The lines stay in the SingAlong or Recital every channel shares. """
+    __slots__ = ("currentTitle", "currentOrder", "currentQ", "autoCompleted", "paused", "delay", "nextAt")
+
+    def __init__(self, title=""):
+        self.currentTitle = title
         self.currentOrder = 0
+        self.currentQ = ""
         self.autoCompleted = False
-        self.lenTitle = 0
+        self.paused = False
+        ## Seconds to wait after the line just recited, and when the next one is due.
+        self.delay = 2.5
+        self.nextAt = 0.0
+
+    def getState(self):
+        return dict((f, getattr(self, f)) for f in self.__slots__)
 
-    def autoNext(self):
+    def setState(self, state):
+        for f in self.__slots__:
+            if f in state:
+                setattr(self, f, state[f])
+
+    @classmethod
+    def fromState(cls, state):
+        """ A saved cursor, picked up again. If its title has gone from the file since, it's simply finished. """
+        cursor = cls()
+        cursor.setState(state)
+        return cursor
+
+
+class SingAlong(Song):
+    """ The songs for singalongs, read once and shared. What each channel is up to is kept in a SongCursor. """
+    def __init__(self, inputFile = os.path.join(phraseDir, "SingAlong.txt")):
+        Song.__init__(self, inputFile)
+
+    def isFinished(self, cursor):
+        """ Whether the last line has been sung, or the song isn't there anymore. """
+        self.readFile()
+        titleQuotes = self.byTitle.get(cursor.currentTitle)
+        if not titleQuotes:
+            return True
+        return cursor.currentQ == titleQuotes[len(titleQuotes)] and cursor.currentOrder >= len(titleQuotes)
+
+    def autoNext(self, cursor):
         quote = ""
-        if 0 == self.currentOrder:
-            quote = self.byTitle[self.currentTitle][1]
-            self.currentOrder += 1
+        titleQuotes = self.byTitle[cursor.currentTitle]
+        if 0 == cursor.currentOrder:
+            quote = titleQuotes[1]
+            cursor.currentOrder += 1
         else:
-            order = self.currentOrder
-##            if not self.autoCompleted:
-##                order += 1
+            order = cursor.currentOrder
             try:
-                quote = self.byTitle[self.currentTitle][order]
+                quote = titleQuotes[order]
             except KeyError:
-                quote = self.byTitle[self.currentTitle][order - 1]
+                quote = titleQuotes[order - 1]
 
-        self.currentOrder += 1
-        self.currentQ = quote
-        self.autoCompleted = False
+        cursor.currentOrder += 1
+        cursor.currentQ = quote
+        cursor.autoCompleted = False
         
         return quote
 
-    def nextLine(self, line):
-        self.autoCompleted = False
+    def nextLine(self, cursor, line):
+        cursor.autoCompleted = False
         line = line.strip()
-        quote = ""
-        if not self.currentTitle:
-            self.currentTitle = self.getTitle(line)
-            self.lenTitle = len(self.byTitle[self.currentTitle])
-            return "Started \"{song}\". (\"{stop}\" to quit the song.)".format(song=self.currentTitle,
+        if not cursor.currentTitle:
+            cursor.currentTitle = self.getTitle(line)
+            if not cursor.currentTitle:
+                return None
+            return "Started \"{song}\". (\"{stop}\" to quit the song.)".format(song=cursor.currentTitle,
                                                                                stop=self.init["Commands"]["stopsong"])
         if not re.search(r"\w", line):
             return None
-        titleQuotes = self.byTitle[self.currentTitle]
-        if not self.currentOrder:
-            self.currentOrder = 1
 
-        self.lenTitle = len(titleQuotes)
+        ## Matching the line against the rest of the song can take a while; a worker does that.
+        quote, state = Offload.call(self, "followLine", (cursor.getState(), line), default=("", None))
+        if state:
+            cursor.setState(state)
+        return quote
+
+    def followLine(self, state, line):
+        """ The matching half of nextLine, on a copy of the cursor. Returns (what to sing next, the cursor after). """
+        cursor = SongCursor.fromState(state)
+        quote = self.matchLine(cursor, line)
+        return quote, cursor.getState()
+
+    def matchLine(self, cursor, line):
+        quote = ""
+        titleQuotes = self.byTitle[cursor.currentTitle]
+        if not cursor.currentOrder:
+            cursor.currentOrder = 1
 
         allQuotes = []
-        tempOrder = self.currentOrder
-        line = self.dumbRegex(line)
+        tempOrder = cursor.currentOrder
+        line = self.query(line)
         
         for o in titleQuotes:
             if tempOrder == o:
-                if line.search(self.dumbDown(titleQuotes[o]).replace("_", " ")):
-                    self.currentQ = titleQuotes[o]
-                    self.currentOrder = tempOrder
-
-                    ## For line auto-completion, try to split the quote with
-                    ## the first instance of the line to to check for leftovers.
-                    quote = line.split(self.currentQ, 1)
-                    quote = quote[len(quote) - 1]
+                ## For line auto-completion, whatever's left of the quote after the line is what comes next.
+                rest = line.rest(titleQuotes[o])
+                if rest is not None:
+                    cursor.currentQ = titleQuotes[o]
+                    cursor.currentOrder = tempOrder
+                    quote = rest
 
                     try:
                         if quote.strip(" ,.?-:;!"):
-                            self.autoCompleted = True
+                            cursor.autoCompleted = True
                         else:
-                            quote = titleQuotes[self.currentOrder + 1]
-                            self.currentQ = titleQuotes[self.currentOrder + 1]
-                            self.currentOrder += 1
+                            quote = titleQuotes[cursor.currentOrder + 1]
+                            cursor.currentQ = titleQuotes[cursor.currentOrder + 1]
+                            cursor.currentOrder += 1
                     except KeyError:
-                        self.currentQ = titleQuotes[self.currentOrder]
+                        cursor.currentQ = titleQuotes[cursor.currentOrder]
                         return None
                     
-                    self.currentOrder += 1
+                    cursor.currentOrder += 1
                     break
                 allQuotes.append(titleQuotes[o])
                 tempOrder += 1
@@ -583,57 +772,61 @@ class SingAlong(Song):
         allQuotes = "\n".join(allQuotes)
         if not quote:
             ## Maybe they said more than one line in the song.
-            if line.search(self.dumbDown(allQuotes).replace("_", " ")):
-                allQuotes = line.split(allQuotes, 1)
-                allQuotes = allQuotes[len(allQuotes) - 1].split("\n")
+            rest = line.rest(allQuotes)
+            if rest is not None:
+                allQuotes = rest.split("\n")
                 quote = allQuotes[0]
 
                 if quote.strip(" ,.?-:;!"):
                     if len(allQuotes) > 1:
                         for o in titleQuotes:
                             if titleQuotes[o] == allQuotes[1]:
-                                self.currentQ = titleQuotes[o - 1]
-                                self.autoCompleted = True
-                                self.currentOrder = o
+                                cursor.currentQ = titleQuotes[o - 1]
+                                cursor.autoCompleted = True
+                                cursor.currentOrder = o
                                 break
                     else:
-                        self.currentQ = titleQuotes[len(titleQuotes)]
-                        self.currentOrder = len(titleQuotes)
+                        cursor.currentQ = titleQuotes[len(titleQuotes)]
+                        cursor.currentOrder = len(titleQuotes)
                 else:
                     quote = allQuotes[1]
-                    self.autoCompleted = False
-                    self.currentQ = quote
+                    cursor.autoCompleted = False
+                    cursor.currentQ = quote
                     for o in titleQuotes:
                         if titleQuotes[o] == quote:
-                            self.currentOrder = o
+                            cursor.currentOrder = o
                             break
 
         ## If the line wasn't found, it probably wasn't part of the song.         
         return quote.lstrip(" ,.?-:;!'")
 
 class Recital(SingAlong):
+    hasDelay = True
+
     def __init__(self, inputFile = os.path.join(phraseDir, "Recite.txt")):
         SingAlong.__init__(self, inputFile)
-        self.delay = 2.5
 
-    def autoNext(self):
+    def isFinished(self, cursor):
+        """ Whether the last line has been recited, or the piece isn't there anymore. """
+        self.readFile()
+        titleQuotes = self.byTitle.get(cursor.currentTitle)
+        return not titleQuotes or cursor.currentOrder > len(titleQuotes)
+
+    def autoNext(self, cursor):
         quote = ""
-        self.lenTitle = len(self.byTitle[self.currentTitle])
-        if 0 == self.currentOrder:
-            quote = "\"{t}\" (\"{stop}\" if you had enough.)".format(t=self.currentTitle, stop=self.init["Commands"]["stoppoem"])
+        titleQuotes = self.byTitle[cursor.currentTitle]
+        if 0 == cursor.currentOrder:
+            quote = "\"{t}\" (\"{stop}\" if you had enough.)".format(t=cursor.currentTitle, stop=self.init["Commands"]["stoppoem"])
         else:
-            order = self.currentOrder
+            order = cursor.currentOrder
             try:
-                quote = self.byTitle[self.currentTitle][order][0]
-                self.delay = self.byTitle[self.currentTitle][order][1]
+                quote, cursor.delay = titleQuotes[order]
             except KeyError:
-                quote = self.byTitle[self.currentTitle][order - 1][0]
-                self.delay = self.byTitle[self.currentTitle][order - 1][1]
+                quote, cursor.delay = titleQuotes[order - 1]
 
-        self.currentOrder += 1
-        self.currentQ = quote
-        self.autoCompleted = False
-        print(self.lenTitle, self.currentOrder)
+        cursor.currentOrder += 1
+        cursor.currentQ = quote
+        cursor.autoCompleted = False
         
         return quote
 
@@ -641,10 +834,10 @@ class Recital(SingAlong):
         self.readFile()
         output = ""
         dumbArg = self.dumbDown(arg).lower()
+        self.listTitles = []
         for w in self.byWork:
             for t in self.byWork[w]:
-                if t not in self.listTitles:
-                    self.listTitles.append("\"{t}\" ({w})".format(t=t, w=w))
+                self.listTitles.append("\"{t}\" ({w})".format(t=t, w=w))
                                        
         self.listWorks = [w for w in self.byWork if w]
         self.listWorks.sort()
@@ -680,20 +873,17 @@ class Recital(SingAlong):
                 song = random.choice(self.byWork[self.dumbedWork[dumbLine]])
                 self.randTitle = True
             else:
-                for s in self.byTitle:
-                    for o in self.byTitle[s]:
-                        if self.dumbRegex(line).search(self.byTitle[s][o][0]):
-                            title = s
-                            self.currentQ = self.byTitle[s][o][0]
-                            self.randTitle = True
+                title = Offload.call(self, "findLyric", (line,), default=("", ""))[0]
+                if title:
+                    self.randTitle = True
         return title
 
+    def lyricText(self, entry):
+        return entry[0]
 
-    def readFile(self):
-        """ Sort songs by movie/work and sort quotes """
-        """ by song and chronological order. """
-        self.init = Settings.Settings().keywords
-        
+    def readText(self):
+        version = self.fileVersion()
+        byWork, byTitle, dumbedTitle, dumbedWork = {}, {}, {}, {}
         try:
             if os.path.isfile(self.inputFile):
                 with open(self.inputFile, "r") as fileHandler:
@@ -721,20 +911,22 @@ class Recital(SingAlong):
                                     delay = float(f)
                             self.index += 1
                         if lineNum > 1:
-                            self.addToList(self.byWork, work, song, self.dumbedWork)
+                            self.addToList(byWork, work, song, dumbedWork)
                             try:
-                                self.byTitle[song][order] = (quote, delay)
+                                byTitle[song][order] = (quote, delay)
                             except KeyError:
                                 ## Song wasn't encountered yet.
-                                self.dumbedTitle[self.dumbDown(song).lower()] = ""
-                                self.dumbedTitle[self.dumbDown(song).lower()] = song
-                                self.byTitle[song] = {order: ""}
-                                self.byTitle[song][order] = (quote, delay)
+                                dumbedTitle[self.dumbDown(song).lower()] = ""
+                                dumbedTitle[self.dumbDown(song).lower()] = song
+                                byTitle[song] = {order: ""}
+                                byTitle[song][order] = (quote, delay)
                                 
                         self.index = 0
             else:
                 self.logger.error("{f} does not exist.".format(f = self.inputFile))
+            self.setTables(version, byWork, byTitle, dumbedTitle, dumbedWork)
         except IOError as ex:
+            self.version = None
             self.closeLogHandlers()
             self.makeLogger()
             self.readFile()
@@ -824,6 +1016,20 @@ class Quote(DictInDict):
 
         return categories
 
+    def findQuotes(self, catFilter, wordFilter, byFilter):
+        """ Sorted IDs of the quotes that match all three filters, as typed. An empty filter matches everything. """
+        category, words, by = [self.query(f, fuzzy=False) for f in (catFilter, wordFilter, byFilter)]
+        matches = []
+        for x in self.keyValues:
+            if words.expired():
+                break
+            if ((not category or category.equals(self.keyValues[x]["category"])) and words.search(self.keyValues[x]["quote"])
+                    and by.search(self.keyValues[x]["by"])):
+                matches.append(int(x))
+        matches.sort()
+
+        return matches
+
     def getQuote(self, category):
         idNum, quote, cat, by, date = "", "", "", "", ""
         if not category:
@@ -834,28 +1040,20 @@ class Quote(DictInDict):
             date = self.keyValues[idNum]["date"]
         else:
             matches = []
+            ## The filters are searched for as text, never run as patterns.
             catFilter = re.search(r"(.*?)(?:index=|by=|words=|$)", category, re.I)
-            if catFilter:
-                catFilter = self.dumbDown(catFilter.group(1)).lower()
-            if not catFilter:
-                catFilter = ".*"
+            catFilter = catFilter.group(1).strip() if catFilter else ""
             wordFilter = re.search(r"words=(.+?)(?:index=|by=|$)", category, re.I)
-            if wordFilter:
-                wordFilter = self.dumbDown(wordFilter.group(1))
-            else:
-                wordFilter = ".*"
+            wordFilter = wordFilter.group(1).strip() if wordFilter else ""
             byFilter = re.search(r"by=(.+?)(?:index=|words=|$)", category, re.I)
-            if byFilter:
-                byFilter = self.dumbDown(byFilter.group(1)).lower()
-            else:
-                byFilter = ".*"
+            byFilter = byFilter.group(1).strip() if byFilter else ""
             orderFilter = re.search(r"index=(\d+\s*)(?:words=|by=|$)", category, re.I)
             if orderFilter:
                 orderFilter = int(orderFilter.group(1)) - 1
 
-            matches = [int(x) for x in self.keyValues if re.match("{}$".format(catFilter), self.keyValues[x]["category"].strip(), re.I) and re.search(wordFilter, self.keyValues[x]["quote"], re.I)
-                       and re.search(byFilter, self.keyValues[x]["by"], re.I)]
-            matches.sort()
+            matches = Offload.call(self, "findQuotes", (catFilter, wordFilter, byFilter))
+            if matches is None:
+                return "That took me too long to look up."
             
             try:
                 if 0 > orderFilter or "" == orderFilter:
@@ -866,7 +1064,8 @@ class Quote(DictInDict):
                 by = self.keyValues[index]["by"]
                 cat = self.keyValues[index]["category"]
                 date = self.keyValues[index]["date"]
-            except ValueError:
+            except (ValueError, KeyError):
+                ## KeyError: a worker found it in a newer Quotes.txt than this one.
                 return "No matching quotes found."
             except IndexError:
                 return "Index not found. (Only {} matches found)".format(len(matches))
@@ -877,3 +1076,35 @@ class Quote(DictInDict):
             quote = "\"{}\" - {} ({})".format(quote, by, cat)
 
         return quote
+
+
+class OutputCache(object):
+    """ Replies that depend only on what was asked and the version of the file they came from, built once.
+
+    Keys end with that version, so once a file is read again what was built from the old one is
+    never handed out; it just ages out. The least recently used go first once there are size of them.
+    """
+    def __init__(self, size=256):
+        self.size = size
+        self.outputs = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.metrics = Metrics.registry
+
+    def get(self, key, render):
+        """ The output kept for key, or what render() gives, kept for next time. """
+        with self.lock:
+            output = self.outputs.pop(key, None)
+            if output is not None:
+                self.outputs[key] = output
+        self.metrics.cacheResult("outputs", output is not None)
+        if output is None:
+            output = render()
+            with self.lock:
+                self.outputs[key] = output
+                while self.size < len(self.outputs):
+                    self.outputs.popitem(last=False)
+        return output
+
+    def clear(self):
+        with self.lock:
+            self.outputs.clear()
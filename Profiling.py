@@ -0,0 +1,232 @@
+import os.path
+import sys
+import gc
+import time
+import pstats
+import cProfile
+import resource
+import threading
+
+try:
+    import tracemalloc
+except ImportError:
+    ## Python 2 doesn't have it; fall back to counting live objects by type.
+    tracemalloc = None
+
+profileDir = os.path.join(os.path.dirname(__file__), "log", "profiles")
+
+
+def frameName(frame):
+    code = frame.f_code
+    return "{f}:{n}".format(f=os.path.basename(code.co_filename), n=code.co_name)
+
+
+class SamplingProfiler(object):
+    """ Looks at every thread's stack every few milliseconds and counts what it sees. """
+    kind = "sample"
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = {}
+        self.leaves = {}
+        self.samples = 0
+        self.running = False
+        self.thread = None
+        ## Threads that belong to the profiling itself.
+        self.ignored = set()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.sample)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def sample(self):
+        self.ignored.add(threading.current_thread().ident)
+        while self.running:
+            for threadId, frame in sys._current_frames().items():
+                if threadId in self.ignored:
+                    continue
+                stack = []
+                while frame:
+                    stack.append(frameName(frame))
+                    frame = frame.f_back
+                if not stack:
+                    continue
+                collapsed = ";".join(reversed(stack))
+                self.stacks[collapsed] = self.stacks.get(collapsed, 0) + 1
+                self.leaves[stack[0]] = self.leaves.get(stack[0], 0) + 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def dump(self, fileName):
+        """ Collapsed stacks, one "frame;frame;frame count" per line, for flame graph tools. """
+        fileName += ".collapsed"
+        with open(fileName, "w") as fileHandler:
+            for stack in sorted(self.stacks):
+                fileHandler.write("{s} {n}\n".format(s=stack, n=self.stacks[stack]))
+        return fileName
+
+    def hottest(self, n=5):
+        """ [(function, share of samples)] for the functions most often on top of a stack. """
+        top = sorted(self.leaves.items(), key=lambda item: (-item[1], item[0]))[:n]
+        return [(name, float(count) / self.samples) for name, count in top]
+
+    def describe(self):
+        return "{n} samples".format(n=self.samples)
+
+
+class ThreadProfiler(object):
+    """ cProfile for every thread started while it runs (the bot starts one per line).
+
+    Threads that were already running (the reader, the scheduler, the sender) aren't covered:
+    Python only lets a thread set its own profiler. describe() names the ones that were left out.
+    """
+    kind = "cprofile"
+
+    def __init__(self):
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.stats = None
+        ## Threads that belong to the profiling itself.
+        self.ignored = set()
+        self.uncovered = []
+
+    def hook(self, frame, event, arg):
+        ## threading calls this as each new thread starts; swap it for a real profiler.
+        sys.setprofile(None)
+        if threading.current_thread().ident in self.ignored:
+            return
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        threading.setprofile(self.hook)
+        self.uncovered = sorted(thread.name for thread in threading.enumerate()
+                                if thread.ident not in self.ignored and thread is not threading.current_thread())
+
+    def stop(self):
+        threading.setprofile(None)
+        with self.lock:
+            profiles = list(self.profiles)
+        for profile in profiles:
+            profile.create_stats()
+        if profiles:
+            self.stats = pstats.Stats(*profiles)
+
+    def dump(self, fileName):
+        if not self.stats:
+            return None
+        fileName += ".pstats"
+        self.stats.dump_stats(fileName)
+        return fileName
+
+    def hottest(self, n=5):
+        """ [(function, share of total time)] by time spent in the function itself. """
+        if not self.stats or not self.stats.total_tt:
+            return []
+        byTime = sorted(self.stats.stats.items(), key=lambda item: -item[1][2])[:n]
+        return [("{f}:{n}".format(f=os.path.basename(func[0]), n=func[2]), stat[2] / self.stats.total_tt)
+                for func, stat in byTime]
+
+    def describe(self):
+        return "{n} new threads only, not {u}".format(n=len(self.profiles), u=", ".join(self.uncovered) or "any others")
+
+
+class MemorySnapshot(object):
+    """ Top allocators with tracemalloc, or object counts by type without it. """
+    def __init__(self):
+        self.rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.snapshot = tracemalloc.take_snapshot()
+        else:
+            self.counts = self.countObjects()
+
+    def countObjects(self):
+        counts = {}
+        for obj in gc.get_objects():
+            name = type(obj).__name__
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def compare(self, n=10):
+        """ [(what, growth)] since this snapshot was taken, biggest first. """
+        if tracemalloc:
+            diff = tracemalloc.take_snapshot().compare_to(self.snapshot, "lineno")[:n]
+            return [(str(stat.traceback), stat.size_diff) for stat in diff]
+        counts = self.countObjects()
+        growth = [(name, counts[name] - self.counts.get(name, 0)) for name in counts]
+
+        return sorted(growth, key=lambda item: (-item[1], item[0]))[:n]
+
+    def dump(self, fileName, growth):
+        fileName += ".memory"
+        unit = "bytes" if tracemalloc else "objects"
+        with open(fileName, "w") as fileHandler:
+            fileHandler.write("Peak RSS: {s} KB -> {e} KB\n".format(s=self.rss, e=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+            for what, size in growth:
+                fileHandler.write("{n:+d} {u}\t{w}\n".format(n=size, u=unit, w=what))
+        return fileName
+
+
+class ProfileSession(object):
+    """ One profiling run: starts now, stops after the given seconds (or when told), then calls back with a summary. """
+    def __init__(self, kind="sample", seconds=30, interval=0.005, directory=profileDir, onFinish=None):
+        if "cprofile" == kind:
+            self.profiler = ThreadProfiler()
+        else:
+            self.profiler = SamplingProfiler(interval)
+        self.seconds = seconds
+        self.directory = directory
+        self.onFinish = onFinish
+        self.timer = None
+        self.lock = threading.Lock()
+        self.finished = False
+
+    def start(self):
+        self.started = time.time()
+        self.memory = MemorySnapshot()
+        ## Start the timer first, so it isn't profiled along with the bot.
+        self.timer = threading.Timer(self.seconds, self.stop)
+        self.timer.daemon = True
+        self.timer.start()
+        self.profiler.ignored.add(self.timer.ident)
+        self.profiler.start()
+
+    def stop(self):
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+        self.timer.cancel()
+        self.profiler.stop()
+        growth = self.memory.compare()
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        fileName = os.path.join(self.directory, time.strftime("%Y%m%d-%H%M%S") + "-" + self.profiler.kind)
+        written = [self.profiler.dump(fileName), self.memory.dump(fileName, growth)]
+
+        summary = self.summary(growth, written)
+        if self.onFinish:
+            self.onFinish(summary)
+        return summary
+
+    def summary(self, growth, written):
+        hot = ", ".join("{f} {p:.0%}".format(f=f, p=p) for f, p in self.profiler.hottest()) or "nothing"
+        grew = ", ".join("{w} {n:+d}".format(w=w.split(" ")[0].split("/")[-1], n=n) for w, n in growth[:3] if n > 0) or "nothing"
+
+        return "Profile ({k}, {s:.0f}s, {d}): hottest {h}; grew {g}; wrote {f}".format(k=self.profiler.kind,
+                                                                                    s=time.time() - self.started,
+                                                                                    d=self.profiler.describe(),
+                                                                                    h=hot,
+                                                                                    g=grew,
+                                                                                    f=", ".join(os.path.basename(w) for w in written if w))
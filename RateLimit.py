@@ -0,0 +1,107 @@
+import time
+import logging
+import threading
+import collections
+
+import Metrics
+
+## [Commands] names -> the kind of command they count as. The rest, and games' own commands, count as "commands".
+KINDS = {"translate": "translate",
+         "roll": "roll",
+         "sing": "sing",
+         "singalong": "sing",
+         "poem": "sing"}
+
+
+def parseLimit(text):
+    """ (uses, seconds) from "uses/seconds", or None for no limit ("0" or nothing). """
+    uses, _, seconds = text.strip().partition("/")
+    if not uses or 0 >= int(uses):
+        return None
+    return int(uses), float(seconds or 1)
+
+
+class Bucket(object):
+    """ Uses left, refilling steadily, as of stamp. """
+    __slots__ = ("tokens", "stamp", "warned")
+
+    def __init__(self, tokens, stamp):
+        self.tokens = tokens
+        self.stamp = stamp
+        self.warned = False
+
+    def refill(self, limit, now):
+        uses, seconds = limit
+        self.tokens = min(uses, self.tokens + (now - self.stamp) * uses / seconds)
+        self.stamp = now
+
+
+class RateLimiter(object):
+    """ How often each user can use each kind of command, and everyone in a channel together.
+
+    Each (user, kind) and each channel has a token bucket: a limit of uses/seconds allows a burst of
+    uses, then one more every seconds/uses. A use has to fit both buckets, and only takes from them if it does.
+    Buckets are forgotten least recently used first once there are size of them; a forgotten one is just full again.
+    """
+    def __init__(self, limits, channelLimit=None, size=2000):
+        self.limits = limits
+        self.channelLimit = channelLimit
+        self.size = size
+        self.buckets = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.metrics = Metrics.registry
+
+    def bucket(self, key, limit, now):
+        bucket = self.buckets.pop(key, None)
+        if bucket:
+            bucket.refill(limit, now)
+        else:
+            bucket = Bucket(limit[0], now)
+        self.buckets[key] = bucket
+        return bucket
+
+    def allow(self, user, channel, kind):
+        """ (whether user can use a kind of command in channel now, whether to tell them they can't).
+
+        user and channel should already be case folded. Someone's only told the first time in a row.
+        """
+        limit = self.limits.get(kind, self.limits.get("commands"))
+        if not limit and not self.channelLimit:
+            return True, False
+        now = time.time()
+        with self.lock:
+            userBucket = self.bucket((user, kind), limit, now) if limit else None
+            channelBucket = self.bucket(channel, self.channelLimit, now) if self.channelLimit else None
+            while self.size < len(self.buckets):
+                self.buckets.popitem(last=False)
+
+            if userBucket and 1 > userBucket.tokens:
+                self.metrics.inc("rate_limited_total", kind=kind, scope="user")
+                warn = not userBucket.warned
+                userBucket.warned = True
+                return False, warn
+            if channelBucket and 1 > channelBucket.tokens:
+                ## The whole channel's busy; that's no one person's doing, so no one's told.
+                self.metrics.inc("rate_limited_total", kind=kind, scope="channel")
+                return False, False
+            for bucket in (userBucket, channelBucket):
+                if bucket:
+                    bucket.tokens -= 1
+                    bucket.warned = False
+        return True, False
+
+
+def makeLimiter(options):
+    """ The RateLimiter set up in the [RateLimit] section of Settings.ini. """
+    limits = {}
+    for kind in set(KINDS.values()) | set(["commands", "links", "channel"]):
+        try:
+            limits[kind] = parseLimit(options.get(kind, ""))
+        except ValueError:
+            logging.getLogger("RateLimiter").warning("Bad rate limit for {k}: {l}".format(k=kind, l=options.get(kind)))
+            limits[kind] = None
+    channelLimit = limits.pop("channel")
+    return RateLimiter(limits, channelLimit, int(options.get("users", 2000)))
+
+
+Metrics.registry.describe("rate_limited_total", "Commands ignored for going over a user's or channel's rate limit, by kind and scope.")
@@ -0,0 +1,253 @@
+import re
+import time
+import errno
+import random
+import socket
+import argparse
+import resource
+import threading
+import traceback
+
+
+#### ---- Recording ---- ####
+## A recording is a series of chunks, each written as
+## "<seconds since start> <length>\n<raw bytes>\n", one per recv() that returned data.
+class RecordingSocket(object):
+    """ Wraps the bot's socket and writes everything received to a file. """
+    def __init__(self, sock, outputFile):
+        self.sock = sock
+        self.output = open(outputFile, "wb")
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def recv(self, size):
+        data = self.sock.recv(size)
+        if data:
+            with self.lock:
+                self.output.write("{t:.6f} {n}\n".format(t=time.time() - self.started, n=len(data)))
+                self.output.write(data)
+                self.output.write("\n")
+                self.output.flush()
+        return data
+
+    def close(self):
+        self.output.close()
+        self.sock.close()
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def readRecording(inputFile):
+    """ List of (seconds since start, chunk) from a recording. """
+    chunks = []
+    with open(inputFile, "rb") as fileHandler:
+        while True:
+            header = fileHandler.readline()
+            if not header.strip():
+                break
+            seconds, length = header.split()
+            chunks.append((float(seconds), fileHandler.read(int(length))))
+            fileHandler.read(1)
+
+    return chunks
+
+
+#### ---- Replaying ---- ####
+class ReplaySocket(object):
+    """ In-memory stand-in for the bot's socket that plays back a recording. """
+    def __init__(self, chunks, realTime=False):
+        self.chunks = chunks
+        self.position = 0
+        self.realTime = realTime
+        self.started = None
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def isFinished(self):
+        return self.position >= len(self.chunks)
+
+    def recv(self, size):
+        if self.started is None:
+            self.started = time.time()
+        if self.isFinished():
+            raise socket.error("Recording finished.")
+        seconds, chunk = self.chunks[self.position]
+        if self.realTime and seconds > time.time() - self.started:
+            ## Same as a non-blocking socket with nothing to read yet.
+            raise socket.error(errno.EWOULDBLOCK, "Nothing to read yet.")
+        self.position += 1
+
+        return chunk
+
+    def send(self, data):
+        with self.lock:
+            self.sent.append((time.time(), data))
+        return len(data)
+
+    def sendall(self, data):
+        self.send(data)
+
+    def setblocking(self, flag):
+        pass
+
+    def settimeout(self, seconds):
+        pass
+
+    def close(self):
+        pass
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class ReplayBench(object):
+    """ Feeds a recording through a GreetBot as fast as possible, or in real time, and times it. """
+    def __init__(self, bot, chunks, realTime=False, seed=0, useThreads=False, drainSeconds=120):
+        self.bot = bot
+        self.chunks = chunks
+        self.realTime = realTime
+        self.seed = seed
+        self.useThreads = useThreads
+        self.cmdTimes = {}
+        self.peakThreads = threading.active_count()
+        self.linesIn = 0
+        self.errors = {}
+        self.drainSeconds = drainSeconds
+
+    def wire(self):
+        bot = self.bot
+        bot.attachSocket(ReplaySocket(self.chunks, self.realTime))
+        ## As after connecting for real; JOINs aren't sent otherwise, and nothing waiting on the names replies happens.
+        bot.connected = True
+        ## No server to answer WHOIS, so everyone is identified as their own nick.
+        bot.whoIs = lambda nick, server="": nick
+
+        if not self.useThreads:
+            ## Run what the bot would've put on a thread right away, so the replay is deterministic.
+            def startThread(target, args=()):
+                bot.metrics.inc("threads_spawned_total")
+                try:
+                    target(*args)
+                except Exception:
+                    ## A thread would've just died here; note it and carry on.
+                    error = traceback.format_exc().strip().split("\n")[-1]
+                    self.errors[error] = self.errors.get(error, 0) + 1
+            bot.startThread = startThread
+
+        lookForCmd = bot.lookForCmd
+        commands = set(bot.init["Commands"].values()) | set(bot.init["SpecialCommands"].values())
+        def timedLookForCmd(data, nick):
+            gotCmd = re.match(r":\S+ (?:PRIVMSG|NOTICE) \S+ :\s*(\S+)", data)
+            command = "(none)"
+            if gotCmd and gotCmd.group(1).lower() in commands:
+                command = gotCmd.group(1).lower()
+            started = time.time()
+            lookForCmd(data, nick)
+            self.cmdTimes.setdefault(command, []).append(time.time() - started)
+        bot.lookForCmd = timedLookForCmd
+
+    def run(self):
+        random.seed(self.seed)
+        self.wire()
+        bot = self.bot
+        self.linesIn = sum(len([l for l in re.split(r"\r|\n", chunk) if l.strip()]) for seconds, chunk in self.chunks)
+
+        started = time.time()
+        while not bot.irc.isFinished():
+            bot.getData()
+            self.peakThreads = max(self.peakThreads, threading.active_count())
+            if self.realTime:
+                time.sleep(0.001)
+        for t in threading.enumerate():
+            if t is not threading.current_thread() and not t.daemon:
+                t.join()
+        self.drain()
+        self.elapsed = time.time() - started
+
+        return self.report()
+
+    def drain(self):
+        ## JOINs, greetings, recitals and game timers wait on the scheduler and the sender, daemon threads nothing joins.
+        ## Run whatever comes due within drainSeconds of the end now, so what they send is in the report.
+        bot = self.bot
+        ## The idle check comes round again forever, so it stops with the recording.
+        bot.idling = False
+        bot.idleTask.cancel()
+        until = time.time() + self.drainSeconds
+        while True:
+            bot.sender.flush()
+            if not bot.scheduler.runUntil(until):
+                break
+
+    def report(self):
+        lines = ["Replayed {n} lines in {s:.3f} s ({r:.0f} lines/sec), sent {o} lines in {w} writes.".format(n=self.linesIn,
+                                                                                                               s=self.elapsed,
+                                                                                                               r=self.linesIn / self.elapsed if self.elapsed else 0,
+                                                                                                               o=sum(data.count("\n") for t, data in self.bot.irc.sent),
+                                                                                                               w=len(self.bot.irc.sent)),
+                 "Peak threads: {t}. Peak RSS: {m} KB.".format(t=self.peakThreads,
+                                                                m=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)]
+        for error in sorted(self.errors):
+            lines.append("Handler died {n} time(s): {e}".format(n=self.errors[error], e=error))
+        lines.append("{c:<16}{n:>8}{p50:>12}{p90:>12}{p99:>12}{mx:>12}".format(c="command", n="count", p50="p50 ms",
+                                                                                 p90="p90 ms", p99="p99 ms", mx="max ms"))
+        for command in sorted(self.cmdTimes):
+            times = self.cmdTimes[command]
+            lines.append("{c:<16}{n:>8}{p50:>12.3f}{p90:>12.3f}{p99:>12.3f}{mx:>12.3f}".format(c=command, n=len(times),
+                                                                                                 p50=percentile(times, 0.5) * 1000,
+                                                                                                 p90=percentile(times, 0.9) * 1000,
+                                                                                                 p99=percentile(times, 0.99) * 1000,
+                                                                                                 mx=max(times) * 1000))
+
+        return "\n".join(lines)
+
+
+def makeBot(channels, botNick="MeatBot", owner="", console=False):
+    import Settings
+    import ClassyBot
+
+    ## Settings.getKeywords() is shared, so this turns console output off for the bot below.
+    Settings.getKeywords().setdefault("Logging", {})["console"] = "yes" if console else "no"
+    ## Start from nothing, and leave the live bot's saved state alone.
+    Settings.getKeywords().setdefault("State", {})["checkpoint"] = ""
+    ## Workers roll their own random numbers, which would make replays differ.
+    Settings.getKeywords().setdefault("Offload", {})["workers"] = "0"
+    bot = ClassyBot.GreetBot("replay.invalid", 6667, channels, botNick, owner, "")
+    bot.readFiles(loadAll=True)
+
+    return bot
+
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Replay recorded IRC traffic through a GreetBot and time it. "
+                                                    "Record traffic by giving GreetBot a recordFile.")
+    argParser.add_argument("recording")
+    argParser.add_argument("--channels", default="", help="Comma-separated channels the bot was in.")
+    argParser.add_argument("--nick", default="MeatBot")
+    argParser.add_argument("--owner", default="")
+    argParser.add_argument("--seed", type=int, default=0)
+    argParser.add_argument("--realtime", action="store_true", help="Keep the recording's timing instead of going as fast as possible.")
+    argParser.add_argument("--threads", action="store_true", help="Let the bot start its threads (not deterministic).")
+    argParser.add_argument("--console", action="store_true", help="Print the bot's console output.")
+    argParser.add_argument("--output", help="Write everything the bot sent to this file.")
+    args = argParser.parse_args()
+
+    chunks = readRecording(args.recording)
+    bot = makeBot([c for c in args.channels.split(",") if c], args.nick, args.owner, args.console)
+    if not args.realtime:
+        ## Flood control and dramatic pauses only slow the benchmark down.
+        time.sleep = lambda seconds: None
+
+    bench = ReplayBench(bot, chunks, args.realtime, args.seed, args.threads)
+    print(bench.run())
+
+    if args.output:
+        with open(args.output, "wb") as fileHandler:
+            for sentTime, data in bot.irc.sent:
+                fileHandler.write(data)
+    bot.closeLogHandlers()
@@ -0,0 +1,155 @@
+import random
+
+
+class Roster(object):
+    """ Who's in a channel, with their mode prefixes.
+
+    Nicks are kept by their folded (lowercased) form, so checking, adding, removing
+    and renaming someone costs the same in a channel of ten people or ten thousand.
+    Nicks are also kept in a list, with each one's place in it, so random picks don't
+    need to copy the list.
+
+    Once attached to a UserIndex, every change is passed on to it as well.
+    """
+    def __init__(self, fold=str.lower):
+        self.fold = fold
+        ## folded nick -> (nick as the server spells it, mode prefixes)
+        self.members = {}
+        self.order = []
+        self.places = {}
+        self.index = None
+        self.channel = None
+
+    def attach(self, index, channel):
+        """ Start keeping index up to date with who's in channel, beginning with everyone here now. """
+        self.index = index
+        self.channel = channel
+        for key in self.order:
+            index.add(key, channel)
+        return self
+
+    def detach(self):
+        """ Tell the index this roster's channel is gone, and stop telling it anything. """
+        if self.index is not None:
+            for key in self.order:
+                self.index.discard(key, self.channel)
+        self.index = None
+
+    def add(self, nick, modes=""):
+        key = self.fold(nick)
+        if key not in self.members:
+            self.places[key] = len(self.order)
+            self.order.append(key)
+            if self.index is not None:
+                self.index.add(key, self.channel)
+        self.members[key] = (nick, modes)
+
+    def discard(self, nick):
+        """ Take nick out; True if they were here. """
+        key = self.fold(nick)
+        if key not in self.members:
+            return False
+        del self.members[key]
+        ## Fill the gap with the last nick in the list instead of shifting everything along.
+        place = self.places.pop(key)
+        last = self.order.pop()
+        if last != key:
+            self.order[place] = last
+            self.places[last] = place
+        if self.index is not None:
+            self.index.discard(key, self.channel)
+        return True
+
+    def rename(self, oldNick, newNick):
+        """ Keep oldNick's place and modes under newNick; True if they were here. """
+        oldKey = self.fold(oldNick)
+        if oldKey not in self.members:
+            return False
+        modes = self.members[oldKey][1]
+        newKey = self.fold(newNick)
+        if oldKey != newKey:
+            self.discard(newNick)
+            del self.members[oldKey]
+            place = self.places.pop(oldKey)
+            self.order[place] = newKey
+            self.places[newKey] = place
+            if self.index is not None:
+                self.index.discard(oldKey, self.channel)
+                self.index.add(newKey, self.channel)
+        self.members[newKey] = (newNick, modes)
+        return True
+
+    def modes(self, nick):
+        return self.members.get(self.fold(nick), ("", ""))[1]
+
+    def choice(self):
+        """ Someone in the channel, picked at random, or None if there's nobody. """
+        if not self.order:
+            return None
+        return self.members[random.choice(self.order)][0]
+
+    def __contains__(self, nick):
+        return self.fold(nick) in self.members
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        return (self.members[key][0] for key in list(self.order))
+
+
+class UserIndex(object):
+    """ Every nick the bot can see, folded, with the channels it shares with the bot.
+
+    A QUIT or NICK only has to visit the channels the user is in, not every channel the bot is in.
+    Rosters attached to the index keep it current.
+    """
+    def __init__(self, fold=str.lower):
+        self.fold = fold
+        self.channels = {}
+
+    def add(self, key, channel):
+        self.channels.setdefault(key, set()).add(channel)
+
+    def discard(self, key, channel):
+        channels = self.channels.get(key)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self.channels[key]
+
+    def channelsOf(self, nick):
+        """ The channels nick is in, as a copy that's safe to change the rosters over. """
+        return list(self.channels.get(self.fold(nick), ()))
+
+    def __len__(self):
+        return len(self.channels)
+
+
+class NamesReply(object):
+    """ Rosters being read from NAMES replies, one per channel, until each one's 366 says it's complete.
+
+    A big channel's names take many 353 lines. They're collected here, out of the bot's sight,
+    and the finished roster replaces the old one in one go.
+    """
+    def __init__(self, fold=str.lower):
+        self.fold = fold
+        self.staging = {}
+
+    def names(self, channel, names, prefixes):
+        """ One 353 line's worth: space-separated names, each with any of the mode prefixes in front. """
+        roster = self.staging.get(self.fold(channel))
+        if roster is None:
+            roster = self.staging[self.fold(channel)] = Roster(self.fold)
+        for name in names.split():
+            ## With multi-prefix, someone both opped and voiced shows up as "@+nick";
+            ## with userhost-in-names, as "nick!user@host".
+            nick = name.lstrip(prefixes)
+            modes = name[:len(name) - len(nick)]
+            nick = nick.split("!", 1)[0]
+            if nick:
+                roster.add(nick, modes)
+
+    def end(self, channel):
+        """ The complete roster for channel, at its 366. """
+        return self.staging.pop(self.fold(channel), None) or Roster(self.fold)
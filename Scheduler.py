@@ -0,0 +1,134 @@
+import time
+import heapq
+import Queue
+import logging
+import itertools
+import threading
+
+
+class Task(object):
+    """ A callback waiting on the scheduler. Cancelling just marks it; it's dropped when it comes due. """
+    __slots__ = ("when", "callback", "args", "cancelled", "done")
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.done = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def pending(self):
+        return not (self.cancelled or self.done)
+
+
+class Scheduler(object):
+    """ One thread that runs callbacks when they're due, however many timers are waiting.
+
+    Callbacks must be quick and must never block, since every timer waits behind them.
+    Anything that talks to the server should be handed on to the Sender instead.
+    """
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.logger = logging.getLogger(type(self).__name__)
+
+    def later(self, seconds, callback, *args):
+        task = Task(time.time() + seconds, callback, args)
+        with self.condition:
+            ## The counter keeps tasks due at the same time in the order they were added.
+            heapq.heappush(self.heap, (task.when, next(self.counter), task))
+            if self.heap[0][2] is task:
+                self.condition.notify()
+            if not self.thread:
+                self.thread = threading.Thread(target=self.run, name=type(self).__name__)
+                self.thread.daemon = True
+                self.thread.start()
+
+        return task
+
+    def dueTasks(self):
+        with self.condition:
+            while True:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                wait = self.heap[0][0] - time.time()
+                if 0 < wait:
+                    self.condition.wait(wait)
+                    continue
+                due = []
+                now = time.time()
+                while self.heap and self.heap[0][0] <= now:
+                    due.append(heapq.heappop(self.heap)[2])
+                return due
+
+    def runTask(self, task):
+        if task.cancelled:
+            return
+        try:
+            task.callback(*task.args)
+        except Exception:
+            self.logger.exception("Scheduled task failed.")
+        task.done = True
+
+    def run(self):
+        while True:
+            for task in self.dueTasks():
+                self.runTask(task)
+
+    def runUntil(self, until):
+        """ Run everything due by until right now, on this thread, including what those tasks add that's due by then too.
+
+        For replays, which don't wait for timers. Gives back how many tasks were taken off.
+        """
+        ran = 0
+        while True:
+            with self.condition:
+                if not self.heap or until < self.heap[0][0]:
+                    return ran
+                task = heapq.heappop(self.heap)[2]
+            self.runTask(task)
+            ran += 1
+
+
+class Sender(object):
+    """ One thread that runs callbacks in the order they're handed over, for work that can block,
+    like writing to the server or pausing between lines, so the scheduler never waits on it.
+    """
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(type(self).__name__)
+
+    def call(self, callback, *args):
+        self.queue.put((callback, args))
+        with self.lock:
+            if not self.thread:
+                self.thread = threading.Thread(target=self.run, name=type(self).__name__)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def flush(self):
+        """ Wait until everything handed over so far has run. """
+        done = threading.Event()
+        self.call(done.set)
+        done.wait()
+
+    def run(self):
+        while True:
+            callback, args = self.queue.get()
+            try:
+                callback(*args)
+            except Exception:
+                self.logger.exception("Sending failed.")
+
+
+## Shared by everything in the bot that needs a timer, and everything those timers send.
+scheduler = Scheduler()
+sender = Sender()
@@ -0,0 +1,164 @@
+import string
+
+## What each CASEMAPPING treats as the same letter, on top of A-Z and a-z.
+CASEMAPPINGS = {"ascii": ("", ""),
+                "rfc1459": ("[]\\~", "{}|^"),
+                "strict-rfc1459": ("[]\\", "{}|")}
+
+
+def splitBytes(text, limit):
+    """ (first line, the rest) for text cut to at most limit bytes of UTF-8.
+
+    Cuts at a space when there's one in the second half of the line, and never through a character.
+    """
+    if len(text) <= limit:
+        return text, ""
+    cut = limit
+    ## Back up off any continuation bytes, so the cut falls before the character they belong to.
+    while 0 < cut and "\x80" <= text[cut] < "\xc0":
+        cut -= 1
+    if not cut:
+        cut = limit
+    space = text.rfind(" ", limit // 2, cut + 1)
+    if 0 < space:
+        return text[:space], text[space + 1:]
+    return text[:cut], text[cut:]
+
+
+class ServerSupport(object):
+    """ What the server said it supports in RPL_ISUPPORT (005), with the RFC defaults until it says.
+
+    Shared by everything that needs the server's rules: the sender for line lengths,
+    the rosters for nick prefixes, and anything keyed by nick or channel for case folding.
+    """
+    def __init__(self):
+        self.tokens = {}
+        self.lineLength = 512
+        self.userLength = 10
+        self.hostLength = 63
+        self.prefixModes = "ov"
+        self.prefixes = "@+"
+        self.chanTypes = "#&"
+        ## The bot's own nick!user@host, once the server shows it.
+        self.source = None
+        self.setCaseMapping("rfc1459")
+
+    def setCaseMapping(self, name):
+        upper, lower = CASEMAPPINGS.get(name, CASEMAPPINGS["rfc1459"])
+        self.caseMapping = name if name in CASEMAPPINGS else "rfc1459"
+        self.table = string.maketrans(string.ascii_uppercase + upper, string.ascii_lowercase + lower)
+
+    def parse(self, tokens):
+        """ Take in the tokens of one 005 line. Returns True if case folding changed. """
+        caseMapping = self.caseMapping
+        for token in tokens:
+            if token.startswith("-"):
+                self.tokens.pop(token[1:].upper(), None)
+                continue
+            name, _, value = token.partition("=")
+            name = name.upper()
+            self.tokens[name] = value
+            if "LINELEN" == name and value.isdigit():
+                self.lineLength = int(value)
+            elif "USERLEN" == name and value.isdigit():
+                self.userLength = int(value)
+            elif "HOSTLEN" == name and value.isdigit():
+                self.hostLength = int(value)
+            elif "CASEMAPPING" == name:
+                self.setCaseMapping(value.lower())
+            elif "CHANTYPES" == name:
+                self.chanTypes = value
+            elif "PREFIX" == name and value.startswith("(") and ")" in value:
+                self.prefixModes, self.prefixes = value[1:].split(")", 1)
+
+        return caseMapping != self.caseMapping
+
+    def fold(self, name):
+        """ name as the server would compare it. """
+        return name.translate(self.table)
+
+    def isChannel(self, name):
+        return bool(name) and name[0] in self.chanTypes
+
+    def maxTargets(self, command):
+        """ How many targets the server takes in one command, from TARGMAX (and the older MAXTARGETS), or None for no limit. """
+        for item in self.tokens.get("TARGMAX", "").split(","):
+            name, _, value = item.partition(":")
+            if name.upper() == command.upper() and value.isdigit():
+                return int(value)
+        value = self.tokens.get("MAXTARGETS", "")
+        return int(value) if value.isdigit() else None
+
+    def packTargets(self, command, targets, most=None):
+        """ targets grouped for "COMMAND a,b,c" lines, each group as many as fit in a line the server will take. """
+        limit = self.lineLength - len("{c} \r\n".format(c=command))
+        limits = [n for n in (most, self.maxTargets(command)) if n]
+        most = min(limits) if limits else None
+        groups = []
+        group = []
+        length = -1
+        for target in targets:
+            if group and (limit < length + 1 + len(target) or most and most <= len(group)):
+                groups.append(group)
+                group = []
+                length = -1
+            group.append(target)
+            length += 1 + len(target)
+        if group:
+            groups.append(group)
+
+        return groups
+
+    def payloadBytes(self, nick, target, command="PRIVMSG"):
+        """ How much text fits in one line from the bot, as the server passes it on with the bot's full source. """
+        source = self.source or "{n}!{u}@{h}".format(n=nick, u="u" * self.userLength, h="h" * self.hostLength)
+
+        return self.lineLength - len(":{s} {c} {t} :\r\n".format(s=source, c=command, t=target))
+
+
+class FoldedDict(dict):
+    """ A dict keyed by nick or channel, where keys that fold the same are the same key.
+
+    Keys are stored folded. How each was first spelled is kept too, so they can be folded again.
+    """
+    def __init__(self, support):
+        dict.__init__(self)
+        self.support = support
+        self.spellings = {}
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self, self.support.fold(key))
+
+    def __setitem__(self, key, value):
+        folded = self.support.fold(key)
+        self.spellings.setdefault(folded, key)
+        dict.__setitem__(self, folded, value)
+
+    def __delitem__(self, key):
+        folded = self.support.fold(key)
+        dict.__delitem__(self, folded)
+        self.spellings.pop(folded, None)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, self.support.fold(key))
+
+    def get(self, key, default=None):
+        return dict.get(self, self.support.fold(key), default)
+
+    def pop(self, key, *default):
+        folded = self.support.fold(key)
+        self.spellings.pop(folded, None)
+        return dict.pop(self, folded, *default)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def refold(self):
+        """ Re-key everything after the server's CASEMAPPING turns out different from what was assumed. """
+        items = [(self.spellings.get(key, key), value) for key, value in dict.items(self)]
+        dict.clear(self)
+        self.spellings = {}
+        for key, value in items:
+            self[key] = value
@@ -1,6 +1,9 @@
 import os.path
+import threading
 import ConfigParser
 
+import Metrics
+
 class Settings(object):
     databaseDir = os.path.join(os.path.dirname(__file__), "database")
     
@@ -17,3 +20,21 @@ class Settings(object):
            for tup in parser.items(section):
                self.keywords[section][tup[0]] = ""
                self.keywords[section][tup[0]] = tup[1].decode("string-escape")
+
+_cached = {}
+_cacheLock = threading.Lock()
+
+def getKeywords(inputFile = os.path.join(Settings.databaseDir, "Settings.ini")):
+    """ Same as Settings(inputFile).keywords, but only re-parsed when the file changes. """
+    try:
+        fileTime = os.path.getmtime(inputFile)
+    except OSError:
+        fileTime = None
+    with _cacheLock:
+        if inputFile in _cached and fileTime == _cached[inputFile][0]:
+            Metrics.registry.cacheResult("settings", True)
+            return _cached[inputFile][1]
+        Metrics.registry.cacheResult("settings", False)
+        keywords = Settings(inputFile).keywords
+        _cached[inputFile] = (fileTime, keywords)
+        return keywords
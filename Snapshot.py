@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import Queue
+import logging
+import threading
+
+from Scheduler import scheduler
+
+VERSION = 1
+
+
+def toStr(value):
+    """ json gives back unicode; the bot works in UTF-8 byte strings. """
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, list):
+        return [toStr(v) for v in value]
+    if isinstance(value, dict):
+        return dict((toStr(k), toStr(v)) for k, v in value.items())
+    return value
+
+def dumps(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+class StateStore(object):
+    """ Keyed runtime state on disk, as a checkpoint of everything plus a journal of what changed since.
+
+    The journal is append-only, one JSON line per changed key, so a crash mid-write
+    costs at most the line being written. Every so often the whole state is written to a new
+    checkpoint (atomically, by renaming) and the journal starts over.
+    """
+    def __init__(self, checkpointFile, journalFile, checkpointEvery=500):
+        self.checkpointFile = checkpointFile
+        self.journalFile = journalFile
+        self.checkpointEvery = checkpointEvery
+        ## What's on disk, key -> serialized state, so only changes get written.
+        self.saved = {}
+        self.journalLength = 0
+        self.sequence = 0
+        ## Reentrant so the writer can hold it across checking it's still wanted and saving.
+        self.lock = threading.RLock()
+        self.task = None
+        ## The latest states captured and not yet written; only the newest is worth writing.
+        self.queue = Queue.Queue(1)
+        self.writer = None
+        self.stopped = False
+        self.logger = logging.getLogger(type(self).__name__)
+
+    def load(self):
+        """ key -> state, from the checkpoint and whatever the journal says happened after it. """
+        states = {}
+        checkpointSequence = 0
+        try:
+            with open(self.checkpointFile, "rb") as fileHandler:
+                checkpoint = json.load(fileHandler)
+            if VERSION == checkpoint.get("version"):
+                states = checkpoint["states"]
+                checkpointSequence = checkpoint["sequence"]
+        except (IOError, ValueError, KeyError):
+            pass
+        self.sequence = checkpointSequence
+
+        self.journalLength = 0
+        try:
+            with open(self.journalFile, "rb") as fileHandler:
+                for line in fileHandler:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        ## A line cut off by a crash; nothing after it was written properly either.
+                        break
+                    self.journalLength += 1
+                    if entry["sequence"] <= checkpointSequence:
+                        continue
+                    if entry["state"] is None:
+                        states.pop(entry["key"], None)
+                    else:
+                        states[entry["key"]] = entry["state"]
+                    self.sequence = entry["sequence"]
+        except IOError:
+            pass
+
+        states = toStr(states)
+        self.saved = dict((k, dumps(v)) for k, v in states.items())
+
+        return states
+
+    def save(self, states, checkpoint=False):
+        """ Journal whatever changed since the last save. states is key -> state (or None to forget it). """
+        with self.lock:
+            entries = []
+            for key, state in states.items():
+                serialized = None if state is None else dumps(state)
+                if serialized != self.saved.get(key):
+                    entries.append((key, state, serialized))
+            for key in set(self.saved) - set(states):
+                entries.append((key, None, None))
+
+            if entries:
+                lines = []
+                for key, state, serialized in entries:
+                    self.sequence += 1
+                    lines.append(dumps({"sequence": self.sequence, "key": key, "state": state}))
+                    if serialized is None:
+                        self.saved.pop(key, None)
+                    else:
+                        self.saved[key] = serialized
+                self.makeDirs(self.journalFile)
+                with open(self.journalFile, "ab") as fileHandler:
+                    fileHandler.write("\n".join(lines) + "\n")
+                    fileHandler.flush()
+                    os.fsync(fileHandler.fileno())
+                self.journalLength += len(lines)
+
+            if checkpoint or self.journalLength >= self.checkpointEvery:
+                self.writeCheckpoint()
+
+        return len(entries)
+
+    def writeCheckpoint(self):
+        self.makeDirs(self.checkpointFile)
+        temp = self.checkpointFile + ".tmp"
+        body = "{{\"version\":{v},\"sequence\":{s},\"time\":{t!r},\"states\":{{{states}}}}}".format(v=VERSION, s=self.sequence,
+                                                                                            t=time.time(),
+                                                                                            states=",".join(dumps(k) + ":" + v for k, v in sorted(self.saved.items())))
+        with open(temp, "wb") as fileHandler:
+            fileHandler.write(body)
+            fileHandler.flush()
+            os.fsync(fileHandler.fileno())
+        os.rename(temp, self.checkpointFile)
+        ## Everything in the journal is in the checkpoint now.
+        with open(self.journalFile, "wb"):
+            pass
+        self.journalLength = 0
+
+    def makeDirs(self, fileName):
+        directory = os.path.dirname(fileName)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def start(self, getStates, interval=5):
+        """ Save getStates() every few seconds.
+
+        Only taking the states happens on the shared scheduler; writing and fsyncing them is
+        this store's own thread's job, so a slow disk never holds up anyone's timers.
+        """
+        def tick():
+            try:
+                self.handOff(getStates())
+            except Exception:
+                self.logger.exception("Couldn't take the state to save.")
+            self.task = scheduler.later(interval, tick)
+        self.stopped = False
+        if not self.writer:
+            self.writer = threading.Thread(target=self.write, name=type(self).__name__)
+            self.writer.daemon = True
+            self.writer.start()
+        self.task = scheduler.later(interval, tick)
+
+    def handOff(self, states):
+        ## States the writer hasn't got to yet are out of date now; these replace them.
+        try:
+            self.queue.get_nowait()
+        except Queue.Empty:
+            pass
+        try:
+            self.queue.put_nowait(states)
+        except Queue.Full:
+            pass
+
+    def write(self):
+        while True:
+            states = self.queue.get()
+            with self.lock:
+                if self.stopped:
+                    continue
+                try:
+                    self.save(states)
+                except Exception:
+                    self.logger.exception("Couldn't save state.")
+
+    def stop(self, states=None):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        with self.lock:
+            self.stopped = True
+            try:
+                self.queue.get_nowait()
+            except Queue.Empty:
+                pass
+            if states is not None:
+                self.save(states, checkpoint=True)
+
+
+def makeStore(keywords):
+    """ A StateStore from the [State] section of Settings.ini, or None if it's turned off. """
+    options = keywords.get("State", {})
+    if not options.get("checkpoint"):
+        return None
+    baseDir = os.path.dirname(__file__)
+
+    return StateStore(os.path.join(baseDir, options["checkpoint"]),
+                      os.path.join(baseDir, options.get("journal") or options["checkpoint"] + ".journal"),
+                      int(options.get("checkpointevery", 500)))
@@ -0,0 +1,104 @@
+import errno
+import select
+import socket
+import threading
+from contextlib import contextmanager
+
+import Metrics
+
+## Longest partial line kept waiting for its end. Anything longer isn't IRC.
+MAX_LINE = 16384
+
+
+def normalize(line, fallback="cp1252"):
+    """ A received line as UTF-8, the only encoding the rest of the bot deals with.
+
+    UTF-8 (and so plain ASCII) passes through as it is. Clients still on a legacy
+    encoding send lines that aren't valid UTF-8; those are read as the fallback instead.
+    """
+    try:
+        line.decode("utf-8")
+        return line
+    except UnicodeDecodeError:
+        return line.decode(fallback, "replace").encode("utf-8")
+
+
+class LineReader(object):
+    """ Turns what recv() gives back into whole lines, keeping a cut-off line (or character) for the next read. """
+    def __init__(self, fallback="cp1252"):
+        self.fallback = fallback
+        self.buffer = ""
+
+    def feed(self, data):
+        lines = (self.buffer + data).replace("\r", "\n").split("\n")
+        self.buffer = lines.pop()
+        if MAX_LINE < len(self.buffer):
+            self.buffer = ""
+
+        return [normalize(line, self.fallback) for line in lines if line.strip()]
+
+
+class LineWriter(object):
+    """ Lines for the server, written out together by one flush.
+
+    A line written outside batch() goes out at once. Inside it, lines pile up until the
+    outermost batch() on that thread ends, then go out in as few send() calls as the socket allows.
+    Lines reach the socket in the order they were written, whichever threads wrote them.
+    """
+    def __init__(self, sock, onError=None, timeout=30.0):
+        self.sock = sock
+        self.onError = onError
+        self.timeout = timeout
+        self.pending = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.metrics = Metrics.registry
+
+    def write(self, line):
+        ## Anything that's still unicode by now is encoded here, once, on its way out.
+        if isinstance(line, unicode):
+            line = line.encode("utf-8")
+        with self.lock:
+            self.pending.append(line)
+        if not getattr(self.local, "depth", 0):
+            self.flush()
+
+    @contextmanager
+    def batch(self):
+        self.local.depth = getattr(self.local, "depth", 0) + 1
+        try:
+            yield self
+        finally:
+            self.local.depth -= 1
+            if not self.local.depth:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            data = "".join(self.pending)
+            self.pending = []
+            try:
+                with self.metrics.timer("send_seconds"):
+                    self.sendAll(data)
+            except socket.error as ex:
+                if self.onError:
+                    self.onError(ex)
+
+    def sendAll(self, data):
+        ## sendall() for a socket that may be non-blocking: wait for room instead of dropping the rest.
+        sent = 0
+        while sent < len(data):
+            try:
+                sent += self.sock.send(buffer(data, sent) if sent else data)
+            except socket.error as ex:
+                if ex.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                if not select.select([], [self.sock], [], self.timeout)[1]:
+                    raise socket.timeout("Timed out waiting to send.")
+                continue
+            self.metrics.inc("socket_writes_total")
+
+
+Metrics.registry.describe("socket_writes_total", "send() calls made writing lines to the server.")
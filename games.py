@@ -1,37 +1,171 @@
 import random
-import time
-from Settings import Settings
+import threading
+
+import Settings
+from Scheduler import scheduler
+
+
+def parseCommand(msg):
+    """ Split a message into its command (lowercased) and arguments, once. """
+    words = msg.split()
+    if not words:
+        return "", []
+    return words[0].lower(), words[1:]
 
 
 class Game(object):
-    def __init__(self, gameTitle):
+    """ A game hosted in one channel.
+
+    Commands are looked up in a table built when the game starts, and timers run on the
+    shared scheduler, so a game nobody is playing costs nothing. Output is a list of
+    (message, seconds to wait after sending it).
+    """
+    JOINING = "joining"
+    PLAYING = "playing"
+    OVER = "over"
+
+    def __init__(self, gameTitle, keywords=None, announce=None):
         self.players = {}
-        self.init = Settings().keywords
-        self.started = False
+        self.init = keywords or Settings.getKeywords()
+        self.state = self.JOINING
         self.gameTitle = gameTitle
+        ## Called with output from timers, since no one's command is waiting on it.
+        self.announce = announce
+        self.commands = {}
+        self.timers = []
+        self.lock = threading.RLock()
+
+    @property
+    def started(self):
+        return self.PLAYING == self.state
+
+    def isOver(self):
+        return self.OVER == self.state
+
+    def addCommand(self, cmd, handler):
+        self.commands[cmd.lower()] = handler
+
+    def handles(self, cmd):
+        return cmd.lower() in self.commands
+
+    def processCommand(self, nick, msg, channelUsers):
+        cmd, args = parseCommand(msg)
+        handler = self.commands.get(cmd)
+        if not handler:
+            return []
+        with self.lock:
+            if self.isOver():
+                return []
+            return handler(nick, args, channelUsers) or []
+
+    def schedule(self, seconds, callback, *args):
+        self.timers = [t for t in self.timers if t.pending()]
+        task = scheduler.later(seconds, self.runTimer, callback, args)
+        self.timers.append(task)
+
+        return task
+
+    def runTimer(self, callback, args):
+        with self.lock:
+            if self.isOver():
+                return
+            output = callback(*args)
+        if output and self.announce:
+            self.announce(output)
+
+    def getState(self):
+        with self.lock:
+            return {"kind": self.kind,
+                    "state": self.state,
+                    "players": [p.getState() for p in self.players.values()]}
+
+    def setState(self, state):
+        with self.lock:
+            self.state = state["state"]
+            self.players = {}
+            for p in state["players"]:
+                player = self.playerClass.fromState(p)
+                self.players[player.name.lower()] = player
+
+    def stop(self):
+        with self.lock:
+            self.state = self.OVER
+            for task in self.timers:
+                task.cancel()
+            self.timers = []
+
+    def sub(self, msg, nick):
+        return msg.replace(self.init["Substitutions"]["sendnick"], nick)
+
+    def choose(self, choices, nick=""):
+        return self.sub(random.choice(self.init["Choices"][choices].split(self.init["Splitters"]["choices-hijack"])), nick)
 
     def addPlayer(self, player, channelUsers):
-        if player.name.lower() in self.players:
-            return "alreadyin"
-        if player.name.lower() not in [n.lower() for n in channelUsers]:
-            player = None
-            return "nonexistent"
-        self.players[player.name.lower()] = None
-        self.players[player.name.lower()] = player
+        with self.lock:
+            if player.name.lower() in self.players:
+                return "alreadyin"
+            if player.name not in channelUsers:
+                return "nonexistent"
+            self.players[player.name.lower()] = player
 
         return True
 
+    def dropPlayer(self, playerName):
+        """ (whether playerName was playing, anything to say about them going). """
+        with self.lock:
+            if playerName.lower() in self.players:
+                del self.players[playerName.lower()]
+                return True, []
+        return False, []
+
     def removePlayer(self, playerName):
-        if playerName.lower() in self.players:
-            del self.players[playerName.lower()]
-            return True
-        return False
-    
-    
+        removed, output = self.dropPlayer(playerName)
+        ## Said once the lock's let go, so no one's command waits on the channel being talked to.
+        if output and self.announce:
+            self.announce(output)
+        return removed
+
+    def renamePlayer(self, oldNick, newNick):
+        with self.lock:
+            if oldNick.lower() in self.players:
+                player = self.players.pop(oldNick.lower())
+                player.name = newNick
+                self.players[newNick.lower()] = player
+
+    def countPlayers(self):
+        return ("Number of people playing {g}: {num}".format(g=self.gameTitle, num=len(self.players)), 0)
+
+    def leave(self, nick, args, channelUsers):
+        output = []
+        for who in args or [nick]:
+            removed, said = self.dropPlayer(who)
+            if removed:
+                output.append((self.choose("hijack-leavegame", who), 1))
+                output.extend(said)
+        if output:
+            output.append(self.countPlayers())
+
+        return output
+
+
 ### === Hijack === ###
 class HijackGame(Game):
-    def __init__(self):
-        Game.__init__(self, Settings().keywords["Titles"]["game-hijack"])
+    kind = "hijack"
+
+    def __init__(self, keywords=None, announce=None):
+        keywords = keywords or Settings.getKeywords()
+        Game.__init__(self, keywords["Titles"]["game-hijack"], keywords, announce)
+        self.playerClass = HijackPlayer
+        gameCommands = self.init["GameCommands"]
+        self.addCommand(gameCommands["addplayer"], self.add)
+        self.addCommand(gameCommands["attack"], self.attack)
+        self.addCommand(gameCommands["build"], self.build)
+        self.addCommand(gameCommands["getaveragehp"], self.averageHP)
+        self.addCommand(gameCommands["gethp"], self.getHP)
+        self.addCommand(gameCommands["leave"], self.leave)
+        self.addCommand(gameCommands["resetcharge"], self.resetCharge)
+        self.addCommand(gameCommands["sethp"], self.setHP)
+        self.addCommand(self.init["Commands"]["startplaying"], self.startPlaying)
 
     def getAverageHP(self):
         average = 0
@@ -44,166 +178,137 @@ class HijackGame(Game):
 
         return int(round(average, 1))
 
-    def processCommand(self, nick, msg, channelUsers):
-        self.init = Settings().keywords
-        self.gameTitle = self.init["Titles"]["game-hijack"]
+    def add(self, nick, args, channelUsers):
         output = []
-        
-        msg = msg.strip()
-        cmd = msg.split(" ")[0]
-        args = []
-        if len(msg.split(" ")) > 1:
-            args = msg.split(" ")
-            args.remove(args[0])
-        if self.init["GameCommands"]["addplayer"] == cmd.lower():
-            if args:
-                for a in args:
-                    name = a.split(self.init["Splitters"]["hijack-subparams"])[0]
-                    health = 100
-                    if self.started:
-                        try:
-                            health = self.getAverageHP()
-                        except (ValueError, ZeroDivisionError):
-                            pass
-                    try:
-                        health = int(a.split(self.init["Splitters"]["hijack-subparams"])[1])
-                    except (IndexError, ValueError):
-                        health = 100
-                    
-                    if "alreadyin" == self.addPlayer(HijackPlayer(name, health), channelUsers):
-                        output.append((self.init["Inform"]["hijack-playeralreadyin"].replace(self.init["Substitutions"]["sendnick"], name), 1))
-                    elif "nonexistent" == self.addPlayer(HijackPlayer(name, health), channelUsers):
-                        nopeMsg = self.init["Inform"]["hijack-nonexistentplayer"]
-                        nopeMsg = nopeMsg.replace(self.init["Substitutions"]["sendnick"], name)
-                        output.append((nopeMsg, 1))
-                    else:
-                        output.append(("{nick} joined the game with {hp} health points.".format(nick=name,
-                                                                                                hp=health), 1))
-                output.append(("Number of people playing {g}: {num}".format(g=self.gameTitle,
-                                                                            num=str(len(self.players))), 0))
-        elif self.init["GameCommands"]["attack"] == cmd.lower():
-            if not self.started:
-                output.append((self.init["Inform"]["hijack-notstarted"], 0))
-            else:
-                if args:
-                    who = args[0]
-                    if who.lower() in self.players:
-                        if self.players[who.lower()].health <= 0:
-                            overkillMsg = random.choice(self.init["Choices"]["hijack-tryoverkill"].split(self.init["Splitters"]["choices-hijack"]))
-                            output.append((overkillMsg.replace(self.init["Substitutions"]["sendnick"], who), 0))
-                        else:
-                            amountTimes = 1
-                            sides = 20
-                            try:
-                                amountTimes = int(args[1].split("d")[0])
-                                if amountTimes > 5:
-                                    amountTimes = 5
-                            except (IndexError, ValueError):
-                                pass
-                            try:
-                                sides = int(args[1].split("d")[1])
-                            except (IndexError, ValueError):
-                                pass
-                            
-                            for _ in range(amountTimes):
-                                damage = self.players[nick.lower()].getAttackPower(sides)
-                                self.players[who.lower()].health -= damage
-                                output.append(("{who} took {d} damage.".format(self.players[who.lower()].name,
-                                                                               d=str(damage)), 1))
-                            thanksMsg = random.choice(self.init["Choices"]["hijack-thanks"].split(self.init["Splitters"]["choices-hijack"]))
-                            thanksMsg = thanksMsg.replace(self.init["Substitutions"]["sendnick"], nick)
-                            output.append(("{who} now has {h} health points. {thanks}".format(who=self.players[who.lower()].name,
-                                                                                              h=str(self.players[who.lower()].health),
-                                                                                              thanks=thanksMsg), 0))
-        elif self.init["GameCommands"]["build"] == cmd.lower():
-            if not self.started:
-                output.append((self.init["Inform"]["hijack-notstarted"], 0))
-            else:
-                if nick.lower() in self.players:
-                    if self.players[nick.lower()].buildCharge():
-                        buildMsg = random.choice(self.init["Choices"]["hijack-buildmsg"].split(self.init["Splitters"]["choices-hijack"]))
-                        buildMsg = buildMsg.replace(self.init["Substitutions"]["sendnick"], nick)
-                        output.append((buildMsg, 0))
-                    else:
-                        output.append((self.init["Inform"]["hijack-maxcharge"], 0))
-        elif self.init["GameCommands"]["getaveragehp"] == cmd.lower():
-            if self.players:
-                output.append(("Average amount of health points across all players: {hp}".format(hp=str(self.getAverageHP())), 0))
-            else:
-                output.append((self.init["Inform"]["hijack-noplayers"], 0))
-        elif self.init["GameCommands"]["gethp"] == cmd.lower():
-            if args:
-                for who in args:
-                    if who.lower() in self.players:
-                        output.append(("{who} has {hp} health points.".format(who=self.players[who.lower()].name,
-                                                                              hp=str(self.players[who.lower()].health)), 1))
-            else:
-                if self.players:
-                    output.append(("Average amount of health points across all players: {hp}".format(hp=str(self.getAverageHP())), 0))
-                else:
-                    output.append((self.init["Inform"]["hijack-noplayers"], 0))
-        elif self.init["GameCommands"]["leave"] == cmd.lower():
-            who = []
-            hasLeft = False
-            if args:
-                who = args
-            else:
-                who = [nick]
-            for w in who:
-                if self.removePlayer(w):
-                    leftMsg = random.choice(self.init["Choices"]["hijack-leavegame"].split(self.init["Splitters"]["choices-hijack"]))
-                    leftMsg = leftMsg.replace(self.init["Substitutions"]["sendnick"], w)
-                    output.append((leftMsg, 1))
-                    hasLeft = True
-            if hasLeft:
-                output.append(("Number of people playing {g}: {num}".format(g=self.gameTitle,
-                                                                            num=str(len(self.players))), 0))
-        elif self.init["GameCommands"]["resetcharge"] == cmd.lower():
-            if args:
-                for who in args:
-                    resetMsg = ""
-                    if who.lower() in self.players:
-                        self.players[who.lower()].attackCharge = 0
-                        resetMsg = random.choice(self.init["Choices"]["hijack-resetcharge"].split(self.init["Splitters"]["choices-hijack"]))
-                        resetMsg = resetMsg.replace(self.init["Substitutions"]["sendnick"], self.players[who.lower()].name)
-                        output.append((resetMsg, 1))
-                    else:
-                        resetMsg = random.choice(self.init["Inform"]["hijack-nosuchplayer"].split(self.init["Splitters"]["choices-hijack"]))
-                        resetMsg = resetMsg.replace(self.init["Substitutions"]["sendnick"], self.players[who.lower()].name)
-                        output.append((resetMsg, 1))
-            else:
-                output.append((self.init["Inform"]["hijack-howtoresetcharge"], 0))
-        elif self.init["GameCommands"]["sethp"] == cmd.lower():
-            if args:
-                for who in args:
-                    name = who.split(self.init["Splitters"]["hijack-subparams"])[0].lower()
-                    if len(who.split(self.init["Splitters"]["hijack-subparams"])[0].lower()) > 1:
-                        try:
-                            if name in self.players:
-                                newHealth = who.split(self.init["Splitters"]["hijack-subparams"])[1]
-                                if "-" in newHealth:
-                                    newHealth = int(round(newHealth.translate(None, "-")))
-                                    self.players[name.lower()].health -= newHealth
-                                elif "+" in newHealth:
-                                    newHealth = int(round(newHealth.translate(None, "+")))
-                                    self.players[name.lower()].health += newHealth
-                                else:
-                                    self.players[name.lower()].health = newHealth
-                                output.append(("{n} now has {hp} health points.".format(n=self.players[name.lower()].name,
-                                                                                        hp=newHealth), 0))
-                        except TypeError:
-                            output.append((self.init["Inform"]["hijack-errorsethp"].replace(self.init["Substitutions"]["sendnick"], self.players[name.lower()].name), 0))
-                    else:
-                        pass
-        elif self.init["Commands"]["startplaying"] == cmd.lower():
+        if not args:
+            return output
+        splitter = self.init["Splitters"]["hijack-subparams"]
+        for a in args:
+            name = a.split(splitter)[0]
+            health = 100
             if self.started:
+                try:
+                    health = self.getAverageHP()
+                except (ValueError, ZeroDivisionError):
+                    pass
+            try:
+                health = int(a.split(splitter)[1])
+            except (IndexError, ValueError):
                 pass
+
+            added = self.addPlayer(HijackPlayer(name, health), channelUsers)
+            if "alreadyin" == added:
+                output.append((self.sub(self.init["Inform"]["hijack-playeralreadyin"], name), 1))
+            elif "nonexistent" == added:
+                output.append((self.sub(self.init["Inform"]["hijack-nonexistentplayer"], name), 1))
+            else:
+                output.append(("{nick} joined the game with {hp} health points.".format(nick=name, hp=health), 1))
+        output.append(self.countPlayers())
+
+        return output
+
+    def attack(self, nick, args, channelUsers):
+        output = []
+        if not self.started:
+            return [(self.init["Inform"]["hijack-notstarted"], 0)]
+        if not args or args[0].lower() not in self.players or nick.lower() not in self.players:
+            return output
+
+        who = self.players[args[0].lower()]
+        if who.health <= 0:
+            return [(self.choose("hijack-tryoverkill", who.name), 0)]
+
+        amountTimes = 1
+        sides = 20
+        try:
+            amountTimes = min(int(args[1].split("d")[0]), 5)
+        except (IndexError, ValueError):
+            pass
+        try:
+            sides = int(args[1].split("d")[1])
+        except (IndexError, ValueError):
+            pass
+
+        for _ in range(amountTimes):
+            damage = self.players[nick.lower()].getAttackPower(sides)
+            who.health -= damage
+            output.append(("{who} took {d} damage.".format(who=who.name, d=damage), 1))
+        output.append(("{who} now has {h} health points. {thanks}".format(who=who.name,
+                                                                          h=who.health,
+                                                                          thanks=self.choose("hijack-thanks", nick)), 0))
+
+        return output
+
+    def build(self, nick, args, channelUsers):
+        if not self.started:
+            return [(self.init["Inform"]["hijack-notstarted"], 0)]
+        if nick.lower() not in self.players:
+            return []
+        if self.players[nick.lower()].buildCharge():
+            return [(self.choose("hijack-buildmsg", nick), 0)]
+        return [(self.init["Inform"]["hijack-maxcharge"], 0)]
+
+    def averageHP(self, nick, args, channelUsers):
+        if self.players:
+            try:
+                return [("Average amount of health points across all players: {hp}".format(hp=self.getAverageHP()), 0)]
+            except ZeroDivisionError:
+                return []
+        return [(self.init["Inform"]["hijack-noplayers"], 0)]
+
+    def getHP(self, nick, args, channelUsers):
+        if not args:
+            return self.averageHP(nick, args, channelUsers)
+        output = []
+        for who in args:
+            if who.lower() in self.players:
+                output.append(("{who} has {hp} health points.".format(who=self.players[who.lower()].name,
+                                                                      hp=self.players[who.lower()].health), 1))
+
+        return output
+
+    def resetCharge(self, nick, args, channelUsers):
+        if not args:
+            return [(self.init["Inform"]["hijack-howtoresetcharge"], 0)]
+        output = []
+        for who in args:
+            if who.lower() in self.players:
+                self.players[who.lower()].attackCharge = 0
+                output.append((self.choose("hijack-resetcharge", self.players[who.lower()].name), 1))
             else:
-                self.started = True
-                output.append((self.init["Inform"]["hijack-startplaying"], 0))
-            
+                output.append((self.choose("hijack-nosuchplayer", who), 1))
+
+        return output
+
+    def setHP(self, nick, args, channelUsers):
+        output = []
+        splitter = self.init["Splitters"]["hijack-subparams"]
+        for who in args:
+            name = who.split(splitter)[0].lower()
+            if name not in self.players:
+                continue
+            player = self.players[name]
+            try:
+                newHealth = who.split(splitter)[1]
+                if newHealth.startswith("-"):
+                    player.health -= int(newHealth[1:])
+                elif newHealth.startswith("+"):
+                    player.health += int(newHealth[1:])
+                else:
+                    player.health = int(newHealth)
+                output.append(("{n} now has {hp} health points.".format(n=player.name, hp=player.health), 0))
+            except (IndexError, ValueError):
+                output.append((self.sub(self.init["Inform"]["hijack-errorsethp"], player.name), 0))
+
         return output
-                    
+
+    def startPlaying(self, nick, args, channelUsers):
+        if self.started:
+            return []
+        self.state = self.PLAYING
+
+        return [(self.init["Inform"]["hijack-startplaying"], 0)]
+
 
 class HijackPlayer(object):
     def __init__(self, name, health):
@@ -211,6 +316,15 @@ class HijackPlayer(object):
         self.health = int(health)
         self.attackCharge = 0
 
+    @classmethod
+    def fromState(cls, state):
+        player = cls(state["name"], state["health"])
+        player.attackCharge = state["attackCharge"]
+        return player
+
+    def getState(self):
+        return {"name": self.name, "health": self.health, "attackCharge": self.attackCharge}
+
     def buildCharge(self):
         if self.attackCharge < 25:
             self.attackCharge += 5
@@ -226,79 +340,127 @@ class HijackPlayer(object):
 
 ### === Hot Potato Grenade === ###
 class HotPotatoGame(Game):
-    def __init__(self):
-        Game.__init__(self, Settings().keywords["Titles"]["game-hotpotato"])
+    """ The potato goes off after a random fuse; whoever's holding it is out. Last one left wins. """
+    kind = "hotpotato"
+
+    def __init__(self, keywords=None, announce=None):
+        keywords = keywords or Settings.getKeywords()
+        Game.__init__(self, keywords["Titles"]["game-hotpotato"], keywords, announce)
+        self.playerClass = HotPotatoPlayer
         self.currentHolder = None
-        self.stopTimer = {"master": False, "single": False}
+        self.fuse = None
+        gameCommands = self.init["GameCommands"]
+        self.addCommand(gameCommands["addplayer"], self.add)
+        self.addCommand(gameCommands["leave"], self.leave)
+        self.addCommand(gameCommands["hotpotato-pass"], self.passPotato)
+        self.addCommand(self.init["Commands"]["startplaying"], self.startPlaying)
 
-    def processCommand(self, nick, msg, channelUsers):
-        self.init = Settings().keywords
-        self.gameTitle = self.init["Titles"]["game-hotpotato"]
+    def add(self, nick, args, channelUsers):
         output = []
-        
-        msg = msg.strip()
-        cmd = msg.split(" ")[0]
-        args = []
-        if len(msg.split(" ")) > 1:
-            args = msg.split(" ")
-            args.remove(args[0])
-
-        if self.init["GameCommands"]["addPlayer"].lower() == cmd.lower():
-            if args:
-                for arg in args:
-                    if "alreadyin" == self.addPlayer(HotPotatoPlayer(arg,), channelUsers):
-                        output.append((self.init["Inform"]["hijack-playeralreadyin"].replace(self.init["Substitutions"]["sendnick"], name), 1))
-                    elif "nonexistent" == self.addPlayer(HijackPlayer(name, health), channelUsers):
-                        nopeMsg = self.init["Inform"]["hotpotato-nonexistentplayer"]
-                        nopeMsg = nopeMsg.replace(self.init["Substitutions"]["sendnick"], name)
-                        output.append((nopeMsg, 1))
-                    else:
-                        output.append(("{nick} joined the game.".format(nick=name,), 1))
-        elif self.init["GameCommands"]["leave"].lower() == cmd.lower():
-            who = []
-            hasLeft = False
-            if args:
-                who = args
+        for name in args or [nick]:
+            added = self.addPlayer(HotPotatoPlayer(name), channelUsers)
+            if "alreadyin" == added:
+                output.append((self.sub(self.init["Inform"]["hijack-playeralreadyin"], name), 1))
+            elif "nonexistent" == added:
+                output.append((self.sub(self.init["Inform"]["hotpotato-nonexistentplayer"], name), 1))
             else:
-                who = [nick]
-            for w in who:
-                if self.removePlayer(w):
-                    leftMsg = random.choice(self.init["Choices"]["hijack-leavegame"].split(self.init["Splitters"]["choices-hijack"]))
-                    leftMsg = leftMsg.replace(self.init["Substitutions"]["sendnick"], w)
-                    output.append((leftMsg, 1))
-                    hasLeft = True
-            if hasLeft:
-                output.append(("Number of people playing {g}: {num}".format(g=self.gameTitle,
-                                                                            num=str(len(self.players))), 0))
-        elif self.init["Commands"]["startplaying"].lower() == cmd.lower():
-            if self.started:
-                pass
-            elif self.players:
-                self.started = True
-                self.currentHolder = random.choice(list(self.players.values()))
-                output.append((self.init["Inform"]["hotpotato-startplaying"], 1))
-                output.append((self.init["Choices"]["hotpotato-startpass"].replace(self.init["Substitutions"]["sendNick"], self.currentHolder.name), 0))
-            else:
-                ## No one's playing.
-                pass
+                output.append(("{nick} joined the game.".format(nick=name), 1))
+        output.append(self.countPlayers())
+
+        return output
+
+    def startPlaying(self, nick, args, channelUsers):
+        if self.started:
+            return []
+        if len(self.players) < 2:
+            return [(self.init["Inform"]["hotpotato-needplayers"], 0)]
+        self.state = self.PLAYING
+        self.currentHolder = random.choice(list(self.players.values()))
+        self.lightFuse()
+
+        return [(self.init["Inform"]["hotpotato-startplaying"], 1),
+                (self.choose("hotpotato-startpass", self.currentHolder.name), 0)]
+
+    def getState(self):
+        state = Game.getState(self)
+        if self.currentHolder:
+            state["holder"] = self.currentHolder.name
+        return state
+
+    def setState(self, state):
+        Game.setState(self, state)
+        with self.lock:
+            self.currentHolder = self.players.get(state.get("holder", "").lower())
+            if self.started and self.currentHolder:
+                ## How long the old fuse had left is lost; light a new one.
+                self.lightFuse()
+            elif self.started:
+                self.stop()
+
+    def lightFuse(self):
+        if self.fuse:
+            self.fuse.cancel()
+        games = self.init.get("Games", {})
+        seconds = random.uniform(float(games.get("hotpotato-minfuse", 10)), float(games.get("hotpotato-maxfuse", 30)))
+        self.fuse = self.schedule(seconds, self.explode)
+
+    def passPotato(self, nick, args, channelUsers):
+        if not self.started:
+            return [(self.init["Inform"]["hotpotato-notstarted"], 0)]
+        if nick.lower() != self.currentHolder.name.lower():
+            return [(self.sub(self.init["Inform"]["hotpotato-notholder"], nick), 0)]
+        if not args or args[0].lower() not in self.players or args[0].lower() == nick.lower():
+            return [(self.init["Inform"]["hotpotato-howtopass"], 0)]
+        self.currentHolder = self.players[args[0].lower()]
+
+        return [(self.choose("hotpotato-pass", self.currentHolder.name), 0)]
+
+    def explode(self):
+        loser = self.currentHolder
+        output = [("Boom.", 1), ("Bye, {nick}".format(nick=loser.name), 0)]
+        Game.dropPlayer(self, loser.name)
+        if len(self.players) <= 1:
+            if self.players:
+                winner = list(self.players.values())[0]
+                output.append((self.sub(self.init["Inform"]["hotpotato-winner"], winner.name), 0))
+            self.stop()
+            return output
 
-        elif self.init["GameCommands"]["hotpotato-pass"].lower() == cmd.lower():
-            if 1 <= len(args):
-                if args[0].lower() in self.players:
-                    self.currentHolder = self.players[args[0].lower()]
-                
-    def timer(seconds, whichTimer):
+        self.currentHolder = random.choice(list(self.players.values()))
+        output.append((self.choose("hotpotato-startpass", self.currentHolder.name), 0))
+        self.lightFuse()
+
+        return output
+
+    def dropPlayer(self, playerName):
         output = []
-        while 0 < seconds:
-            if self.stopTimer[whichTimer]:
-                return
-            pass
+        with self.lock:
+            if not Game.dropPlayer(self, playerName)[0]:
+                return False, output
+            if self.started and self.currentHolder and playerName.lower() == self.currentHolder.name.lower():
+                ## Leaving doesn't take the potato with you.
+                if self.players:
+                    self.currentHolder = random.choice(list(self.players.values()))
+                    output.append((self.choose("hotpotato-startpass", self.currentHolder.name), 0))
+            if self.started and len(self.players) <= 1:
+                if self.players:
+                    winner = list(self.players.values())[0]
+                    output.append((self.sub(self.init["Inform"]["hotpotato-winner"], winner.name), 0))
+                self.stop()
+
+        return True, output
 
-        output.append(("Boom.", 1))
-        output.append(("Bye, {nick}".format(nick=self.currentHolder.name), 0))
-        self.removePlayer(self.currentHolder.name)
 
-        
 class HotPotatoPlayer(object):
     def __init__(self, name):
         self.name = name
+
+    @classmethod
+    def fromState(cls, state):
+        return cls(state["name"])
+
+    def getState(self):
+        return {"name": self.name}
+
+
+gameClasses = dict((g.kind, g) for g in (HijackGame, HotPotatoGame))